@@ -0,0 +1,226 @@
+import itertools
+import logging
+import time
+
+from aria2_rpc import RPC_TIMEOUT, check_rpc, new_rpc_session, send_batch, size_options
+from onedrive_downloader import folderPath
+
+logger = logging.getLogger(__name__)
+
+# 分配策略：剩余字节最少、轮询、按权重
+POLICIES = ('least_bytes', 'round_robin', 'weighted')
+DEFAULT_POLICY = 'least_bytes'
+
+# 不可用的端点至少隔多久重新检查一次（秒）
+HEALTH_INTERVAL = 30
+
+# 检查端点时最多读取多少个等待中的任务来估算剩余字节
+LOAD_WINDOW = 1000
+
+LOAD_KEYS = ['totalLength', 'completedLength']
+
+
+def endpoints_from_config(config):
+    """从配置中读取端点列表
+
+    配置中有 endpoints 时使用其中的 [{"rpc", "secret", "weight"}]，
+    否则把 rpc/secret 作为唯一的端点。
+    """
+    endpoints = config.get('endpoints') or [config]
+    return [
+        {
+            'rpc': endpoint['rpc'],
+            'secret': endpoint.get('secret', ''),
+            'weight': max(1, int(endpoint.get('weight', 1))),
+        }
+        for endpoint in endpoints
+    ]
+
+
+class Endpoint:
+    """池中的一个aria2端点及其状态"""
+
+    def __init__(self, rpc, secret='', weight=1):
+        self.config = {'rpc': rpc, 'secret': secret}
+        self.weight = weight
+        self.session = new_rpc_session()
+        self.healthy = False
+        self.error = None
+        self.checked_at = None
+        # 估算的未完成字节数：检查时从aria2读取，之后加上新分配的文件大小
+        self.outstanding = 0
+        # 平滑加权轮询的当前值
+        self.current = 0
+        # aria2 全局的下载目录，保留文件夹结构时在其下创建子目录
+        self.base_dir = None
+
+    @property
+    def rpc(self):
+        return self.config['rpc']
+
+    def check(self):
+        """检查连通性和密码，并读取当前未完成的字节数和下载目录"""
+        self.checked_at = time.monotonic()
+        self.error = check_rpc(self.config, self.session)
+        if self.error is None:
+            token = [f'token:{self.config["secret"]}'] if self.config['secret'] else []
+            calls = [
+                {'methodName': 'aria2.getVersion', 'params': token},
+                {'methodName': 'aria2.tellActive', 'params': token + [LOAD_KEYS]},
+                {'methodName': 'aria2.tellWaiting', 'params': token + [0, LOAD_WINDOW, LOAD_KEYS]},
+                {'methodName': 'aria2.getGlobalOption', 'params': token},
+            ]
+            data = {
+                'jsonrpc': '2.0',
+                'method': 'system.multicall',
+                'id': 'check',
+                'params': [calls]
+            }
+            try:
+                response = self.session.post(self.rpc, json=data, timeout=RPC_TIMEOUT)
+                result = response.json()
+                if 'error' in result:
+                    error_msg = str(result['error'].get('message', '未知错误'))
+                    self.error = 'RPC密码错误' if 'Unauthorized' in error_msg else error_msg
+                else:
+                    replies = result.get('result', [])
+                    if not replies or not isinstance(replies[0], list):
+                        self.error = 'RPC密码错误'
+                    else:
+                        self.outstanding = sum(
+                            int(task.get('totalLength') or 0) - int(task.get('completedLength') or 0)
+                            for reply in replies[1:3] if isinstance(reply, list)
+                            for task in reply[0]
+                        )
+                        if len(replies) > 3 and isinstance(replies[3], list):
+                            self.base_dir = replies[3][0].get('dir')
+            except Exception as e:
+                self.error = str(e)
+        self.healthy = self.error is None
+        return self.healthy
+
+    def close(self):
+        self.session.close()
+
+
+class Aria2Pool:
+    """把推送任务分配到多个aria2端点
+
+    policy 为 least_bytes 时分给（按权重折算后）未完成字节最少的端点，
+    round_robin 时依次轮流，weighted 时按权重平滑轮询。某个端点推送失败
+    且重新检查仍不可用时，将其标记为不可用，这批任务改投其他端点；
+    不可用的端点每隔 HEALTH_INTERVAL 秒重新检查一次。
+
+    每个任务按文件大小附加 profiles 中对应档位的下载参数；keep_folders
+    为 True 时在端点的下载目录下按分享中的文件夹结构保存。
+    """
+
+    def __init__(self, config, policy=None):
+        self.endpoints = [
+            Endpoint(endpoint['rpc'], endpoint['secret'], endpoint['weight'])
+            for endpoint in endpoints_from_config(config)
+        ]
+        self.policy = policy or config.get('policy') or DEFAULT_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"未知的分配策略: {self.policy}，可选: {', '.join(POLICIES)}")
+        self._rr = itertools.count()
+        self.profiles = config.get('profiles')
+        self.keep_folders = config.get('keep_folders', True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def check(self):
+        """检查所有端点，全部不可用时返回错误信息，否则返回 None"""
+        for endpoint in self.endpoints:
+            if not endpoint.check():
+                logger.warning("Aria2端点不可用 | %s | 错误信息: %s", endpoint.rpc, endpoint.error)
+        if any(endpoint.healthy for endpoint in self.endpoints):
+            return None
+        errors = {endpoint.error for endpoint in self.endpoints}
+        return errors.pop() if len(errors) == 1 else '所有Aria2端点均不可用'
+
+    def _healthy(self):
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if endpoint.healthy:
+                continue
+            if endpoint.checked_at is None or now - endpoint.checked_at >= HEALTH_INTERVAL:
+                if endpoint.check():
+                    logger.info("Aria2端点已恢复 | %s", endpoint.rpc)
+        return [endpoint for endpoint in self.endpoints if endpoint.healthy]
+
+    def _pick(self, candidates):
+        if self.policy == 'round_robin':
+            return candidates[next(self._rr) % len(candidates)]
+        if self.policy == 'weighted':
+            # 平滑加权轮询：权重大的端点更常被选中，但不会连续扎堆
+            total = sum(endpoint.weight for endpoint in candidates)
+            for endpoint in candidates:
+                endpoint.current += endpoint.weight
+            chosen = max(candidates, key=lambda endpoint: endpoint.current)
+            chosen.current -= total
+            return chosen
+        return min(candidates, key=lambda endpoint: endpoint.outstanding / endpoint.weight)
+
+    def options(self, endpoint, name, size, folder=None):
+        """某个任务在指定端点上的aria2下载参数"""
+        options = size_options(size, self.profiles)
+        subdir = folderPath(folder) if self.keep_folders else ''
+        if subdir:
+            if endpoint.base_dir:
+                options['dir'] = endpoint.base_dir.rstrip('/\\') + '/' + subdir
+            else:
+                # 读不到下载目录时用带子目录的文件名，aria2 会自动创建目录
+                options['out'] = subdir + '/' + name
+        return options
+
+    def send(self, items):
+        """推送 [(文件名, 直链, 大小)] 或 [(文件名, 直链, 大小, 文件夹ID)]
+
+        返回与 items 一一对应的结果，成功为 {'result': GID, 'endpoint': 端点配置}，
+        失败为 {'error': {'message': ...}}。
+        """
+        results = [None] * len(items)
+        pending = list(range(len(items)))
+        while pending:
+            candidates = self._healthy()
+            if not candidates:
+                for i in pending:
+                    results[i] = {'error': {'message': '没有可用的Aria2端点'}}
+                break
+            groups = {}
+            for i in pending:
+                endpoint = self._pick(candidates)
+                endpoint.outstanding += items[i][2] or 0
+                groups.setdefault(endpoint, []).append(i)
+
+            pending = []
+            for endpoint, indexes in groups.items():
+                calls = []
+                for i in indexes:
+                    name, url, size, *folder = items[i]
+                    calls.append((name, url, self.options(endpoint, name, size, *folder)))
+                batch = send_batch(calls, endpoint.config, endpoint.session, probe=False)
+                rechecked = all('error' in result for result in batch)
+                if rechecked and not endpoint.check():
+                    # 端点已不可用，这批任务改投其他端点
+                    logger.warning("Aria2端点不可用，改投其他端点 | %s | 错误信息: %s", endpoint.rpc, endpoint.error)
+                    pending.extend(indexes)
+                    continue
+                for i, result in zip(indexes, batch):
+                    if 'result' in result:
+                        result['endpoint'] = endpoint.config
+                    elif not rechecked:
+                        # 重新检查时已从aria2读回实际的剩余字节，无需再扣除
+                        endpoint.outstanding -= items[i][2] or 0
+                    results[i] = result
+            pending.sort()
+        return results
+
+    def close(self):
+        for endpoint in self.endpoints:
+            endpoint.close()
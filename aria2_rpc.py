@@ -0,0 +1,155 @@
+import requests
+
+# 每次 system.multicall 合并的 addUri 调用数
+MULTICALL_BATCH = 100
+
+# RPC请求超时（秒）
+RPC_TIMEOUT = 10
+
+# 按文件大小选择的aria2下载参数，依次匹配第一个 max_size 不小于文件大小的档位，
+# max_size 为 None 表示不限。可在配置文件的 profiles 中覆盖。
+DEFAULT_PROFILES = [
+    # 小文件单连接即可，多开连接只会浪费握手时间
+    {'max_size': '20M', 'options': {'split': '1', 'max-connection-per-server': '1'}},
+    {'max_size': '1G', 'options': {
+        'split': '8', 'max-connection-per-server': '8', 'min-split-size': '20M'
+    }},
+    {'max_size': None, 'options': {
+        'split': '16', 'max-connection-per-server': '16', 'min-split-size': '64M'
+    }},
+]
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def new_rpc_session(pool_size=4):
+    """创建用于aria2 RPC的会话，多次请求复用同一个连接"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def check_rpc(config, session=None):
+    """检查RPC地址格式和连通性，返回错误信息；正常时返回 None"""
+    server_url = config['rpc']
+    if not server_url.startswith(('http://', 'https://')):
+        return 'RPC地址格式错误，必须以http://或https://开头，以/jsonrpc结尾'
+    if not server_url.endswith('/jsonrpc'):
+        return 'RPC地址格式错误，必须以/jsonrpc结尾'
+
+    # 发送一个不带token的测试请求
+    test_data = {
+        'jsonrpc': '2.0',
+        'method': 'aria2.getVersion',
+        'id': 1,
+        'params': []
+    }
+    try:
+        test_response = (session or requests).post(server_url, json=test_data, timeout=RPC_TIMEOUT)
+        test_result = test_response.json()
+        if 'error' in test_result and 'Unauthorized' in str(test_result.get('error', {}).get('message', '')):
+            if not config['secret']:
+                return '服务端需要密码验证'
+    except requests.exceptions.ConnectionError:
+        return 'RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动'
+    except requests.exceptions.Timeout:
+        return 'RPC地址连接超时，请检查地址是否正确'
+    except Exception:
+        pass  # 忽略其他错误，继续执行
+    return None
+
+
+def parse_size(value):
+    """解析 1048576、'20M'、'1.5G' 形式的大小，None 表示不限"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().upper().rstrip('B')
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(float(value))
+
+
+def size_options(size, profiles=None):
+    """按文件大小选择aria2下载参数"""
+    for profile in profiles or DEFAULT_PROFILES:
+        limit = parse_size(profile.get('max_size'))
+        if limit is None or (size or 0) <= limit:
+            # aria2 的选项值必须是字符串
+            return {key: str(value) for key, value in profile.get('options', {}).items()}
+    return {}
+
+
+def build_add_uri(name, url, config, options=None):
+    """构建一个 aria2.addUri 调用的参数，options 为附加的aria2下载参数"""
+    params = [[url], {'out': name, **(options or {})}]
+    if config['secret']:
+        params.insert(0, f'token:{config["secret"]}')
+    return params
+
+
+def send_batch(items, config, session=None, probe=True):
+    """通过 system.multicall 批量推送任务
+
+    items 为 [(文件名, 直链)] 或 [(文件名, 直链, aria2下载参数)]，每 MULTICALL_BATCH 个任务合并成一次请求，
+    所有请求复用同一个会话。连通性和密码只在开始时检查一次。返回与
+    items 一一对应的结果，成功为 {'result': GID}，失败为 {'error': {'message': ...}}。
+    """
+    if not items:
+        return []
+    own_session = session is None
+    if own_session:
+        session = new_rpc_session()
+    try:
+        if probe:
+            error_msg = check_rpc(config, session)
+            if error_msg:
+                return [{'error': {'message': error_msg}} for _ in items]
+
+        results = []
+        for start in range(0, len(items), MULTICALL_BATCH):
+            chunk = items[start:start + MULTICALL_BATCH]
+            calls = [
+                {'methodName': 'aria2.addUri', 'params': build_add_uri(name, url, config, *options)}
+                for name, url, *options in chunk
+            ]
+            data = {
+                'jsonrpc': '2.0',
+                'method': 'system.multicall',
+                'id': start,
+                'params': [calls]
+            }
+            try:
+                response = session.post(config['rpc'], json=data, timeout=RPC_TIMEOUT)
+                result = response.json()
+            except Exception as e:
+                results.extend({'error': {'message': str(e)}} for _ in chunk)
+                continue
+
+            if 'error' in result:
+                # 整个请求失败，例如密码错误
+                error_msg = str(result['error'].get('message', '未知错误'))
+                if 'Unauthorized' in error_msg:
+                    error_msg = 'RPC密码错误'
+                results.extend({'error': {'message': error_msg}} for _ in chunk)
+                continue
+
+            for item_result in result.get('result', []):
+                # 成功时为 [GID]，失败时为 {'code': ..., 'message': ...}
+                if isinstance(item_result, list) and item_result:
+                    results.append({'result': item_result[0]})
+                else:
+                    error_msg = str(item_result.get('message', '未知错误'))
+                    if 'Unauthorized' in error_msg:
+                        error_msg = 'RPC密码错误'
+                    results.append({'error': {'message': error_msg}})
+            # 返回条数不足时补齐，保证与输入一一对应
+            missing = start + len(chunk) - len(results)
+            results.extend({'error': {'message': '未收到返回结果'}} for _ in range(missing))
+        return results
+    finally:
+        if own_session:
+            session.close()
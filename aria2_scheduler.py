@@ -0,0 +1,216 @@
+import logging
+import threading
+
+from aria2_rpc import RPC_TIMEOUT
+from aria2_status import PollerGroup
+from onedrive_downloader import LINK_REFRESH_MARGIN, LINK_TTL
+
+logger = logging.getLogger(__name__)
+
+# 推送顺序：列表顺序、小文件优先、大文件优先、大小交错
+POLICIES = ('listing', 'smallest', 'largest', 'interleave')
+DEFAULT_POLICY = 'listing'
+
+# 每批推送的最大文件数，推送前刷新这一批中即将过期的直链
+WAVE_SIZE = 200
+
+# 调整队列顺序时读取的等待队列最大条数
+REORDER_WINDOW = 1000
+
+
+def recordSize(record):
+    return record.get('size') or 0
+
+
+def order_records(records, policy=DEFAULT_POLICY, size=recordSize):
+    """按推送策略排序文件记录，返回新列表
+
+    smallest 让完成的文件数尽快增长，largest 让大文件尽早开始以缩短总
+    耗时，interleave 交替取最大和最小的文件，避免大文件扎堆占满连接。
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"未知的推送顺序: {policy}，可选: {', '.join(POLICIES)}")
+    if policy == 'listing':
+        return list(records)
+    ordered = sorted(records, key=size)
+    if policy == 'smallest':
+        return ordered
+    if policy == 'largest':
+        return ordered[::-1]
+    interleaved = []
+    low, high = 0, len(ordered) - 1
+    while low <= high:
+        interleaved.append(ordered[high])
+        if low != high:
+            interleaved.append(ordered[low])
+        low, high = low + 1, high - 1
+    return interleaved
+
+
+class SubmissionScheduler:
+    """按策略分批把文件推送到aria2端点池
+
+    文件先按 policy 排序，再按 WAVE_SIZE 分批推送，每批推送前刷新其中
+    即将过期的直链。每批推送后用 aria2.changePosition 把本次推送、仍在
+    等待的任务在各端点的队列中按策略连续排好，其他任务的相对顺序不变。
+
+    hold_back 为 True 时还会按直链有效期控制队列深度：根据已推送任务的
+    实际下载速度，估算直链过期前能下载完的字节数，队列中未完成的字节超过
+    这个值时暂缓推送下一批，等队列消化后再刷新直链继续推送，避免任务在
+    aria2队列里等到直链过期。此时需要保持程序运行直到全部推送完成。
+    """
+
+    def __init__(self, pool, policy=DEFAULT_POLICY, resolver=None, hold_back=False,
+                 wave_size=WAVE_SIZE, ttl=LINK_TTL, margin=LINK_REFRESH_MARGIN):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的推送顺序: {policy}，可选: {', '.join(POLICIES)}")
+        self.pool = pool
+        self.policy = policy
+        self.resolver = resolver
+        self.hold_back = hold_back
+        self.wave_size = max(1, int(wave_size))
+        # 直链从获取到过期的可用时间（秒）
+        self.budget_time = max(ttl - margin, 60)
+        self.poller = PollerGroup()
+        # 端点RPC地址 -> 本次推送的 {GID: 大小}
+        self._pushed = {}
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """在当前这一批推送完成后停止，未推送的记录结果为 None"""
+        self._cancelled.set()
+        self.poller.stop()
+
+    def submit(self, records, on_result=None):
+        """推送全部记录，返回与 records 一一对应的结果（取消后未推送的为 None）
+
+        每批推送后对其中每条记录调用 on_result(record, result)。
+        """
+        results = [None] * len(records)
+        order = order_records(range(len(records)), self.policy, lambda i: recordSize(records[i]))
+        position = 0
+        while position < len(order) and not self._cancelled.is_set():
+            limit = self._waveLimit()
+            if self._cancelled.is_set():
+                break
+            wave = []
+            wave_bytes = 0
+            while position < len(order) and len(wave) < self.wave_size:
+                size = recordSize(records[order[position]])
+                if wave and limit is not None and wave_bytes + size > limit:
+                    break
+                wave.append(order[position])
+                wave_bytes += size
+                position += 1
+
+            wave_records = [records[i] for i in wave]
+            self._refresh(wave_records)
+            wave_results = self.pool.send([
+                (record['name'].strip(), record['raw_url'].strip(), recordSize(record), record.get('folder'))
+                for record in wave_records
+            ])
+            for i, record, result in zip(wave, wave_records, wave_results):
+                results[i] = result
+                if 'result' in result:
+                    endpoint = result['endpoint']
+                    self._pushed.setdefault(endpoint['rpc'], {})[result['result']] = recordSize(record)
+                    self.poller.track([result['result']], endpoint)
+                if on_result is not None:
+                    on_result(record, result)
+            self.reorder()
+        return results
+
+    def _refresh(self, records):
+        if self.resolver is None:
+            return
+        try:
+            self.resolver.refresh(records)
+        except Exception as e:
+            logger.warning("刷新直链失败，将使用原有直链: %s", e)
+
+    def _waveLimit(self):
+        """下一批最多推送的字节数；不限制时返回 None
+
+        只有开启 hold_back 且已有推送任务时才限制：队列中未完成的字节
+        不超过“当前速度 × 直链可用时间”，速度未知时等待任务开始下载。
+        """
+        if not self.hold_back or not self.poller.pollers:
+            return None
+        while True:
+            try:
+                summary = self.poller.poll()
+            except Exception as e:
+                logger.warning("获取下载进度失败，不再按直链有效期分批: %s", e)
+                self.hold_back = False
+                return None
+            remaining = 0
+            for rpc, gids in self._pushed.items():
+                poller = self.poller.pollers[rpc]
+                for gid, size in gids.items():
+                    status = poller.status(gid)
+                    if status is None:
+                        remaining += size
+                    elif status['status'] not in ('complete', 'error', 'removed'):
+                        remaining += max(status['total'] or size, status['completed']) - status['completed']
+            if remaining == 0:
+                return None
+            budget = summary['speed'] * self.budget_time
+            # 队列消化到一半以下再补一批，避免每次只推送一两个文件
+            if remaining * 2 <= budget:
+                return budget - remaining
+            # 等待下一次轮询，收到aria2的任务通知或取消时提前结束
+            self.poller.wait()
+            if self._cancelled.is_set():
+                return None
+
+    def reorder(self):
+        """在各端点的等待队列中按策略重排本次推送的任务"""
+        if self.policy == 'listing':
+            return
+        for endpoint in self.pool.endpoints:
+            pushed = self._pushed.get(endpoint.rpc)
+            if not pushed or not endpoint.healthy:
+                continue
+            try:
+                self._reorderEndpoint(endpoint, pushed)
+            except Exception as e:
+                logger.warning("调整Aria2队列顺序失败 | %s | 错误信息: %s", endpoint.rpc, e)
+
+    def _reorderEndpoint(self, endpoint, pushed):
+        token = [f'token:{endpoint.config["secret"]}'] if endpoint.config['secret'] else []
+        data = {
+            'jsonrpc': '2.0',
+            'method': 'aria2.tellWaiting',
+            'id': 'reorder',
+            'params': token + [0, REORDER_WINDOW, ['gid']]
+        }
+        response = endpoint.session.post(endpoint.rpc, json=data, timeout=RPC_TIMEOUT)
+        queue = [task['gid'] for task in response.json().get('result', [])]
+        own = [gid for gid in queue if gid in pushed]
+        if len(own) < 2:
+            return
+        # 本次推送的任务按策略排好，从其中最靠前的位置开始连续排列
+        target = order_records(own, self.policy, pushed.get)
+        base = queue.index(own[0])
+        calls = []
+        for offset, gid in enumerate(target):
+            current = queue.index(gid, base)
+            if current == base + offset:
+                continue
+            queue.insert(base + offset, queue.pop(current))
+            calls.append({
+                'methodName': 'aria2.changePosition',
+                'params': token + [gid, base + offset, 'POS_SET']
+            })
+        if not calls:
+            return
+        data = {
+            'jsonrpc': '2.0',
+            'method': 'system.multicall',
+            'id': 'reorder',
+            'params': [calls]
+        }
+        endpoint.session.post(endpoint.rpc, json=data, timeout=RPC_TIMEOUT)
+
+    def close(self):
+        self.poller.close()
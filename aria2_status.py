@@ -0,0 +1,411 @@
+import itertools
+import logging
+import threading
+from collections import deque
+
+from aria2_rpc import RPC_TIMEOUT, new_rpc_session
+from aria2_ws import Aria2WebSocket, Aria2WebSocketError
+
+logger = logging.getLogger(__name__)
+
+# 轮询间隔的上下限（秒）：有进度变化时用下限，空闲时逐步放宽到上限
+MIN_INTERVAL = 0.5
+MAX_INTERVAL = 5.0
+BACKOFF = 1.5
+
+# 每次轮询读取的等待队列和已停止列表的最大条数
+WINDOW = 100
+
+# 每次轮询额外单独查询的“未出现在上述列表中”的任务数
+PROBE_COUNT = 20
+
+# 只读取需要的字段，避免返回文件列表、服务器列表等大字段
+STATUS_KEYS = [
+    'gid', 'status', 'totalLength', 'completedLength', 'downloadSpeed',
+    'errorCode', 'errorMessage',
+]
+
+FINISHED = ('complete', 'error', 'removed')
+
+
+def _parseStatus(entry):
+    total = int(entry.get('totalLength') or 0)
+    completed = int(entry.get('completedLength') or 0)
+    speed = int(entry.get('downloadSpeed') or 0)
+    status = {
+        'gid': entry.get('gid'),
+        'status': entry.get('status', 'unknown'),
+        'total': total,
+        'completed': completed,
+        'speed': speed,
+        'eta': (total - completed) / speed if speed and total > completed else None,
+        'error': None,
+    }
+    if status['status'] == 'error':
+        status['error'] = entry.get('errorMessage') or f"错误码 {entry.get('errorCode')}"
+    return status
+
+
+def _notFound(error):
+    """multicall 中某个调用的错误对象是否表示GID不存在"""
+    return isinstance(error, dict) and 'not found' in str(error.get('message', '')).lower()
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def format_status(status):
+    """把单个任务的状态转换为用于显示的文字"""
+    if status is None:
+        return "已成功推送到Aria2"
+    state = status['status']
+    if state == 'complete':
+        return "已完成"
+    if state == 'error':
+        return f"失败: {status['error']}"
+    if state == 'removed':
+        return "已移除"
+    if state == 'paused':
+        return "已暂停"
+    if state == 'waiting':
+        return "等待中"
+    percent = status['completed'] * 100 / status['total'] if status['total'] else 0
+    speed_mb = status['speed'] / 1024 / 1024
+    return f"下载中 {percent:.1f}% {speed_mb:.2f}MB/s 剩余 {format_duration(status['eta'])}"
+
+
+class _PollLoop:
+    """按当前间隔反复调用 poll() 的循环"""
+
+    def __init__(self):
+        self._stopped = False
+        # 收到aria2推送的通知或 stop() 时提前结束等待
+        self.wake = threading.Event()
+
+    def stop(self):
+        self._stopped = True
+        self.wake.set()
+
+    def wait(self):
+        """等到下一次轮询：最长 interval 秒，收到任务状态变化的通知时立即返回"""
+        self.wake.wait(self.interval)
+        self.wake.clear()
+
+    def run(self, on_update=None, until_done=True):
+        """持续轮询，每次轮询后调用 on_update(汇总信息)，直到全部结束或 stop()"""
+        self._stopped = False
+        while not self._stopped:
+            summary = self.poll()
+            if on_update is not None:
+                on_update(summary)
+            if until_done and summary['done']:
+                return summary
+            self.wait()
+
+
+class Aria2Poller(_PollLoop):
+    """批量轮询已推送任务的下载进度
+
+    每次轮询只发一个 system.multicall 请求，内含 getGlobalStat、tellActive、
+    以及各取最多 WINDOW 条的 tellWaiting 和 tellStopped，均带 keys 只取必要
+    字段；不在这些列表中的已跟踪任务每次轮流单独查询 PROBE_COUNT 个。
+    因此每次轮询的开销与排队任务总数无关。
+
+    有进度变化时按 min_interval 轮询，没有变化时逐步放宽到 max_interval。
+
+    push 为 True 时优先通过aria2的WebSocket接口发送请求，并订阅下载开始、
+    完成、出错等通知，跟踪的任务状态变化时 wait() 立即返回，不必等到下一
+    个轮询间隔；连接不上或连接断开时改用HTTP轮询。
+    """
+
+    def __init__(self, config, session=None, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, window=WINDOW, push=True, wake=None):
+        super().__init__()
+        if wake is not None:
+            self.wake = wake
+        self.push = push
+        self._ws = None
+        self.config = config
+        self.session = session if session is not None else new_rpc_session()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.window = window
+        self.interval = min_interval
+        # GID -> 最近一次的状态，尚未查询到时为 None
+        self.tasks = {}
+        self.global_stat = {}
+        self._unseen = deque()
+        self._queued = set()
+
+    def track(self, gids):
+        """开始跟踪一批GID"""
+        for gid in gids:
+            if gid not in self.tasks:
+                self.tasks[gid] = None
+                self._enqueue(gid)
+
+    def _enqueue(self, gid):
+        if gid not in self._queued:
+            self._queued.add(gid)
+            self._unseen.append(gid)
+
+    def _params(self, *params):
+        if self.config['secret']:
+            return [f'token:{self.config["secret"]}', *params]
+        return list(params)
+
+    def _connectPush(self):
+        if self._ws is not None and self._ws.closed.is_set():
+            logger.info("Aria2 WebSocket连接已断开，改用HTTP轮询 | %s", self.config['rpc'])
+            self._closePush()
+            self.push = False
+        if not self.push or self._ws is not None:
+            return
+        ws = Aria2WebSocket(self.config, timeout=RPC_TIMEOUT)
+        ws.on('*', self._notified)
+        try:
+            self._ws = ws.connect()
+        except (OSError, Aria2WebSocketError) as e:
+            logger.debug("Aria2 WebSocket不可用，使用HTTP轮询 | %s | %s", self.config['rpc'], e)
+            self.push = False
+
+    def _closePush(self):
+        if self._ws is not None:
+            self._ws.close()
+            self._ws = None
+
+    def _notified(self, event, gid):
+        # 在WebSocket的读取线程中调用
+        if gid in self.tasks:
+            self.wake.set()
+
+    def _multicall(self, calls):
+        """发送 system.multicall 并返回各调用的结果"""
+        self._connectPush()
+        if self._ws is not None:
+            try:
+                return self._ws.call('system.multicall', calls, timeout=RPC_TIMEOUT)
+            except Aria2WebSocketError as e:
+                # 连接问题或RPC错误都交给下面的HTTP请求处理，由它报告错误
+                logger.debug("通过WebSocket查询进度失败，改用HTTP | %s | %s", self.config['rpc'], e)
+                self._closePush()
+                self.push = False
+        data = {
+            'jsonrpc': '2.0',
+            'method': 'system.multicall',
+            'id': 'status',
+            'params': [calls]
+        }
+        response = self.session.post(self.config['rpc'], json=data, timeout=RPC_TIMEOUT)
+        result = response.json()
+        if 'error' in result:
+            error_msg = str(result['error'].get('message', '未知错误'))
+            if 'Unauthorized' in error_msg:
+                error_msg = 'RPC密码错误'
+            raise RuntimeError(error_msg)
+        return result.get('result', [])
+
+    def poll(self):
+        """轮询一次，更新各任务状态并返回汇总信息"""
+        probes = []
+        while self._unseen and len(probes) < PROBE_COUNT:
+            gid = self._unseen.popleft()
+            self._queued.discard(gid)
+            status = self.tasks.get(gid)
+            if status is None or status['status'] not in FINISHED:
+                probes.append(gid)
+        calls = [
+            {'methodName': 'aria2.getGlobalStat', 'params': self._params()},
+            {'methodName': 'aria2.tellActive', 'params': self._params(STATUS_KEYS)},
+            {'methodName': 'aria2.tellWaiting', 'params': self._params(0, self.window, STATUS_KEYS)},
+            {'methodName': 'aria2.tellStopped', 'params': self._params(-1, self.window, STATUS_KEYS)},
+        ]
+        calls.extend(
+            {'methodName': 'aria2.tellStatus', 'params': self._params(gid, STATUS_KEYS)}
+            for gid in probes
+        )
+        replies = self._multicall(calls)
+        if replies and isinstance(replies[0], list):
+            self.global_stat = replies[0][0]
+        seen = set()
+        changed = False
+        for reply in replies[1:]:
+            # 成功时为 [结果]，失败（例如GID已被清除）时为错误对象
+            if not isinstance(reply, list):
+                continue
+            entries = reply[0] if isinstance(reply[0], list) else [reply[0]]
+            for entry in entries:
+                gid = entry.get('gid')
+                if gid not in self.tasks or gid in seen:
+                    continue
+                seen.add(gid)
+                status = _parseStatus(entry)
+                old = self.tasks[gid]
+                if old is None or (old['status'], old['completed']) != (status['status'], status['completed']):
+                    changed = True
+                self.tasks[gid] = status
+
+        # aria2 只保留有限条已停止任务的结果（max-download-result），被清除的
+        # 任务查询时返回“GID ... is not found”，按已移除处理，不再等待
+        for gid, reply in zip(probes, replies[4:]):
+            if gid in seen or isinstance(reply, list) or not _notFound(reply):
+                continue
+            seen.add(gid)
+            old = self.tasks[gid]
+            self.tasks[gid] = _parseStatus({
+                'gid': gid, 'status': 'removed',
+                'totalLength': old['total'] if old else 0,
+                'completedLength': old['completed'] if old else 0,
+            })
+            changed = True
+
+        # 本次未出现且未结束的任务排到队尾，之后轮流单独查询
+        for gid, status in self.tasks.items():
+            if gid not in seen and (status is None or status['status'] not in FINISHED):
+                self._enqueue(gid)
+
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        return self.summary()
+
+    def status(self, gid):
+        return self.tasks.get(gid)
+
+    def summary(self):
+        """已跟踪任务的汇总：数量、总速度、总进度、预计剩余时间和失败任务"""
+        return summarize(self.tasks.items())
+
+    def finished(self):
+        """所有已跟踪任务是否都已结束（完成、出错或被移除）"""
+        return all(
+            status is not None and status['status'] in FINISHED
+            for status in self.tasks.values()
+        )
+
+    def close(self):
+        self._closePush()
+        self.session.close()
+
+
+class PollerGroup(_PollLoop):
+    """同时跟踪多个aria2端点上的任务
+
+    每个端点一个 Aria2Poller，每次轮询各发一个请求；状态和汇总信息
+    合并后与单个 Aria2Poller 的接口相同。任一端点推送的通知都会让
+    wait() 立即返回。
+    """
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, window=WINDOW,
+                 push=True):
+        super().__init__()
+        self.push = push
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.window = window
+        # RPC地址 -> Aria2Poller
+        self.pollers = {}
+        # GID -> RPC地址
+        self._owner = {}
+        # RPC地址 -> 最近一次轮询失败的错误信息
+        self.errors = {}
+
+    def track(self, gids, config):
+        """开始跟踪某个端点上的一批GID"""
+        poller = self.pollers.get(config['rpc'])
+        if poller is None:
+            poller = Aria2Poller(config, min_interval=self.min_interval,
+                                 max_interval=self.max_interval, window=self.window,
+                                 push=self.push, wake=self.wake)
+            self.pollers[config['rpc']] = poller
+        gids = list(gids)
+        poller.track(gids)
+        for gid in gids:
+            self._owner[gid] = config['rpc']
+
+    @property
+    def interval(self):
+        if not self.pollers:
+            return self.max_interval
+        return min(poller.interval for poller in self.pollers.values())
+
+    def poll(self):
+        """轮询所有端点一次，个别端点失败时保留其上次的状态"""
+        for rpc, poller in self.pollers.items():
+            if poller.finished():
+                continue
+            try:
+                poller.poll()
+                self.errors.pop(rpc, None)
+            except Exception as e:
+                self.errors[rpc] = str(e)
+        if self.errors and len(self.errors) == len(self.pollers):
+            raise RuntimeError("; ".join(self.errors.values()))
+        return self.summary()
+
+    def tracked(self):
+        """所有已跟踪的GID"""
+        return list(self._owner)
+
+    def status(self, gid):
+        rpc = self._owner.get(gid)
+        return self.pollers[rpc].status(gid) if rpc else None
+
+    def summary(self):
+        return summarize(itertools.chain.from_iterable(
+            poller.tasks.items() for poller in self.pollers.values()
+        ))
+
+    def finished(self):
+        return all(poller.finished() for poller in self.pollers.values())
+
+    def close(self):
+        for poller in self.pollers.values():
+            poller.close()
+
+
+def summarize(tasks):
+    """汇总 [(GID, 状态)]：数量、总速度、总进度、预计剩余时间和失败任务"""
+    counts = {}
+    total = completed = speed = 0
+    errors = {}
+    done = True
+    for gid, status in tasks:
+        state = status['status'] if status is not None else 'unknown'
+        counts[state] = counts.get(state, 0) + 1
+        if state not in FINISHED:
+            done = False
+        if status is None:
+            continue
+        total += status['total']
+        completed += status['completed']
+        speed += status['speed']
+        if status['error']:
+            errors[gid] = status['error']
+    return {
+        'tasks': sum(counts.values()),
+        'counts': counts,
+        'total': total,
+        'completed': completed,
+        'speed': speed,
+        'eta': (total - completed) / speed if speed and total > completed else None,
+        'errors': errors,
+        'done': done,
+    }
+
+
+def format_summary(summary):
+    """把汇总信息转换为一行用于显示的文字"""
+    counts = summary['counts']
+    percent = summary['completed'] * 100 / summary['total'] if summary['total'] else 0
+    speed_mb = summary['speed'] / 1024 / 1024
+    return (
+        f"下载中 {counts.get('active', 0)} | 等待 {counts.get('waiting', 0) + counts.get('paused', 0)} | "
+        f"完成 {counts.get('complete', 0)} | 失败 {counts.get('error', 0)} | "
+        f"{percent:.1f}% {speed_mb:.2f}MB/s 剩余 {format_duration(summary['eta'])}"
+    )
@@ -0,0 +1,388 @@
+import asyncio
+import base64
+import contextlib
+import hashlib
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import ssl
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# WebSocket 握手时用于计算 Sec-WebSocket-Accept 的固定GUID（RFC 6455）
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# 连接和单次调用的默认超时（秒）
+CONNECT_TIMEOUT = 10
+CALL_TIMEOUT = 30
+
+# 迭代方来不及取走的通知最多保留的条数，超出时丢弃最早的
+EVENT_BACKLOG = 1000
+
+# aria2 推送的通知及其简称
+NOTIFICATIONS = {
+    'aria2.onDownloadStart': 'start',
+    'aria2.onDownloadPause': 'pause',
+    'aria2.onDownloadStop': 'stop',
+    'aria2.onDownloadComplete': 'complete',
+    'aria2.onDownloadError': 'error',
+    'aria2.onBtDownloadComplete': 'btComplete',
+}
+
+
+class Aria2WebSocketError(Exception):
+    """WebSocket 连接或 RPC 调用失败"""
+
+
+def ws_url(rpc_url):
+    """把 http(s)://.../jsonrpc 形式的RPC地址转换为 ws(s):// 地址"""
+    if rpc_url.startswith('https://'):
+        return 'wss://' + rpc_url[len('https://'):]
+    if rpc_url.startswith('http://'):
+        return 'ws://' + rpc_url[len('http://'):]
+    return rpc_url
+
+
+def _mask(payload, key):
+    if not payload:
+        return payload
+    n = len(payload)
+    stream = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(n, 'big')
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    """编码一个客户端帧（客户端发出的帧必须加掩码）"""
+    header = bytearray([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        header.append(0x80 | n)
+    elif n < 1 << 16:
+        header.append(0x80 | 126)
+        header += n.to_bytes(2, 'big')
+    else:
+        header.append(0x80 | 127)
+        header += n.to_bytes(8, 'big')
+    key = os.urandom(4)
+    return bytes(header) + key + _mask(payload, key)
+
+
+def _putLatest(events, event):
+    """在事件循环线程中放入通知，超出 EVENT_BACKLOG 时丢弃最早的"""
+    while events.qsize() >= EVENT_BACKLOG:
+        events.get_nowait()
+    events.put_nowait(event)
+
+
+class Aria2WebSocket:
+    """基于 WebSocket 的 aria2 JSON-RPC 客户端
+
+    保持一条长连接：请求带自增ID发出后立即返回 Future，多个请求可以同时
+    在途，由后台线程按ID把响应分发回去。aria2 主动推送的下载开始、完成、
+    出错等通知可以通过 on() 注册回调，也可以用 events() 同步迭代或
+    async for 异步迭代，无需轮询。通知只在有迭代方时排队，且最多保留
+    EVENT_BACKLOG 条，长时间运行也不会积压。
+    """
+
+    def __init__(self, config, timeout=CONNECT_TIMEOUT):
+        self.url = ws_url(config['rpc'])
+        self.secret = config.get('secret', '')
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._callbacks = {}
+        self._events = queue.Queue()
+        # 正在同步迭代通知的数量，为 0 时通知不进入 _events
+        self._iterators = 0
+        # 正在异步迭代的 (事件循环, asyncio.Queue)，通知通过事件循环线程安全地放入
+        self._listeners = []
+        self._events_lock = threading.Lock()
+        self._thread = None
+        self.closed = threading.Event()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        """建立连接并完成握手，返回自身"""
+        parts = urlsplit(self.url)
+        secure = parts.scheme == 'wss'
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=self.timeout)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=parts.hostname)
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        )
+        sock.sendall(request.encode('ascii'))
+        reader = sock.makefile('rb')
+        status = reader.readline().decode('latin-1')
+        headers = {}
+        while True:
+            line = reader.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        expected = base64.b64encode(
+            hashlib.sha1((key + WS_GUID).encode('ascii')).digest()
+        ).decode('ascii')
+        if ' 101 ' not in status or headers.get('sec-websocket-accept') != expected:
+            sock.close()
+            raise Aria2WebSocketError(f"WebSocket握手失败: {status.strip()}")
+
+        # 握手完成后由后台线程阻塞读取，不再需要超时
+        sock.settimeout(None)
+        self._sock = sock
+        self._reader = reader
+        self.closed.clear()
+        self._thread = threading.Thread(target=self._readLoop, name="aria2-ws", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._sock is None:
+            return
+        try:
+            self._send(b'', OP_CLOSE)
+        except OSError:
+            pass
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.timeout)
+        self._sock = None
+
+    def _send(self, payload, opcode=OP_TEXT):
+        with self._send_lock:
+            self._sock.sendall(encode_frame(payload, opcode))
+
+    def _readExact(self, n):
+        data = self._reader.read(n)
+        if data is None or len(data) < n:
+            raise ConnectionError("WebSocket连接已关闭")
+        return data
+
+    def _readFrame(self):
+        b1, b2 = self._readExact(2)
+        fin, opcode = b1 & 0x80, b1 & 0x0F
+        n = b2 & 0x7F
+        if n == 126:
+            n = int.from_bytes(self._readExact(2), 'big')
+        elif n == 127:
+            n = int.from_bytes(self._readExact(8), 'big')
+        key = self._readExact(4) if b2 & 0x80 else None
+        payload = self._readExact(n) if n else b''
+        if key is not None:
+            payload = _mask(payload, key)
+        return fin, opcode, payload
+
+    def _readLoop(self):
+        fragments = []
+        error = None
+        try:
+            while True:
+                fin, opcode, payload = self._readFrame()
+                if opcode == OP_PING:
+                    self._send(payload, OP_PONG)
+                    continue
+                if opcode == OP_PONG:
+                    continue
+                if opcode == OP_CLOSE:
+                    break
+                fragments.append(payload)
+                if not fin:
+                    continue
+                message = b''.join(fragments)
+                fragments = []
+                self._dispatch(json.loads(message.decode('utf-8')))
+        except (OSError, ValueError, ConnectionError) as e:
+            error = e
+        finally:
+            self.closed.set()
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(Aria2WebSocketError(f"WebSocket连接已断开: {error}"))
+            # 通知迭代方连接已结束
+            self._queueEvent(None)
+
+    def _dispatch(self, message):
+        if 'id' in message and message['id'] is not None:
+            with self._pending_lock:
+                future = self._pending.pop(message['id'], None)
+            if future is None:
+                return
+            if 'error' in message:
+                error_msg = str(message['error'].get('message', '未知错误'))
+                if 'Unauthorized' in error_msg:
+                    error_msg = 'RPC密码错误'
+                future.set_exception(Aria2WebSocketError(error_msg))
+            else:
+                future.set_result(message.get('result'))
+            return
+
+        method = message.get('method')
+        if method not in NOTIFICATIONS:
+            return
+        for params in message.get('params') or [{}]:
+            gid = params.get('gid')
+            event = (NOTIFICATIONS[method], gid)
+            for name in (method, NOTIFICATIONS[method], '*'):
+                for callback in self._callbacks.get(name, []):
+                    try:
+                        callback(*event)
+                    except Exception as e:
+                        logger.warning("处理aria2通知出错: %s", e)
+            self._queueEvent(event)
+
+    def _queueEvent(self, event):
+        with self._events_lock:
+            for loop, events in self._listeners:
+                try:
+                    loop.call_soon_threadsafe(_putLatest, events, event)
+                except RuntimeError:
+                    # 事件循环已关闭
+                    pass
+            # 没有同步迭代方时不保留通知；None 表示连接已结束，总是放入
+            if event is not None and not self._iterators:
+                return
+            while self._events.qsize() >= EVENT_BACKLOG:
+                try:
+                    self._events.get_nowait()
+                except queue.Empty:
+                    break
+            self._events.put(event)
+
+    @contextlib.contextmanager
+    def _iterating(self):
+        with self._events_lock:
+            self._iterators += 1
+        try:
+            yield
+        finally:
+            with self._events_lock:
+                self._iterators -= 1
+                if not self._iterators:
+                    # 最后一个迭代方退出后丢弃没取走的通知，连接已结束的标记除外
+                    while True:
+                        try:
+                            self._events.get_nowait()
+                        except queue.Empty:
+                            break
+                    if self.closed.is_set():
+                        self._events.put(None)
+
+    def call_async(self, method, *params):
+        """发送一个RPC调用并立即返回 Future，可同时发出多个调用"""
+        return self._request(method, params)[1]
+
+    def _request(self, method, params):
+        if self._sock is None or self.closed.is_set():
+            raise Aria2WebSocketError("WebSocket未连接")
+        request_id = next(self._ids)
+        params = list(params)
+        if self.secret and method != 'system.multicall':
+            params.insert(0, f'token:{self.secret}')
+        future = Future()
+        with self._pending_lock:
+            self._pending[request_id] = future
+        message = {'jsonrpc': '2.0', 'method': method, 'id': request_id, 'params': params}
+        try:
+            self._send(json.dumps(message).encode('utf-8'))
+        except OSError as e:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise Aria2WebSocketError(str(e))
+        return request_id, future
+
+    def call(self, method, *params, timeout=CALL_TIMEOUT):
+        """发送一个RPC调用并等待结果，超时抛出 Aria2WebSocketError"""
+        request_id, future = self._request(method, params)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # 不再等待该响应，之后收到时直接丢弃
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise Aria2WebSocketError(f"RPC调用超时: {method}")
+
+    def on(self, event, callback):
+        """注册通知回调 callback(事件简称, GID)
+
+        event 可以是完整方法名（aria2.onDownloadComplete）、简称（complete）
+        或 '*'（全部通知）。
+        """
+        self._callbacks.setdefault(event, []).append(callback)
+
+    def events(self, timeout=None):
+        """逐个产出 (事件简称, GID)，连接断开或等待超时后结束
+
+        只产出开始迭代之后收到的通知。
+        """
+        with self._iterating():
+            while True:
+                try:
+                    event = self._events.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if event is None:
+                    self._queueEvent(None)
+                    return
+                yield event
+
+    def __aiter__(self):
+        return self._aiterEvents()
+
+    async def _aiterEvents(self):
+        # 每个异步迭代方一个 asyncio.Queue，不占用线程；迭代被取消时只需注销，
+        # 不会有等待中的线程之后取走别人的通知
+        listener = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._events_lock:
+            closed = self.closed.is_set()
+            if not closed:
+                self._listeners.append(listener)
+        if closed:
+            return
+        try:
+            while True:
+                event = await listener[1].get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            with self._events_lock:
+                self._listeners.remove(listener)
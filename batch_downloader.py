@@ -0,0 +1,346 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from aria2_pool import Aria2Pool
+from aria2_scheduler import DEFAULT_POLICY, POLICIES, SubmissionScheduler
+from listing_cache import ListingWriter
+from listing_snapshot import write_snapshot
+from logging_setup import add_logging_arguments, setup_logging
+from request_metrics import RequestMetrics
+from onedrive_downloader import (DEFAULT_PAGE_SIZE, DEFAULT_WORKERS, REFRESH_BATCH, LinkResolver,
+                                 iter_files, newAdapter, newSession)
+from send_to_aria2 import load_config
+from share_index import ShareIndex
+
+logger = logging.getLogger(__name__)
+
+# 定义缓存目录（在程序运行目录下）
+CACHE_DIR = Path('.onedrive_downloader')
+BATCH_DIR = CACHE_DIR / 'batch'
+
+# 同时处理的分享链接数
+DEFAULT_JOBS = 4
+
+# 退出码
+EXIT_OK = 0
+EXIT_PARTIAL = 1  # 部分分享处理失败
+EXIT_USAGE = 2    # 参数错误或没有可处理的链接（与 argparse 一致）
+EXIT_FAILED = 3   # 全部分享处理失败
+
+
+def read_urls(urls, url_file=None):
+    """合并命令行和文件中的分享链接，去掉空行、# 注释和重复项
+
+    url_file 为 '-' 时从标准输入读取。
+    """
+    lines = list(urls)
+    if url_file == '-':
+        lines.extend(sys.stdin.read().splitlines())
+    elif url_file:
+        lines.extend(Path(url_file).read_text(encoding='utf-8-sig').splitlines())
+    seen = set()
+    result = []
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith('#') and url not in seen:
+            seen.add(url)
+            result.append(url)
+    return result
+
+
+def shareName(index, url):
+    """分享在输出目录中的文件名前缀：序号加链接摘要，重复运行时保持不变"""
+    return f"{index:03d}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]}"
+
+
+def indexPath(out_dir, url):
+    """增量列出时分享的本地索引路径
+
+    每个分享一个索引文件：索引的一次遍历是一个 SQLite 写事务，多个分享
+    共用一个文件时会互相等待。
+    """
+    return Path(out_dir) / 'index' / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}.sqlite3"
+
+
+class BatchRunner:
+    """无交互地批量处理多个分享链接
+
+    各分享在线程池中并发列出，所有会话共用同一个连接池（各自保存Cookie），
+    列表和快照写到输出目录中各自的文件。export 为 True 时为每个分享导出直链
+    文件；传入 aria2_config 时把文件推送到aria2，推送经同一个端点池逐个分享
+    进行，推送前刷新即将过期的直链。传入 metrics 时记录所有分享各阶段请求
+    的耗时和流量。incremental 为 True 时按输出目录中各分享的本地索引增量
+    列出，只重新请求 cTag 变化了的文件夹。
+    """
+
+    def __init__(self, urls, out_dir=BATCH_DIR, jobs=DEFAULT_JOBS, workers=DEFAULT_WORKERS,
+                 page_size=DEFAULT_PAGE_SIZE, export=False, aria2_config=None, schedule=None, push=None,
+                 metrics=None, incremental=False):
+        self.urls = list(urls)
+        self.out_dir = Path(out_dir)
+        self.jobs = max(1, int(jobs))
+        self.workers = max(1, int(workers))
+        self.page_size = page_size
+        self.export = export
+        self.aria2_config = aria2_config
+        # 默认有 aria2 配置时推送
+        self.push = aria2_config is not None if push is None else push
+        self.schedule = schedule
+        self.metrics = metrics
+        self.incremental = incremental
+        # 每个分享最多 workers 个列目录线程，各带一个预取线程
+        self.adapter = newAdapter(self.jobs * self.workers * 2)
+        self.pool = None
+        self.pool_error = None
+        self._push_lock = threading.Lock()
+        # 分享链接 -> 锁，同一分享的增量遍历依次进行
+        self._index_locks = {}
+        self._index_locks_lock = threading.Lock()
+
+    def run(self):
+        """处理全部分享，返回汇总信息"""
+        started = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="batch-share") as executor:
+                shares = list(executor.map(
+                    lambda index, url: self.process(url, shareName(index, url)),
+                    range(1, len(self.urls) + 1), self.urls,
+                ))
+        finally:
+            self.close()
+        failed = sum(1 for share in shares if share['status'] != 'ok')
+        return {
+            'started_at': started,
+            'seconds': round(time.time() - started, 3),
+            'shares': shares,
+            'total': len(shares),
+            'ok': len(shares) - failed,
+            'failed': failed,
+            'files': sum(share['files'] for share in shares),
+            'bytes': sum(share['bytes'] for share in shares),
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.adapter.close()
+
+    def session(self, url):
+        """处理某个分享用的会话，共用连接池"""
+        return newSession(adapter=self.adapter)
+
+    def process(self, url, name, export=None, push=None, incremental=None):
+        """处理一个分享，返回其结果；export、push、incremental 为 None 时按创建时的设置"""
+        if export is None:
+            export = self.export
+        if push is None:
+            push = self.push
+        if incremental is None:
+            incremental = self.incremental
+        share = {
+            'url': url,
+            'name': name,
+            'status': 'ok',
+            'files': 0,
+            'bytes': 0,
+            'listing': None,
+            'export': None,
+            'pushed': 0,
+            'push_failed': 0,
+            'errors': [],
+            'seconds': 0,
+        }
+        started = time.monotonic()
+        try:
+            if push and self.aria2_config is None:
+                raise ValueError("没有配置Aria2，无法推送")
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            session = self.session(url)
+            records = self._list(url, session, self.out_dir / f"{name}.jsonl", incremental)
+            share['listing'] = str(self.out_dir / f"{name}.jsonl")
+            share['files'] = len(records)
+            share['bytes'] = sum(record['size'] or 0 for record in records)
+            if export:
+                share['export'] = str(self._export(url, session, records, self.out_dir / f"{name}.txt"))
+            if push:
+                self._push(url, session, records, share)
+        except Exception as e:
+            share['status'] = 'error'
+            share['errors'].append(str(e))
+            logger.error("处理分享失败 | %s | 错误信息: %s", url, e)
+        share['seconds'] = round(time.monotonic() - started, 3)
+        return share
+
+    def _indexLock(self, url):
+        with self._index_locks_lock:
+            return self._index_locks.setdefault(url, threading.Lock())
+
+    def _list(self, url, session, listing_path, incremental=False):
+        records = []
+        meta = {"share": url}
+        with self._indexLock(url) if incremental else contextlib.nullcontext():
+            index = ShareIndex(indexPath(self.out_dir, url)) if incremental else None
+            try:
+                with ListingWriter(listing_path, meta=meta) as writer:
+                    for record in iter_files(url, session, self.workers, self.page_size, index=index,
+                                             incremental=incremental, metrics=self.metrics):
+                        writer.write(record)
+                        records.append(record)
+            finally:
+                if index is not None:
+                    index.close()
+        try:
+            write_snapshot(records, listing_path, meta)
+        except OSError as e:
+            logger.warning("生成列表快照失败: %s", e)
+        logger.info("已列出 %d 个文件 | %s", len(records), url)
+        return records
+
+    def _export(self, url, session, records, path):
+        # 增量列出时未变化文件夹的记录来自索引，其中的直链可能已过期，导出前刷新
+        try:
+            with LinkResolver(url, session, metrics=self.metrics) as resolver:
+                resolver.refresh(records)
+        except Exception as e:
+            logger.warning("刷新直链失败，将导出原有直链 | %s | 错误信息: %s", url, e)
+        with open(path, 'w', encoding='utf-8') as f:
+            for item in records:
+                name = item['name'].strip()
+                link = item['raw_url'].strip()
+                size_mb = item['size'] / 1024 / 1024
+                f.write(f"文件名：{name}\n")
+                f.write(f"大小：{size_mb:.2f}MB\n")
+                f.write(f"直链：{link}\n")
+                f.write("\n")
+        return path
+
+    def _push(self, url, session, records, share):
+        policy = self.schedule or self.aria2_config.get('schedule', DEFAULT_POLICY)
+        # 端点池的负载计数不是线程安全的，各分享依次推送；排队期间过期的直链推送前刷新
+        with self._push_lock:
+            # 端点池第一次推送时创建；之前全部不可用时重新检查
+            if self.pool is None:
+                self.pool = Aria2Pool(self.aria2_config)
+                self.pool_error = self.pool.check()
+            elif self.pool_error:
+                self.pool_error = self.pool.check()
+            if self.pool_error:
+                share['status'] = 'error'
+                share['push_failed'] = len(records)
+                share['errors'].append(self.pool_error)
+                return
+            with LinkResolver(url, session, metrics=self.metrics) as resolver:
+                scheduler = SubmissionScheduler(self.pool, policy, resolver, wave_size=REFRESH_BATCH)
+                try:
+                    results = scheduler.submit(records)
+                finally:
+                    scheduler.close()
+        errors = set()
+        for result in results:
+            if result is not None and 'result' in result:
+                share['pushed'] += 1
+            else:
+                share['push_failed'] += 1
+                if result is not None:
+                    errors.add(str(result.get('error', {}).get('message', '未知错误')))
+        share['errors'].extend(sorted(errors))
+        if share['push_failed']:
+            share['status'] = 'error'
+        logger.info("推送完成 | %s | 成功 %d 个，失败 %d 个", url, share['pushed'], share['push_failed'])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="无交互地批量列出OneDrive分享链接，并导出直链或推送到Aria2",
+        epilog=(
+            "退出码：0 全部成功，1 部分分享失败，2 参数错误或没有链接，3 全部分享失败。"
+            "汇总信息以JSON格式写入 --summary 指定的文件（默认输出目录下的 summary.json）。"
+        ),
+    )
+    parser.add_argument('urls', nargs='*', help="分享链接，可以有多个")
+    parser.add_argument('-f', '--file', help="每行一个分享链接的文件，- 表示标准输入")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f"同时处理的分享数（默认 {DEFAULT_JOBS}）")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"每个分享列目录的并发数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"每页条目数（默认 {DEFAULT_PAGE_SIZE}）")
+    parser.add_argument('-o', '--out-dir', default=str(BATCH_DIR),
+                        help=f"列表、快照和直链文件的输出目录（默认 {BATCH_DIR}）")
+    parser.add_argument('--incremental', action='store_true',
+                        help="按输出目录中的本地索引增量列出，只重新请求有变化的文件夹")
+    parser.add_argument('--export', action='store_true', help="为每个分享导出直链文件")
+    parser.add_argument('--push', action='store_true', help="推送到Aria2，默认使用已保存的配置")
+    parser.add_argument('--rpc', help="Aria2 RPC地址，指定时不使用已保存的配置")
+    parser.add_argument('--secret', default='', help="Aria2 RPC密码")
+    parser.add_argument('--schedule', choices=POLICIES,
+                        help="推送顺序（默认按配置）")
+    parser.add_argument('--summary', help="汇总JSON的保存路径，- 表示输出到标准输出")
+    parser.add_argument('--metrics', help="请求统计的保存路径，.prom 结尾时为Prometheus文本格式，否则为JSON")
+    add_logging_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+
+    try:
+        urls = read_urls(args.urls, args.file)
+    except OSError as e:
+        parser.error(f"无法读取链接文件: {str(e)}")
+    if not urls:
+        parser.error("没有要处理的分享链接")
+
+    aria2_config = None
+    if args.push:
+        if args.rpc:
+            aria2_config = {'rpc': args.rpc, 'secret': args.secret}
+        else:
+            aria2_config = load_config()
+            if not aria2_config:
+                parser.error("没有已保存的Aria2配置，请使用 --rpc 指定RPC地址")
+
+    runner = BatchRunner(
+        urls, args.out_dir, args.jobs, args.workers, args.page_size,
+        export=args.export, aria2_config=aria2_config, schedule=args.schedule,
+        metrics=RequestMetrics() if args.metrics else None, incremental=args.incremental,
+    )
+    # 汇总输出到标准输出时，日志改到标准错误，不混入JSON
+    redirect = contextlib.redirect_stdout(sys.stderr) if args.summary == '-' else contextlib.nullcontext()
+    with redirect:
+        summary = runner.run()
+        if runner.metrics is not None:
+            try:
+                runner.metrics.write(args.metrics)
+            except OSError as e:
+                logger.error("保存请求统计失败: %s", e)
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary == '-':
+        print(text)
+    else:
+        summary_path = Path(args.summary) if args.summary else Path(args.out_dir) / 'summary.json'
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        summary_path.write_text(text, encoding='utf-8')
+        logger.info("处理完成: 成功 %d 个，失败 %d 个，汇总已保存至 %s", summary['ok'], summary['failed'], summary_path)
+
+    if summary['failed'] == 0:
+        return EXIT_OK
+    if summary['ok'] == 0:
+        return EXIT_FAILED
+    return EXIT_PARTIAL
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from file_hashes import verifyFile
+from onedrive_downloader import REFRESH_BATCH, folderPath, newSession
+
+logger = logging.getLogger(__name__)
+
+# 默认下载目录（在程序运行目录下）
+DOWNLOAD_DIR = Path('downloads')
+
+# 全局最大连接数，以及单个文件最多同时使用的连接数
+DEFAULT_CONNECTIONS = 16
+DEFAULT_PER_FILE = 4
+
+# 分段的最小大小，不足两段的文件不切分（字节）
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# 每次从连接读取并写入磁盘的块大小（字节）
+CHUNK_SIZE = 1024 * 1024
+
+# 分段中途出错时从已写入位置续传的次数
+SEGMENT_RETRIES = 3
+
+# 连接超时和读取超时（秒）
+TIMEOUT = (10, 60)
+
+# 直链过期后服务器可能返回的状态码，遇到时刷新直链再试
+EXPIRED_STATUS = (401, 403, 404, 410)
+
+# 分段日志最长隔多久写一次（秒）
+JOURNAL_INTERVAL = 1.0
+
+
+def splitRanges(size, parts, min_segment=MIN_SEGMENT_SIZE):
+    """把 [0, size) 切成不超过 parts 段、每段不小于 min_segment 的闭区间
+
+    大小未知时返回 [(0, None)]，表示不带Range整文件下载。
+    """
+    if not size or size <= 0:
+        return [(0, None)]
+    parts = max(1, min(parts, size // max(min_segment, 1)))
+    step = -(-size // parts)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+class _FileJob:
+    """一个文件的下载状态
+
+    segments 为 [[起点, 终点, 已写到的位置], ...]，会定期写入 .part 旁的
+    日志文件，中断后据此只下载缺失的区间。
+    """
+
+    def __init__(self, record, path, segments):
+        self.record = record
+        self.path = path
+        self.part_path = path.with_name(path.name + '.part')
+        self.journal_path = path.with_name(path.name + '.part.journal')
+        self.segments = segments
+        self.pending = 0
+        self.downloaded = sum(pos - start for start, _, pos in segments)
+        self.error = None
+        self.lock = threading.Lock()
+        self.journal_lock = threading.Lock()
+        self.saved_at = 0
+
+    def missing(self):
+        """还需要下载的分段序号"""
+        return [
+            i for i, (_, end, pos) in enumerate(self.segments)
+            if end is None or pos <= end
+        ]
+
+    def saveJournal(self):
+        with self.journal_lock:
+            with self.lock:
+                data = {
+                    "id": self.record.get('id'),
+                    "size": self.record.get('size') or 0,
+                    "segments": [list(segment) for segment in self.segments],
+                }
+                self.saved_at = time.monotonic()
+            # 先写临时文件再替换，中途崩溃也不会留下半截日志
+            tmp_path = self.journal_path.with_name(self.journal_path.name + '.tmp')
+            with tmp_path.open('w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.journal_path)
+
+
+def loadJournal(job):
+    """读取与当前记录匹配的分段日志，不匹配或损坏时返回 None"""
+    if not job.part_path.exists() or not job.journal_path.exists():
+        return None
+    try:
+        with job.journal_path.open('r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    size = job.record.get('size') or 0
+    if not size or data.get('size') != size or data.get('id') != job.record.get('id'):
+        return None
+    if job.part_path.stat().st_size != size:
+        return None
+    segments = data.get('segments') or []
+    for segment in segments:
+        if len(segment) != 3 or segment[1] is None or not segment[0] <= segment[2] <= segment[1] + 1:
+            return None
+    return segments
+
+
+class DirectDownloader:
+    """内置的多连接HTTP下载器，无需aria2
+
+    大文件按 HTTP Range 切成多段，各段在共享连接池上并行下载并直接写入
+    预分配的 .part 文件，全部完成后改名为最终文件名。全局连接数和单个
+    文件的连接数分别受 connections 和 per_file 限制；文件按顺序开始，
+    空出的连接立即分给下一个分段。服务器不支持 Range 时退回单连接下载。
+
+    每个分段的进度记录在 .part.journal 日志中，重新运行时只下载缺失的
+    区间；直链过期时通过 resolver 重新获取。完成后按列表中的 sha1Hash
+    或 quickXorHash 校验文件。
+    """
+
+    def __init__(self, out_dir=DOWNLOAD_DIR, connections=DEFAULT_CONNECTIONS,
+                 per_file=DEFAULT_PER_FILE, min_segment=MIN_SEGMENT_SIZE, session=None,
+                 resolver=None, on_progress=None, on_done=None, verify=True):
+        self.out_dir = Path(out_dir)
+        self.connections = max(1, int(connections))
+        self.per_file = max(1, int(per_file))
+        self.min_segment = min_segment
+        self.session = session if session is not None else newSession(self.connections)
+        # onedrive_downloader.LinkResolver，开始下载前和直链失效时刷新直链
+        self.resolver = resolver
+        # on_progress(record, 已下载字节, 总字节)，on_done(record, 错误信息或None)
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.verify = verify
+        self._cancelled = threading.Event()
+        self._resolve_lock = threading.Lock()
+
+    def cancel(self):
+        """停止尚未完成的下载，已下载的区间保留在日志中"""
+        self._cancelled.set()
+
+    def download(self, records):
+        """下载全部记录，返回 [(record, 错误信息或None)]"""
+        self._cancelled.clear()
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        slots = threading.BoundedSemaphore(self.connections)
+        results = []
+        jobs = []
+        with ThreadPoolExecutor(
+            max_workers=self.connections, thread_name_prefix="direct-download"
+        ) as pool:
+            for start in range(0, len(records), REFRESH_BATCH):
+                batch = records[start:start + REFRESH_BATCH]
+                # 正在下载的分段可能同时因直链过期而刷新，共用同一个解析器
+                with self._resolve_lock:
+                    self._refresh(batch)
+                for record in batch:
+                    if self._cancelled.is_set():
+                        break
+                    job = self._prepare(record)
+                    if job is None:
+                        results.append((record, None))
+                        continue
+                    jobs.append(job)
+                    missing = job.missing()
+                    job.pending = len(missing)
+                    if not missing:
+                        self._finish(job)
+                        continue
+                    for index in missing:
+                        # 没有空闲连接时在这里等待，文件因此按顺序开始
+                        slots.acquire()
+                        pool.submit(self._runSegment, job, index, slots)
+        return results + [(job.record, job.error) for job in jobs]
+
+    def _refresh(self, records, force=False):
+        if self.resolver is None:
+            return
+        if force:
+            # 服务器已拒绝该直链，不论记录的获取时间如何都重新获取
+            for record in records:
+                record['fetched_at'] = 0
+        try:
+            self.resolver.refresh(records)
+        except Exception as e:
+            logger.warning("刷新直链失败，将使用原有直链: %s", e)
+
+    def _prepare(self, record):
+        """准备下载任务，文件已完整存在时返回 None"""
+        # 按分享中的文件夹结构保存，同名文件不会共用 .part 和日志；
+        # 文件名只取最后一部分，避免名称中的路径分隔符写出下载目录
+        path = self.out_dir / folderPath(record.get('folder')) / Path(record['name']).name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = record.get('size') or 0
+        if size and path.exists() and path.stat().st_size == size:
+            logger.info("文件已存在，跳过: %s", path)
+            return None
+
+        job = _FileJob(record, path, [])
+        segments = loadJournal(job)
+        if segments is not None:
+            job = _FileJob(record, path, segments)
+            logger.info("继续下载: %s（已完成 %d/%d 字节）", path, job.downloaded, size)
+            return job
+
+        job.segments = [
+            [start, end, start] for start, end in splitRanges(size, self.per_file, self.min_segment)
+        ]
+        with job.part_path.open('wb') as f:
+            if size:
+                f.truncate(size)
+        if size:
+            job.saveJournal()
+        return job
+
+    def _runSegment(self, job, index, slots):
+        try:
+            if job.error is None:
+                self._fetch(job, index)
+        except Exception as e:
+            with job.lock:
+                job.error = job.error or str(e)
+        finally:
+            slots.release()
+            if job.record.get('size'):
+                job.saveJournal()
+            with job.lock:
+                job.pending -= 1
+                finished = job.pending == 0
+            if finished:
+                self._finish(job)
+
+    def _fetch(self, job, index):
+        segment = job.segments[index]
+        start, end, pos = segment
+        url_refreshed = False
+        for attempt in range(SEGMENT_RETRIES + 1):
+            headers = {}
+            if end is not None:
+                headers['Range'] = f'bytes={pos}-{end}'
+            url = job.record['raw_url']
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+                    if r.status_code in EXPIRED_STATUS and not url_refreshed and self.resolver:
+                        # 直链已过期，同一文件的多个分段只刷新一次
+                        with self._resolve_lock:
+                            if job.record['raw_url'] == url:
+                                self._refresh([job.record], force=True)
+                        url_refreshed = True
+                        continue
+                    r.raise_for_status()
+                    if headers and r.status_code != 206:
+                        # 服务器忽略了Range：由第一段下载整个文件，其余分段直接结束
+                        if pos != 0:
+                            segment[2] = end + 1
+                            return
+                        end = None
+                    with job.part_path.open('r+b') as f:
+                        f.seek(pos)
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            if self._cancelled.is_set():
+                                raise RuntimeError("下载已取消")
+                            if end is not None:
+                                chunk = chunk[:end + 1 - pos]
+                            f.write(chunk)
+                            f.flush()
+                            pos += len(chunk)
+                            # 数据已交给系统后才记录进度，日志不会超前于文件内容
+                            segment[2] = pos
+                            self._progress(job, len(chunk))
+                            if end is not None and pos > end:
+                                break
+                if end is None or pos > end:
+                    return
+                raise IOError("连接提前关闭")
+            except (requests.RequestException, IOError):
+                if attempt == SEGMENT_RETRIES or self._cancelled.is_set():
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+        raise IOError("直链已失效且无法刷新")
+
+    def _progress(self, job, n):
+        with job.lock:
+            job.downloaded += n
+            downloaded = job.downloaded
+            save = time.monotonic() - job.saved_at >= JOURNAL_INTERVAL
+        if save and job.record.get('size'):
+            job.saveJournal()
+        if self.on_progress is not None:
+            self.on_progress(job.record, downloaded, job.record.get('size') or 0)
+
+    def _finish(self, job):
+        size = job.record.get('size') or 0
+        if job.error is None and size and job.downloaded != size:
+            job.error = f"文件大小不符: 期望 {size}，实际 {job.downloaded}"
+        if job.error is None and self.verify:
+            job.error = verifyFile(job.part_path, job.record.get('hashes'))
+            if job.error is not None:
+                # 内容已损坏，续传无意义，下次从头下载
+                job.journal_path.unlink(missing_ok=True)
+        if job.error is None:
+            os.replace(job.part_path, job.path)
+            job.journal_path.unlink(missing_ok=True)
+            logger.info("下载完成: %s", job.path)
+        else:
+            logger.warning("下载失败: %s: %s", job.record['name'], job.error)
+        if self.on_done is not None:
+            self.on_done(job.record, job.error)
+
+
+def download_files(records, out_dir=DOWNLOAD_DIR, connections=DEFAULT_CONNECTIONS,
+                   per_file=DEFAULT_PER_FILE, resolver=None):
+    """直接下载文件列表中的记录，返回 (成功数, 失败列表)"""
+    downloader = DirectDownloader(out_dir, connections, per_file, resolver=resolver)
+    results = downloader.download(records)
+    fail_list = [(record['name'], error) for record, error in results if error]
+    return len(results) - len(fail_list), fail_list
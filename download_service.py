@@ -0,0 +1,352 @@
+import argparse
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from aria2_scheduler import POLICIES
+from batch_downloader import DEFAULT_JOBS, BatchRunner, shareName
+from listing_snapshot import open_listing
+from logging_setup import add_logging_arguments, setup_logging
+from request_metrics import RequestMetrics
+from onedrive_downloader import DEFAULT_PAGE_SIZE, DEFAULT_WORKERS, newSession
+from send_to_aria2 import load_config
+
+logger = logging.getLogger(__name__)
+
+# 定义缓存目录（在程序运行目录下）
+CACHE_DIR = Path('.onedrive_downloader')
+SERVICE_DIR = CACHE_DIR / 'service'
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# 排队中和运行中的任务数上限，超过时拒绝新任务
+MAX_PENDING = 1000
+
+# 保留的已结束任务数，超过时丢弃最早的
+MAX_FINISHED = 1000
+
+# 保留会话（Cookie）的分享数
+MAX_SESSIONS = 256
+
+# 文件列表接口每次最多返回的条数
+MAX_PAGE = 1000
+
+FINISHED = ('ok', 'error')
+
+
+class ServiceRunner(BatchRunner):
+    """常驻进程使用的 BatchRunner
+
+    连接池、aria2端点池在各任务间共用，每个分享的会话按链接缓存，
+    再次提交同一分享时复用已建立的连接和Cookie。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__([], *args, **kwargs)
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def session(self, url):
+        with self._sessions_lock:
+            session = self._sessions.pop(url, None)
+            if session is None:
+                session = newSession(adapter=self.adapter)
+            self._sessions[url] = session
+            # 不调用 session.close()，否则会关闭共用的连接池
+            while len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+            return session
+
+
+class Job:
+    def __init__(self, job_id, url, export, push, incremental=None):
+        self.id = job_id
+        self.url = url
+        self.export = export
+        self.push = push
+        self.incremental = incremental
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'export': self.export,
+            'push': self.push,
+            'incremental': self.incremental,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+        }
+
+
+class JobQueue:
+    """任务表和有界的工作线程池
+
+    任务按提交顺序交给 jobs 个工作线程执行，排队和运行中的任务超过
+    max_pending 时 submit 抛出 OverflowError。已结束的任务只保留最近的
+    max_finished 个。
+    """
+
+    def __init__(self, runner, jobs=DEFAULT_JOBS, max_pending=MAX_PENDING, max_finished=MAX_FINISHED):
+        self.runner = runner
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(jobs)), thread_name_prefix="service-job")
+
+    def submit(self, url, export=None, push=None, incremental=None):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise OverflowError(f"排队任务已达上限 {self.max_pending}")
+            job = Job(next(self._ids), url, export, push, incremental)
+            self.jobs[job.id] = job
+            self._pending += 1
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            result = self.runner.process(
+                job.url, shareName(job.id, job.url), job.export, job.push, job.incremental
+            )
+        except Exception as e:
+            result = {'url': job.url, 'status': 'error', 'errors': [str(e)]}
+        job.result = result
+        job.finished_at = time.time()
+        job.status = result['status']
+        with self._lock:
+            self._pending -= 1
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list(self, status=None):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return [job for job in jobs if status is None or job.status == status]
+
+    def stats(self):
+        counts = {}
+        for job in self.list():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {'pending': self._pending, 'counts': counts}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """本地HTTP/JSON接口
+
+    POST /jobs                  提交任务，请求体 {"url": ..., "export": 布尔, "push": 布尔,
+                                "incremental": 布尔}
+    GET  /jobs[?status=...]     任务列表（不含结果）
+    GET  /jobs/<id>             任务状态和结果
+    GET  /jobs/<id>/files       任务列出的文件，支持 offset、limit 分页
+    GET  /health                运行状态
+    GET  /metrics[?format=json] 各阶段请求统计，默认为Prometheus文本格式
+    """
+
+    server_version = "OneDriveDownloader"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def queue(self):
+        return self.server.queue
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+    def _send(self, status, body):
+        self._sendText(status, json.dumps(body, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def _sendText(self, status, text, content_type):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send(status, {'error': {'message': message}})
+
+    def _job(self, part):
+        try:
+            job = self.queue.get(int(part))
+        except ValueError:
+            job = None
+        if job is None:
+            self._error(404, "任务不存在")
+        return job
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+        if parts == ['health']:
+            self._send(200, {'status': 'ok', **self.queue.stats()})
+        elif parts == ['metrics']:
+            metrics = self.queue.runner.metrics
+            if query.get('format', [None])[0] == 'json':
+                self._send(200, metrics.report())
+            else:
+                self._sendText(200, metrics.prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif parts == ['jobs']:
+            status = query.get('status', [None])[0]
+            jobs = []
+            for job in self.queue.list(status):
+                job = job.to_dict()
+                job.pop('result')
+                jobs.append(job)
+            self._send(200, {'jobs': jobs})
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self._job(parts[1])
+            if job is not None:
+                self._send(200, job.to_dict())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'files':
+            job = self._job(parts[1])
+            if job is not None:
+                self._files(job, query)
+        else:
+            self._error(404, "接口不存在")
+
+    def _files(self, job, query):
+        if job.status not in FINISHED or not (job.result or {}).get('listing'):
+            self._error(409, "任务尚未完成或没有文件列表")
+            return
+        try:
+            offset = max(0, int(query.get('offset', [0])[0]))
+            limit = min(MAX_PAGE, max(0, int(query.get('limit', [MAX_PAGE])[0])))
+        except ValueError:
+            self._error(400, "offset 和 limit 必须是整数")
+            return
+        try:
+            with open_listing(job.result['listing']) as records:
+                files = [record.to_dict() for record in records[offset:offset + limit]]
+                total = len(records)
+        except OSError as e:
+            self._error(410, f"文件列表无法读取: {str(e)}")
+            return
+        self._send(200, {'total': total, 'offset': offset, 'files': files})
+
+    def do_POST(self):
+        if [part for part in urlsplit(self.path).path.split('/') if part] != ['jobs']:
+            self._error(404, "接口不存在")
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except (ValueError, UnicodeDecodeError):
+            self._error(400, "请求体不是有效的JSON")
+            return
+        url = body.get('url') if isinstance(body, dict) else None
+        if not isinstance(url, str) or not url.strip():
+            self._error(400, "缺少分享链接 url")
+            return
+        if body.get('push') and self.queue.runner.aria2_config is None:
+            self._error(400, "没有配置Aria2，无法推送")
+            return
+        try:
+            job = self.queue.submit(
+                url.strip(), body.get('export'), body.get('push'), body.get('incremental')
+            )
+        except OverflowError as e:
+            self._error(503, str(e))
+            return
+        self._send(202, job.to_dict())
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, runner=None, jobs=DEFAULT_JOBS, max_pending=MAX_PENDING):
+    """启动服务并一直运行，直到收到 Ctrl+C"""
+    queue = JobQueue(runner, jobs, max_pending)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.daemon_threads = True
+    server.queue = queue
+    logger.info("服务已启动: http://%s:%d/", host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        queue.close()
+        runner.close()
+        logger.info("服务已停止")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="常驻运行，通过本地HTTP/JSON接口提交和查询分享链接的处理任务",
+        epilog=ServiceHandler.__doc__.split('\n', 2)[2],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"监听地址（默认 {DEFAULT_HOST}）")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"监听端口（默认 {DEFAULT_PORT}）")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f"同时处理的任务数（默认 {DEFAULT_JOBS}）")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING,
+                        help=f"排队任务数上限（默认 {MAX_PENDING}）")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"每个分享列目录的并发数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"每页条目数（默认 {DEFAULT_PAGE_SIZE}）")
+    parser.add_argument('-o', '--out-dir', default=str(SERVICE_DIR),
+                        help=f"列表、快照和直链文件的输出目录（默认 {SERVICE_DIR}）")
+    parser.add_argument('--incremental', action='store_true',
+                        help="任务默认按本地索引增量列出，只重新请求有变化的文件夹")
+    parser.add_argument('--export', action='store_true', help="任务默认导出直链文件")
+    parser.add_argument('--push', action='store_true', help="任务默认推送到Aria2")
+    parser.add_argument('--rpc', help="Aria2 RPC地址，指定时不使用已保存的配置")
+    parser.add_argument('--secret', default='', help="Aria2 RPC密码")
+    parser.add_argument('--schedule', choices=POLICIES, help="推送顺序（默认按配置）")
+    add_logging_arguments(parser)
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+
+    if args.rpc:
+        aria2_config = {'rpc': args.rpc, 'secret': args.secret}
+    else:
+        aria2_config = load_config()
+    if args.push and not aria2_config:
+        parser.error("没有已保存的Aria2配置，请使用 --rpc 指定RPC地址")
+
+    runner = ServiceRunner(
+        args.out_dir, args.jobs, args.workers, args.page_size,
+        export=args.export, aria2_config=aria2_config or None, schedule=args.schedule, push=args.push,
+        metrics=RequestMetrics(), incremental=args.incremental,
+    )
+    serve(args.host, args.port, runner, args.jobs, args.max_pending)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
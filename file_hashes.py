@@ -0,0 +1,99 @@
+import base64
+import hashlib
+
+# 计算文件哈希时每次读取的块大小，取160的整数倍便于QuickXorHash折叠
+READ_SIZE = 160 * 8192
+
+
+class QuickXorHash:
+    """OneDrive 使用的 QuickXorHash
+
+    第 i 个字节异或到160位状态的第 (11 * i) % 160 位处（循环移位），最后
+    把总长度异或进末尾8字节并做 base64 编码。位置相同的字节移位相同，
+    因此先把数据按160字节一行逐行异或（用大整数对半折叠，在C层完成），
+    再对折叠出的160个字节做移位，速度与数据量近似线性。
+    """
+
+    WIDTH = 160
+    SHIFT = 11
+    MASK = (1 << WIDTH) - 1
+    ROW_BITS = WIDTH * 8
+
+    def __init__(self):
+        self._folded = 0
+        self._length = 0
+        self._tail = b""
+
+    def update(self, data):
+        self._length += len(data)
+        data = self._tail + bytes(data)
+        usable = len(data) - len(data) % self.WIDTH
+        self._tail = data[usable:]
+        if usable:
+            self._folded ^= self._fold(data[:usable])
+
+    def _fold(self, data):
+        x = int.from_bytes(data, 'little')
+        rows = len(data) // self.WIDTH
+        while rows > 1:
+            half = rows // 2
+            bits = half * self.ROW_BITS
+            x = (x >> bits) ^ (x & ((1 << bits) - 1))
+            rows -= half
+        return x
+
+    def digest(self):
+        x = self._folded ^ int.from_bytes(self._tail, 'little')
+        h = 0
+        for r in range(self.WIDTH):
+            b = (x >> (8 * r)) & 0xFF
+            if b:
+                offset = (self.SHIFT * r) % self.WIDTH
+                h ^= ((b << offset) | (b >> (self.WIDTH - offset))) & self.MASK
+        out = bytearray(h.to_bytes(self.WIDTH // 8, 'little'))
+        for i, b in enumerate(self._length.to_bytes(8, 'little')):
+            out[self.WIDTH // 8 - 8 + i] ^= b
+        return bytes(out)
+
+    def b64digest(self):
+        return base64.b64encode(self.digest()).decode('ascii')
+
+
+def expectedHash(hashes):
+    """从接口返回的 hashes 中选出用于校验的哈希，返回 (算法, 期望值)
+
+    优先使用计算更快的 sha1，没有时使用 quickXorHash；都没有时返回 None。
+    """
+    if not hashes:
+        return None
+    if hashes.get('sha1Hash'):
+        return 'sha1', hashes['sha1Hash'].upper()
+    if hashes.get('quickXorHash'):
+        return 'quickXorHash', hashes['quickXorHash']
+    return None
+
+
+def fileHash(path, algorithm):
+    """计算文件哈希，sha1 返回大写十六进制，quickXorHash 返回 base64"""
+    hasher = hashlib.sha1() if algorithm == 'sha1' else QuickXorHash()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    if algorithm == 'sha1':
+        return hasher.hexdigest().upper()
+    return hasher.b64digest()
+
+
+def verifyFile(path, hashes):
+    """校验文件哈希，返回错误信息；一致或没有可用哈希时返回 None"""
+    expected = expectedHash(hashes)
+    if expected is None:
+        return None
+    algorithm, value = expected
+    actual = fileHash(path, algorithm)
+    if actual != value:
+        return f"{algorithm} 校验失败: 期望 {value}，实际 {actual}"
+    return None
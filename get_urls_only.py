@@ -1,32 +1,60 @@
-import json
+import logging
 from pathlib import Path
 
+from listing_cache import listing_meta
+from listing_snapshot import open_listing
+from onedrive_downloader import REFRESH_BATCH, LinkResolver
+
+logger = logging.getLogger(__name__)
+
 # 定义缓存目录（在程序运行目录下）
 CACHE_DIR = Path('.onedrive_downloader')
-TEMP_JSON_PATH = CACHE_DIR / 'tmp.json'
 RESULT_PATH = CACHE_DIR / 'result.txt'
 
-def main():
-    """新增main函数"""
+def main(refresh=True):
+    """根据列表缓存生成 result.txt
+
+    refresh 为 True 时先刷新即将过期的直链；获取列表后立即生成时可以
+    关闭，推送和导出前会再刷新。
+    """
     try:
-        with TEMP_JSON_PATH.open('r', encoding='utf-8') as f:
-            data = json.load(f)
+        share_url = listing_meta().get('share') if refresh else None
+        resolver = LinkResolver(share_url) if share_url else None
+        total_size = 0
         
         CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        with RESULT_PATH.open('w', encoding='utf-8') as f:
-            for item in data:
-                name = item['name'].strip()
-                url = item['raw_url'].strip()
-                size_mb = item['size'] / 1024 / 1024
-                f.write(f"{name}\n")
-                f.write(f"# 文件大小: {size_mb:.2f}MB\n")
-                f.write(f"{url}\n\n")
+        try:
+            with open_listing() as data, RESULT_PATH.open('w', encoding='utf-8') as f:
+                for start in range(0, len(data), REFRESH_BATCH):
+                    batch = data[start:start + REFRESH_BATCH]
+                    
+                    # 导出前刷新即将过期的直链
+                    if resolver is not None:
+                        try:
+                            resolver.refresh(batch)
+                        except Exception as e:
+                            logger.warning("刷新直链失败，将导出原有直链: %s", e)
+                    
+                    for item in batch:
+                        name = item['name'].strip()
+                        url = item['raw_url'].strip()
+                        size_mb = item['size'] / 1024 / 1024
+                        total_size += item['size']
+                        f.write(f"{name}\n")
+                        f.write(f"# 文件大小: {size_mb:.2f}MB\n")
+                        f.write(f"{url}\n\n")
+                count = len(data)
+        finally:
+            if resolver is not None:
+                resolver.close()
         
-        total_size_gb = sum(item['size'] for item in data) / 1024 / 1024 / 1024
-        print(f"成功生成 {len(data)} 条下载链接")
+        total_size_gb = total_size / 1024 / 1024 / 1024
+        print(f"成功生成 {count} 条下载链接")
         print(f"总文件大小: {total_size_gb:.2f}GB")
     except Exception as e:
         print(f"错误: {str(e)}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    from logging_setup import setup_logging
+    setup_logging()
+    main()
\ No newline at end of file
@@ -1,8 +1,12 @@
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QLineEdit, QPushButton, QTextEdit, 
-                            QLabel, QTableWidget, QTableWidgetItem, QCheckBox, QMenu, QMessageBox)
-from PyQt6.QtCore import Qt
+                            QLabel, QTableView, QHeaderView, QMenu, QMessageBox, QCheckBox)
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex
 import sys
+import logging
+import threading
+import time
+from collections import deque
 import json
 import os
 from pathlib import Path
@@ -10,38 +14,500 @@ import ctypes
 import subprocess
 import onedrive_downloader
 from get_urls_only import main as get_urls
-from send_to_aria2 import get_aria2_config, send_to_aria2, load_config, save_config
-import requests
+from send_to_aria2 import get_aria2_config, send_to_aria2, load_config, save_config, with_rpc
 from version import __version__
+from onedrive_downloader import refresh_links
+from aria2_status import PollerGroup, format_status, format_summary
+from aria2_pool import Aria2Pool
+from aria2_scheduler import DEFAULT_POLICY, SubmissionScheduler
+from file_index import FileIndex, QUERY_HELP, parse_query
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
 
 class TextRedirector:
+    """把 print 和日志输出转到界面的状态栏
+
+    任何线程都可以写入：完整的行先放进队列，由界面线程定时调用 drain()
+    一次性显示，后台线程不会直接操作界面控件。
+    """
     def __init__(self, text_func):
         self._text_func = text_func
         self._buffer = ""
+        self._lines = deque()
+        self._lock = threading.Lock()
         self._original_stdout = sys.stdout
         self._original_stderr = sys.stderr
 
     def write(self, text):
-        self._buffer += text
-        while '\n' in self._buffer:
-            line, self._buffer = self._buffer.split('\n', 1)
-            if line.strip():  # 只处理非空行
-                self._text_func(line.strip())
+        with self._lock:
+            self._buffer += text
+            while '\n' in self._buffer:
+                line, self._buffer = self._buffer.split('\n', 1)
+                if line.strip():  # 只处理非空行
+                    self._lines.append(line.strip())
 
     def flush(self):
-        if self._buffer.strip():
-            self._text_func(self._buffer.strip())
-            self._buffer = ""
+        with self._lock:
+            if self._buffer.strip():
+                self._lines.append(self._buffer.strip())
+                self._buffer = ""
+
+    def drain(self):
+        """在界面线程中显示队列中的输出"""
+        lines = []
+        while self._lines:
+            lines.append(self._lines.popleft())
+        if lines:
+            self._text_func("\n".join(lines))
 
     def __del__(self):
         # 恢复原始输出
         sys.stdout = self._original_stdout
         sys.stderr = self._original_stderr
 
+# 后台线程向界面发送文件或结果的批大小和最长间隔（秒）
+EMIT_BATCH = 500
+EMIT_INTERVAL = 0.2
+
+class ListingCancelled(Exception):
+    """用户取消了获取文件列表"""
+
+class _Batcher:
+    """把逐条产生的结果攒成批，按数量或时间间隔发送"""
+    def __init__(self, emit):
+        self._emit = emit
+        self._items = []
+        self._last = time.monotonic()
+
+    def add(self, item):
+        self._items.append(item)
+        if len(self._items) >= EMIT_BATCH or time.monotonic() - self._last >= EMIT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self._items:
+            self._emit(self._items)
+            self._items = []
+        self._last = time.monotonic()
+
+class FileTableModel(QAbstractTableModel):
+    """文件列表的表格模型，直接使用内存中的文件记录
+
+    勾选状态通过 Qt.CheckStateRole 提供，不再为每行创建控件；
+    显示文字在 data() 中按需生成，只有可见的行才会被请求。
+    已勾选的文件数和总大小随勾选增量维护，勾选一行的开销与列表长度无关。
+
+    表格的行可以是按 FileIndex 筛选、排序后的部分记录，此时 rows 为
+    各行对应的记录下标；勾选状态和状态文字始终按记录下标保存。
+    """
+    HEADERS = ["选择", "文件名", "大小", "状态"]
+    COL_CHECK, COL_NAME, COL_SIZE, COL_STATUS = range(4)
+    SORT_COLUMNS = {COL_NAME: 'name', COL_SIZE: 'size'}
+
+    # 勾选状态改变（单行或批量）
+    checkChanged = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.records = []
+        self.file_index = FileIndex()
+        # 每条记录一个字节，1 表示已勾选
+        self.checked = bytearray()
+        self.statuses = []
+        self.total_bytes = 0
+        self.checked_count = 0
+        self.checked_bytes = 0
+        # 表格中显示的行里已勾选的数量
+        self.visible_checked = 0
+        # 各行对应的记录下标，None 表示按原有顺序显示全部记录
+        self.rows = None
+        self._terms = []
+        self._query_sort = (None, False)
+        self._header_sort = (None, False)
+
+    def record_index(self, row):
+        """表格行号对应的记录下标"""
+        return row if self.rows is None else self.rows[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.records) if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+        if index.column() == self.COL_CHECK:
+            flags |= Qt.ItemFlag.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        row, column = self.record_index(index.row()), index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == self.COL_NAME:
+                return self.records[row]['name']
+            if column == self.COL_SIZE:
+                return f"{self.records[row]['size'] / 1024 / 1024:.2f}MB"
+            if column == self.COL_STATUS:
+                return self.statuses[row]
+        elif role == Qt.ItemDataRole.CheckStateRole and column == self.COL_CHECK:
+            return Qt.CheckState.Checked if self.checked[row] else Qt.CheckState.Unchecked
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.CheckStateRole or index.column() != self.COL_CHECK:
+            return False
+        row = self.record_index(index.row())
+        checked = Qt.CheckState(value) == Qt.CheckState.Checked
+        if self.checked[row] == checked:
+            return True
+        self.checked[row] = checked
+        size = self.records[row]['size']
+        self.checked_count += 1 if checked else -1
+        self.checked_bytes += size if checked else -size
+        self.visible_checked += 1 if checked else -1
+        self.dataChanged.emit(index, index, [role])
+        self.checkChanged.emit()
+        return True
+
+    def append(self, records):
+        """在末尾追加一批文件记录"""
+        if not records:
+            return
+        start = len(self.records)
+        self.file_index.extend(records)
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), start, start + len(records) - 1)
+        self.records.extend(records)
+        self.checked.extend(bytes(len(records)))
+        self.statuses.extend(["待处理"] * len(records))
+        self.total_bytes += sum(record['size'] for record in records)
+        if self.rows is None:
+            self.endInsertRows()
+        elif self._sortKey()[0] is None:
+            # 只筛选新加入的记录，符合条件的追加到末尾
+            rows = self.file_index.filter(self._terms, range(start, len(self.records)))
+            if rows:
+                self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+                self.rows.extend(rows)
+                self.endInsertRows()
+        else:
+            self._applyView()
+
+    def clear(self):
+        self.beginResetModel()
+        self.records = []
+        self.file_index = FileIndex()
+        self.checked = bytearray()
+        self.statuses = []
+        self.total_bytes = 0
+        self.checked_count = 0
+        self.checked_bytes = 0
+        self.visible_checked = 0
+        self.rows = None if not self._terms and self._sortKey()[0] is None else []
+        self.endResetModel()
+        self.checkChanged.emit()
+
+    def _sortKey(self):
+        # 查询中的 sort: 优先于点击表头的排序
+        return self._query_sort if self._query_sort[0] is not None else self._header_sort
+
+    def _applyView(self):
+        key, reverse = self._sortKey()
+        self.beginResetModel()
+        if not self._terms and key is None:
+            self.rows = None
+        else:
+            self.rows = self.file_index.sort(self.file_index.filter(self._terms), key, reverse)
+        self._countVisible()
+        self.endResetModel()
+
+    def _countVisible(self):
+        if self.rows is None or len(self.rows) == len(self.records):
+            self.visible_checked = self.checked_count
+        else:
+            self.visible_checked = sum(map(self.checked.__getitem__, self.rows))
+
+    def set_filter(self, query):
+        """按查询文字筛选显示的行，语法见 file_index.QUERY_HELP
+
+        查询有误时抛出 ValueError，显示的行不变。
+        """
+        terms, key, reverse = parse_query(query)
+        self._terms = terms
+        self._query_sort = (key, reverse)
+        self._applyView()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        """点击表头排序；选择列和状态列恢复原有顺序"""
+        self._header_sort = (
+            self.SORT_COLUMNS.get(column), order == Qt.SortOrder.DescendingOrder
+        )
+        self._applyView()
+
+    def is_filtered(self):
+        return self.rows is not None and len(self.rows) != len(self.records)
+
+    def has_checked(self):
+        return self.checked_count > 0
+
+    def has_checked_visible(self):
+        """表格中显示的行是否有已勾选的"""
+        return self.visible_checked > 0
+
+    def checked_rows(self):
+        """已勾选的记录下标，按下标排序"""
+        if self.checked_count == 0:
+            return []
+        if self.checked_count == len(self.records):
+            return list(range(len(self.records)))
+        rows = []
+        row = self.checked.find(1)
+        while row != -1 and len(rows) < self.checked_count:
+            rows.append(row)
+            row = self.checked.find(1, row + 1)
+        return rows
+
+    def set_all_checked(self, checked):
+        """勾选或取消勾选表格中显示的所有行，只发送一次变更通知"""
+        if not self.rowCount():
+            return
+        if self.rows is None or len(self.rows) == len(self.records):
+            self.checked = bytearray(b'\x01' * len(self.records)) if checked else bytearray(len(self.records))
+            self.checked_count = len(self.records) if checked else 0
+            self.checked_bytes = self.total_bytes if checked else 0
+        else:
+            flag = 1 if checked else 0
+            for row in self.rows:
+                if self.checked[row] != flag:
+                    self.checked[row] = flag
+                    size = self.records[row]['size']
+                    self.checked_count += 1 if checked else -1
+                    self.checked_bytes += size if checked else -size
+        self.visible_checked = self.rowCount() if checked else 0
+        self.dataChanged.emit(
+            self.index(0, self.COL_CHECK), self.index(self.rowCount() - 1, self.COL_CHECK),
+            [Qt.ItemDataRole.CheckStateRole]
+        )
+        self.checkChanged.emit()
+
+    def clear_checked(self):
+        """取消勾选所有记录，包括未显示的"""
+        self.checked = bytearray(len(self.records))
+        self.checked_count = 0
+        self.checked_bytes = 0
+        self.visible_checked = 0
+        if self.rowCount():
+            self.dataChanged.emit(
+                self.index(0, self.COL_CHECK), self.index(self.rowCount() - 1, self.COL_CHECK),
+                [Qt.ItemDataRole.CheckStateRole]
+            )
+        self.checkChanged.emit()
+
+    def set_statuses(self, statuses):
+        """批量更新状态列 {记录下标: 文字}，只发送一次变更通知"""
+        statuses = {row: text for row, text in statuses.items() if row is not None}
+        for row, text in statuses.items():
+            self.statuses[row] = text
+        if not statuses or not self.rowCount():
+            return
+        if self.rows is None:
+            first, last = min(statuses), max(statuses)
+        else:
+            first, last = 0, len(self.rows) - 1
+        self.dataChanged.emit(
+            self.index(first, self.COL_STATUS), self.index(last, self.COL_STATUS),
+            [Qt.ItemDataRole.DisplayRole]
+        )
+
+class ListWorker(QThread):
+    """在后台线程中获取文件列表，每解析到一批文件就交给界面追加到表格"""
+    files_found = pyqtSignal(list)
+    succeeded = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, share_url, incremental=False, parent=None):
+        super().__init__(parent)
+        self.share_url = share_url
+        self.incremental = incremental
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self):
+        batcher = _Batcher(self.files_found.emit)
+
+        def on_file(file_info):
+            if self._cancelled.is_set():
+                raise ListingCancelled()
+            batcher.add(file_info)
+
+        try:
+            files = onedrive_downloader.getFiles(
+                self.share_url, on_file=on_file, incremental=self.incremental
+            )
+            batcher.flush()
+            if not files:
+                self.failed.emit("获取文件列表失败")
+                return
+            # 生成下载链接文件；增量获取时部分直链来自索引，推送和导出前才刷新
+            get_urls(refresh=False)
+            self.succeeded.emit(len(files))
+        except ListingCancelled:
+            batcher.flush()
+            self.failed.emit("已取消获取文件列表")
+        except Exception as e:
+            batcher.flush()
+            self.failed.emit(f"获取文件列表失败: {str(e)}")
+
+class PushWorker(QThread):
+    """在后台线程中检查aria2、刷新直链并推送选中的文件
+
+    results 信号发送 [(表格行号, 结果)]，结果格式同 Aria2Pool.send。
+    """
+    results = pyqtSignal(list)
+    succeeded = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, config, records, rows, parent=None):
+        super().__init__(parent)
+        self.config = config
+        self.records = records
+        self.rows = rows
+        self.scheduler = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+
+    def run(self):
+        try:
+            row_of = {id(record): row for record, row in zip(self.records, self.rows)}
+            batcher = _Batcher(self.results.emit)
+            with Aria2Pool(self.config) as pool:
+                # 检查所有端点，只有全部不可用时才失败，与批量处理一致
+                error_msg = pool.check()
+                if error_msg:
+                    self.failed.emit(error_msg)
+                    return
+
+                # 推送前刷新即将过期的直链
+                try:
+                    refreshed = refresh_links(self.records)
+                    if refreshed:
+                        logger.info("已刷新 %d 个即将过期的直链", refreshed)
+                except Exception as e:
+                    logger.warning("刷新直链失败，将使用原有直链: %s", e)
+
+                self.scheduler = SubmissionScheduler(pool, self.config.get('schedule', DEFAULT_POLICY))
+                if self._cancelled.is_set():
+                    self.scheduler.cancel()
+                self.scheduler.submit(
+                    self.records, lambda record, result: batcher.add((row_of[id(record)], result))
+                )
+                self.scheduler.close()
+            batcher.flush()
+            self.succeeded.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ExportWorker(QThread):
+    """在后台线程中刷新直链并导出到文件"""
+    succeeded = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+    def __init__(self, records, path, parent=None):
+        super().__init__(parent)
+        self.records = records
+        self.path = path
+
+    def run(self):
+        try:
+            # 导出前刷新即将过期的直链
+            try:
+                refreshed = refresh_links(self.records)
+                if refreshed:
+                    logger.info("已刷新 %d 个即将过期的直链", refreshed)
+            except Exception as e:
+                logger.warning("刷新直链失败，将使用原有直链: %s", e)
+
+            with open(self.path, 'w', encoding='utf-8') as f:
+                for item in self.records:
+                    name = item['name'].strip()
+                    url = item['raw_url'].strip()
+                    size_mb = item['size'] / 1024 / 1024
+                    f.write(f"文件名：{name}\n")
+                    f.write(f"大小：{size_mb:.2f}MB\n")
+                    f.write(f"直链：{url}\n")
+                    f.write("\n")
+            self.succeeded.emit(len(self.records))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ProgressWorker(QThread):
+    """在后台线程中轮询已推送任务的进度
+
+    updated 信号发送 ({GID: 状态文字}, 汇总信息)，只包含状态有变化的任务。
+    """
+    updated = pyqtSignal(dict, dict)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.poller = PollerGroup()
+        self._new = deque()
+        self._texts = {}
+        self._stopped = threading.Event()
+
+    def track(self, pushed):
+        """跟踪新推送的任务 [(端点配置, GID)]，可在任意线程调用"""
+        self._new.extend(pushed)
+
+    def untracked(self):
+        """已提交但线程结束前还没来得及跟踪的任务"""
+        return list(self._new)
+
+    def stop(self):
+        self._stopped.set()
+        self.poller.stop()
+
+    def run(self):
+        try:
+            while not self._stopped.is_set():
+                while self._new:
+                    endpoint, gid = self._new.popleft()
+                    self.poller.track([gid], endpoint)
+                summary = self.poller.poll()
+                changed = {}
+                for gid in self.poller.tracked():
+                    text = format_status(self.poller.status(gid))
+                    if self._texts.get(gid) != text:
+                        self._texts[gid] = text
+                        changed[gid] = text
+                self.updated.emit(changed, summary)
+                if summary['done'] and not self._new:
+                    return
+                # 收到aria2推送的任务通知时立即刷新，否则按轮询间隔
+                self.poller.wait()
+        except Exception as e:
+            self.failed.emit(f"获取下载进度失败: {str(e)}")
+        finally:
+            self.poller.close()
+
 # 定义缓存目录（在程序运行目录下）
 CACHE_DIR = Path('.onedrive_downloader')
 CONFIG_PATH = CACHE_DIR / 'aria2_config.json'
-TEMP_JSON_PATH = CACHE_DIR / 'tmp.json'
 RESULT_PATH = CACHE_DIR / 'result.txt'
 
 def hide_directory(path):
@@ -52,18 +518,20 @@ def hide_directory(path):
             FILE_ATTRIBUTE_HIDDEN = 0x02
             ret = ctypes.windll.kernel32.SetFileAttributesW(str(path), FILE_ATTRIBUTE_HIDDEN)
             if not ret:  # 返回0表示失败
-                print(f"设置隐藏属性失败: {ctypes.get_last_error()}")
+                logger.warning("设置隐藏属性失败: %s", ctypes.get_last_error())
         except Exception as e:
-            print(f"设置隐藏属性时出错: {e}")
+            logger.warning("设置隐藏属性时出错: %s", e)
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         
         # 只在GUI模式下重定向输出
+        self.redirector = None
         if not sys.stdout.isatty():  # 检查是否在终端中运行
-            sys.stdout = TextRedirector(self.show_status)
-            sys.stderr = TextRedirector(self.show_status)
+            self.redirector = TextRedirector(self.show_status)
+            sys.stdout = self.redirector
+            sys.stderr = self.redirector
         
         # 使用version.py中定义的版本号
         self.version = f"v{__version__}"
@@ -86,16 +554,16 @@ class MainWindow(QMainWindow):
             QMainWindow {
                 background-color: #f5f5f5;
             }
-            QTableWidget {
+            QTableView {
                 background-color: white;
                 border: 1px solid #ddd;
                 border-radius: 4px;
                 padding: 2px;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #e3f2fd;
             }
             QLineEdit {
@@ -116,10 +584,7 @@ class MainWindow(QMainWindow):
             QLabel {
                 color: #333;
             }
-            QCheckBox {
-                padding: 5px;
-            }
-            QCheckBox::indicator {
+            QTableView::indicator {
                 width: 18px;
                 height: 18px;
             }
@@ -204,6 +669,10 @@ class MainWindow(QMainWindow):
         self.get_files_btn.setEnabled(False)
         link_layout.addWidget(QLabel("分享链接:"))
         link_layout.addWidget(self.link_input)
+        # 增量获取：只重新请求上次获取以来有变化的文件夹
+        self.incremental_check = QCheckBox("增量获取")
+        self.incremental_check.setToolTip("根据本地索引只重新获取有变化的文件夹，适合再次获取同一分享")
+        link_layout.addWidget(self.incremental_check)
         link_layout.addWidget(self.get_files_btn)
         layout.addLayout(link_layout)
         
@@ -223,12 +692,27 @@ class MainWindow(QMainWindow):
         config_layout.addWidget(self.secret_input)
         layout.addLayout(config_layout)
         
+        # 文件列表筛选
+        filter_layout = QHBoxLayout()
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("输入关键词筛选，例如: ext:mp4 size>100M sort:-size")
+        self.filter_input.setToolTip(QUERY_HELP)
+        self.filter_input.setClearButtonEnabled(True)
+        self.filter_input.textChanged.connect(self.filter_files)
+        self.filter_input.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.filter_input.customContextMenuRequested.connect(self.show_context_menu)
+        filter_layout.addWidget(QLabel("筛选:"))
+        filter_layout.addWidget(self.filter_input)
+        layout.addLayout(filter_layout)
+        
         # 文件列表
-        self.file_table = QTableWidget()
-        self.file_table.setColumnCount(4)
-        self.file_table.setHorizontalHeaderLabels(["选择", "文件名", "大小", "状态"])
-        # 用于跟踪是否正在批量更新复选框
-        self.is_batch_updating = False
+        self.file_model = FileTableModel(self)
+        self.file_model.checkChanged.connect(self.on_checkbox_changed)
+        self.file_table = QTableView()
+        self.file_table.setModel(self.file_model)
+        # 固定行高，避免按内容逐行计算高度
+        self.file_table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.file_table.verticalHeader().setDefaultSectionSize(36)
         layout.addWidget(self.file_table)
         
         # 修改文件表格的样式
@@ -247,6 +731,12 @@ class MainWindow(QMainWindow):
         self.file_table.setColumnWidth(1, 400)  # 文件名列宽度
         self.file_table.setColumnWidth(2, 100)  # 大小列宽度
         self.file_table.setColumnWidth(3, 150)  # 状态列宽度
+        # 点击文件名或大小列的表头排序
+        header = self.file_table.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        header.setSortIndicatorShown(True)
+        header.sortIndicatorChanged.connect(self.file_model.sort)
         
         # 操作按钮
         btn_layout = QHBoxLayout()
@@ -302,7 +792,12 @@ class MainWindow(QMainWindow):
             }
         """)
         
+        # 已选文件数和总大小
+        self.selection_label = QLabel("已选择 0/0 个文件，共 0.00GB")
+        
         btn_layout.addWidget(self.select_all_btn)
+        btn_layout.addWidget(self.selection_label)
+        btn_layout.addStretch()
         btn_layout.addWidget(self.export_btn)
         btn_layout.addWidget(self.download_btn)
         layout.addLayout(btn_layout)
@@ -334,6 +829,20 @@ class MainWindow(QMainWindow):
         status_layout.addWidget(version_label)
         layout.addLayout(status_layout)
         
+        # 后台线程：获取列表、推送、导出和进度轮询
+        self.list_worker = None
+        self.push_worker = None
+        self.export_worker = None
+        self.progress_worker = None
+        # 已推送任务的 GID -> 表格行号
+        self.gid_rows = {}
+        
+        # 定时显示后台线程的输出
+        if self.redirector is not None:
+            self.output_timer = QTimer(self)
+            self.output_timer.timeout.connect(self.redirector.drain)
+            self.output_timer.start(100)
+        
         # 加载aria2配置
         self.load_aria2_config()
         
@@ -363,122 +872,101 @@ class MainWindow(QMainWindow):
                 self.secret_input.setText(config.get('secret', ''))
     
     def get_file_list(self):
-        """获取文件列表"""
-        # 禁用按钮，避免重复点击
-        self.get_files_btn.setEnabled(False)
+        """获取文件列表，正在获取时再次点击则取消"""
+        if self.list_worker is not None:
+            self.list_worker.cancel()
+            self.get_files_btn.setEnabled(False)
+            self.show_status("正在取消获取文件列表...")
+            return
+        
+        # 清空文件表格，旧的行号不再有效，停止进度轮询
+        self.stop_progress()
+        self.file_model.clear()
+        self.select_all_btn.setEnabled(False)
+        self.download_btn.setEnabled(False)
+        self.export_btn.setEnabled(False)
         self.link_input.setEnabled(False)
+        self.get_files_btn.setText("取消获取")
         
-        try:
-            # 清空文件表格
-            self.file_table.setRowCount(0)
-            
-            # 获取文件列表
-            share_url = self.link_input.text().strip()
-            if not onedrive_downloader.get_onedrive_files(share_url):
-                self.show_status("获取文件列表失败")
-                return
-            
-            # 生成下载链接文件
-            get_urls()
-            
-            # 读取文件列表
-            # 确保缓存目录存在
-            CACHE_DIR.mkdir(parents=True, exist_ok=True)
-            
-            try:
-                with TEMP_JSON_PATH.open('r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # 填充表格
-                self.file_table.setRowCount(len(data))
-                for i, item in enumerate(data):
-                    # 添加复选框
-                    chk = QCheckBox()
-                    chk.toggled.connect(self.on_checkbox_changed)
-                    self.file_table.setCellWidget(i, 0, chk)
-                    
-                    # 添加文件名
-                    self.file_table.setItem(i, 1, QTableWidgetItem(item['name']))
-                    
-                    # 添加文件大小
-                    size_mb = item['size'] / 1024 / 1024
-                    self.file_table.setItem(i, 2, QTableWidgetItem(f"{size_mb:.2f}MB"))
-                    
-                    # 添加状态列
-                    self.file_table.setItem(i, 3, QTableWidgetItem("待处理"))
-                
-                # 启用相关按钮
-                self.select_all_btn.setEnabled(True)
-                
-                # 显示文件总数和大小
-                total_size_gb = sum(item['size'] for item in data) / 1024 / 1024 / 1024
-                self.show_status(f"已获取 {len(data)} 个文件，总大小: {total_size_gb:.2f}GB")
-                
-            except Exception as e:
-                self.show_status(f"解析文件列表失败: {str(e)}")
-                
-        except Exception as e:
-            self.show_status(f"获取文件列表失败: {str(e)}")
-        finally:
-            # 恢复按钮状态
-            self.get_files_btn.setEnabled(True)
-            self.link_input.setEnabled(True)
+        # 确保缓存目录存在
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        
+        # 在后台线程中获取，边解析边填充表格
+        share_url = self.link_input.text().strip()
+        self.list_worker = ListWorker(share_url, self.incremental_check.isChecked(), self)
+        self.list_worker.files_found.connect(self.append_files)
+        self.list_worker.succeeded.connect(self.on_list_succeeded)
+        self.list_worker.failed.connect(self.show_status)
+        self.list_worker.finished.connect(self.on_list_finished)
+        self.list_worker.start()
+    
+    def append_files(self, files):
+        """把新解析到的一批文件追加到表格"""
+        self.file_model.append(files)
+        if files:
+            self.select_all_btn.setEnabled(True)
+            self.on_checkbox_changed()
+    
+    def on_list_succeeded(self, count):
+        """文件列表获取完成"""
+        # 显示文件总数和大小
+        total_size_gb = self.file_model.total_bytes / 1024 / 1024 / 1024
+        self.show_status(f"已获取 {count} 个文件，总大小: {total_size_gb:.2f}GB")
     
-    def on_checkbox_changed(self, checked):
-        """复选框状态改变时更新按钮状态"""
-        if self.is_batch_updating:
+    def on_list_finished(self):
+        """获取线程结束后恢复按钮状态"""
+        self.list_worker = None
+        self.get_files_btn.setText("获取文件列表")
+        self.get_files_btn.setEnabled(True)
+        self.link_input.setEnabled(True)
+    
+    def on_checkbox_changed(self):
+        """勾选状态改变时更新已选统计和按钮状态"""
+        model = self.file_model
+        text = (
+            f"已选择 {model.checked_count}/{len(model.records)} 个文件，"
+            f"共 {model.checked_bytes / 1024 / 1024 / 1024:.2f}GB"
+        )
+        if model.is_filtered():
+            text += f"（筛选出 {model.rowCount()} 个）"
+        self.selection_label.setText(text)
+        if self.push_worker is not None or self.export_worker is not None:
             return
-            
-        # 检查是否有选中的项目
-        has_checked = False
-        for i in range(self.file_table.rowCount()):
-            chk = self.file_table.cellWidget(i, 0)
-            if isinstance(chk, QCheckBox) and chk.isChecked():
-                has_checked = True
-                break
+        has_checked = model.has_checked()
+        has_checked_visible = model.has_checked_visible()
         
         # 更新下载按钮和导出按钮状态
         self.download_btn.setEnabled(has_checked)
         self.export_btn.setEnabled(has_checked)
         
         # 更新全选按钮文字
-        self.select_all_btn.setText("取消选择" if has_checked else "全选")
+        self.select_all_btn.setText("取消选择" if has_checked_visible else "全选")
     
     def select_all_files(self):
-        """全选/取消全选"""
-        # 检查当前选中状态
-        any_checked = False
-        for i in range(self.file_table.rowCount()):
-            chk = self.file_table.cellWidget(i, 0)
-            if isinstance(chk, QCheckBox) and chk.isChecked():
-                any_checked = True
-                break
-        
-        # 根据当前状态切换
-        new_state = not any_checked
-        
-        # 更新按钮文字
-        self.select_all_btn.setText("取消选择" if new_state else "全选")
-        
-        # 设置所有复选框状态
-        self.is_batch_updating = True
-        for i in range(self.file_table.rowCount()):
-            chk = self.file_table.cellWidget(i, 0)
-            if isinstance(chk, QCheckBox):
-                chk.setChecked(new_state)
-        self.is_batch_updating = False
-        
-        # 更新下载按钮和导出按钮状态
-        self.download_btn.setEnabled(new_state)
-        self.export_btn.setEnabled(new_state)
+        """全选/取消全选，筛选时只作用于筛选出的文件"""
+        # 根据当前选中状态切换
+        self.file_model.set_all_checked(not self.file_model.has_checked_visible())
+    
+    def filter_files(self, text):
+        """按输入的查询筛选文件列表"""
+        try:
+            self.file_model.set_filter(text)
+        except ValueError as e:
+            # 输入到一半的查询可能暂时无效，保持当前结果
+            self.filter_input.setToolTip(f"{str(e)}\n\n{QUERY_HELP}")
+            return
+        self.filter_input.setToolTip(QUERY_HELP)
+        self.on_checkbox_changed()
     
     def download_selected(self):
-        """下载选中的文件"""
-        selected = []
-        for i in range(self.file_table.rowCount()):
-            chk = self.file_table.cellWidget(i, 0)
-            if isinstance(chk, QCheckBox) and chk.isChecked():
-                selected.append(i)
+        """下载选中的文件，正在推送时再次点击则取消"""
+        if self.push_worker is not None:
+            self.push_worker.cancel()
+            self.download_btn.setEnabled(False)
+            self.show_status("正在取消推送，当前这一批推送完成后停止...")
+            return
+        
+        selected = self.file_model.checked_rows()
         
         if not selected:
             self.show_status("请先选择要推送的文件")
@@ -498,106 +986,143 @@ class MainWindow(QMainWindow):
             self.show_status("RPC地址格式错误，必须以/jsonrpc结尾")
             return
         
-        # 构建配置
-        config = {
-            'rpc': rpc_url,
-            'secret': self.secret_input.text().strip()
-        }
+        # 以配置文件为基础构建配置：分段档位、文件夹结构、推送顺序等设置保持不变；
+        # 设置了多个aria2端点且RPC地址未改动时，按端点池分发任务
+        config = with_rpc(load_config(), rpc_url, self.secret_input.text().strip())
         
-        # 3. 检查RPC服务器是否联通
-        try:
-            test_data = {
-                'jsonrpc': '2.0',
-                'method': 'aria2.getVersion',
-                'id': 1,
-                'params': []
-            }
-            test_response = requests.post(rpc_url, json=test_data, timeout=5)
-            test_result = test_response.json()
-        except requests.exceptions.ConnectionError:
-            self.show_status("推送失败: RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动")
-            return
-        except requests.exceptions.Timeout:
-            self.show_status("推送失败: RPC地址连接超时，请检查地址是否正确")
-            return
-        except Exception as e:
-            error_msg = str(e)
-            if 'Expecting value' in error_msg:
-                self.show_status("推送失败: RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动")
+        # 在后台线程中检查RPC服务器、刷新直链并推送，结果逐批显示在状态列
+        self.push_config = config
+        self.push_success = 0
+        self.push_errors = []
+        self.push_pending = set(selected)
+        self.file_model.set_statuses(dict.fromkeys(selected, "推送中"))
+        records = self.file_model.records
+        self.push_worker = PushWorker(config, [records[i] for i in selected], selected, self)
+        self.push_worker.results.connect(self.on_push_results)
+        self.push_worker.succeeded.connect(self.on_push_succeeded)
+        self.push_worker.failed.connect(self.on_push_failed)
+        self.push_worker.finished.connect(self.on_push_finished)
+        self.download_btn.setText("取消推送")
+        self.get_files_btn.setEnabled(False)
+        self.select_all_btn.setEnabled(False)
+        self.export_btn.setEnabled(False)
+        self.push_worker.start()
+    
+    def on_push_results(self, results):
+        """显示一批推送结果，并开始跟踪推送成功的任务"""
+        pushed = []
+        statuses = {}
+        for i, result in results:
+            self.push_pending.discard(i)
+            if 'result' in result:
+                statuses[i] = "已成功推送到Aria2"
+                pushed.append((result['endpoint'], result['result'], i))
+                self.push_success += 1
             else:
-                self.show_status(f"推送失败: {error_msg}")
-            return
-        
-        # 4. 检查服务器是否需要密码
-        if 'error' in test_result and 'Unauthorized' in str(test_result.get('error', {}).get('message', '')):
-            if not self.secret_input.text().strip():
-                self.show_status("当前RPC地址需要密码验证，请输入RPC密码")
+                error_msg = result.get('error', {}).get('message', '未知错误')
+                statuses[i] = f"失败: {error_msg}"
+                self.push_errors.append(error_msg)
+        self.file_model.set_statuses(statuses)
+        if pushed:
+            self.start_progress(pushed)
+    
+    def on_push_failed(self, error_msg):
+        """推送前的检查或推送过程出错"""
+        if error_msg == '服务端需要密码验证':
+            self.show_status("当前RPC地址需要密码验证，请输入RPC密码")
+        elif 'Connection refused' in error_msg:
+            self.show_status("推送失败: RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动")
+        else:
+            self.show_status(f"推送失败: {error_msg}")
+    
+    def on_push_succeeded(self):
+        """推送结束后汇总结果，询问是否保存配置并清空选择"""
+        success = self.push_success
+        if success == 0 and self.push_errors:
+            error_msg = self.push_errors[0]
+            if error_msg == 'RPC密码错误':
+                self.show_status("推送失败: Aria2 RPC密码错误")
+                return
+            elif 'Connection refused' in str(error_msg):
+                self.show_status("推送失败: Aria2 RPC地址连接失败，请检查地址是否正确或Aria2是否已启动")
                 return
         
-        try:
-            # 读取文件列表
-            with TEMP_JSON_PATH.open('r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 下载选中的文件
-            success = 0
-            for i in selected:
-                item = data[i]
-                result = send_to_aria2(item['name'], item['raw_url'], config)
-                if 'result' in result:
-                    self.file_table.setItem(i, 3, QTableWidgetItem("已成功推送到Aria2"))
-                    success += 1
-                else:
-                    error_msg = result.get('error', {}).get('message', '未知错误')
-                    if 'Unauthorized' in str(error_msg):
-                        error_msg = 'RPC密码错误'
-                        self.show_status("推送失败: Aria2 RPC密码错误")
-                        self.file_table.setItem(i, 3, QTableWidgetItem(f"失败: {error_msg}"))
-                        return
-                    elif 'Connection refused' in str(error_msg):
-                        self.show_status("推送失败: Aria2 RPC地址连接失败，请检查地址是否正确或Aria2是否已启动")
-                        self.file_table.setItem(i, 3, QTableWidgetItem(f"失败: {error_msg}"))
-                        return
-                    else:
-                        self.show_status(f"推送失败: {error_msg}")
-                        self.file_table.setItem(i, 3, QTableWidgetItem(f"失败: {error_msg}"))
-                        return
-            
-            self.show_status(f"推送完成: 成功 {success} 个，失败 {len(selected)-success} 个")
-            
-            # 第一次推送成功后询问是否保存配置
-            if success > 0:
-                reply = QMessageBox.question(
-                    self, 
-                    '保存配置',
-                    '是否保存当前的aria2配置？\n'
-                    f'RPC地址: {self.rpc_input.text()}\n'
-                    f'RPC密码: {self.secret_input.text()}',
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
-                )
-                if reply == QMessageBox.StandardButton.Yes:
-                    save_config(config)
-                    self.show_status("aria2配置已保存")
-            
-            # 下载成功后清空选择
-            self.is_batch_updating = True
-            for i in range(self.file_table.rowCount()):
-                chk = self.file_table.cellWidget(i, 0)
-                if isinstance(chk, QCheckBox):
-                    chk.setChecked(False)
-            self.is_batch_updating = False
-            
-            # 更新按钮状态
-            self.select_all_btn.setText("全选")
-            self.download_btn.setEnabled(False)
-            self.export_btn.setEnabled(False)
+        message = f"推送完成: 成功 {success} 个，失败 {len(self.push_errors)} 个"
+        if self.push_pending:
+            message += f"，取消 {len(self.push_pending)} 个"
+        self.show_status(message)
+        
+        # 第一次推送成功后询问是否保存配置
+        if success > 0:
+            reply = QMessageBox.question(
+                self, 
+                '保存配置',
+                '是否保存当前的aria2配置？\n'
+                f'RPC地址: {self.rpc_input.text()}\n'
+                f'RPC密码: {self.secret_input.text()}',
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+            )
+            if reply == QMessageBox.StandardButton.Yes:
+                save_config(self.push_config)
+                self.show_status("aria2配置已保存")
+        
+        # 下载成功后清空选择
+        self.file_model.clear_checked()
+    
+    def on_push_finished(self):
+        """推送线程结束后恢复按钮状态"""
+        self.push_worker = None
+        # 未推送的文件恢复为待处理
+        self.file_model.set_statuses(dict.fromkeys(self.push_pending, "待处理"))
+        self.push_pending = set()
+        self.download_btn.setText("推送到Aria2")
+        self.get_files_btn.setEnabled(self.link_input.text().strip().startswith('https://1drv.ms/'))
+        self.select_all_btn.setEnabled(self.file_model.rowCount() > 0)
+        self.on_checkbox_changed()
+    
+    def start_progress(self, pushed):
+        """开始在后台轮询新推送任务的进度，结果显示在状态列
 
-        except Exception as e:
-            error_msg = str(e)
-            if 'Connection refused' in error_msg:
-                self.show_status("推送失败: RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动")
-            else:
-                self.show_status(f"推送失败: {error_msg}")
+        pushed 为 [(端点配置, GID, 表格行号)]
+        """
+        for endpoint, gid, row in pushed:
+            self.gid_rows[gid] = row
+        items = [(endpoint, gid) for endpoint, gid, _ in pushed]
+        if self.progress_worker is None:
+            self.progress_worker = ProgressWorker(self)
+            self.progress_worker.updated.connect(self.on_progress)
+            self.progress_worker.failed.connect(self.show_status)
+            self.progress_worker.finished.connect(self.on_progress_finished)
+            self.progress_worker.track(items)
+            self.progress_worker.start()
+        else:
+            self.progress_worker.track(items)
+    
+    def stop_progress(self):
+        """停止进度轮询"""
+        if self.progress_worker is not None:
+            self.progress_worker.stop()
+            self.progress_worker.updated.disconnect(self.on_progress)
+            self.progress_worker.failed.disconnect(self.show_status)
+            self.progress_worker.finished.disconnect(self.on_progress_finished)
+            self.progress_worker = None
+        self.gid_rows = {}
+    
+    def on_progress(self, changed, summary):
+        """更新状态有变化的任务"""
+        self.file_model.set_statuses({self.gid_rows.get(gid): text for gid, text in changed.items()})
+        if summary['done']:
+            self.show_status(f"下载结束: {format_summary(summary)}")
+    
+    def on_progress_finished(self):
+        """轮询线程结束；结束前刚推送的任务由新的线程继续跟踪"""
+        worker = self.progress_worker
+        self.progress_worker = None
+        leftover = worker.untracked() if worker is not None else []
+        if leftover:
+            self.start_progress([
+                (endpoint, gid, self.gid_rows.get(gid)) for endpoint, gid in leftover
+            ])
     
     def show_status(self, msg):
         """显示状态信息"""
@@ -716,63 +1241,57 @@ class MainWindow(QMainWindow):
         menu.exec(text_edit.mapToGlobal(pos))
 
     def export_links(self):
-        """导出选中文件的直链"""
-        try:
-            # 读取文件列表
-            with TEMP_JSON_PATH.open('r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 获取选中的文件
-            selected = []
-            for i in range(self.file_table.rowCount()):
-                chk = self.file_table.cellWidget(i, 0)
-                if isinstance(chk, QCheckBox) and chk.isChecked():
-                    selected.append(i)
-            
-            if not selected:
-                self.show_status("请先选择要导出的文件")
-                return
-            
-            # 导出直链到文件
-            with open('直链.txt', 'w', encoding='utf-8') as f:
-                for i in selected:
-                    item = data[i]
-                    name = item['name'].strip()
-                    url = item['raw_url'].strip()
-                    size_mb = item['size'] / 1024 / 1024
-                    f.write(f"文件名：{name}\n")
-                    f.write(f"大小：{size_mb:.2f}MB\n")
-                    f.write(f"直链：{url}\n")
-                    f.write("\n")
-            
-            # 显示成功提示
-            msg = QMessageBox(self)
-            msg.setIcon(QMessageBox.Icon.Information)
-            msg.setWindowTitle("导出成功")
-            msg.setText("直链已导出到软件目录下的'直链.txt'文件中")
-            msg.setInformativeText("请注意：直链有效期为1小时，超时后需要重新获取！")
-            msg.setDetailedText(f"保存位置：{os.path.abspath('直链.txt')}")
-            msg.exec()
-            
-            self.show_status(f"已导出 {len(selected)} 个文件的直链")
-            
-            # 导出成功后清空选择
-            self.is_batch_updating = True
-            for i in range(self.file_table.rowCount()):
-                chk = self.file_table.cellWidget(i, 0)
-                if isinstance(chk, QCheckBox):
-                    chk.setChecked(False)
-            self.is_batch_updating = False
-            
-            # 更新按钮状态
-            self.select_all_btn.setText("全选")
-            self.download_btn.setEnabled(False)
-            self.export_btn.setEnabled(False)
-            
-        except Exception as e:
-            self.show_status(f"导出失败: {str(e)}")
+        """导出选中文件的直链，刷新直链和写文件在后台线程中进行"""
+        if self.export_worker is not None:
+            return
+        
+        # 获取选中的文件
+        selected = self.file_model.checked_rows()
+        
+        if not selected:
+            self.show_status("请先选择要导出的文件")
+            return
+        
+        self.export_btn.setEnabled(False)
+        self.export_worker = ExportWorker([self.file_model.records[i] for i in selected], '直链.txt', self)
+        self.export_worker.succeeded.connect(self.on_export_succeeded)
+        self.export_worker.failed.connect(lambda error: self.show_status(f"导出失败: {error}"))
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.start()
+    
+    def on_export_succeeded(self, count):
+        """导出完成后提示并清空选择"""
+        # 显示成功提示
+        msg = QMessageBox(self)
+        msg.setIcon(QMessageBox.Icon.Information)
+        msg.setWindowTitle("导出成功")
+        msg.setText("直链已导出到软件目录下的'直链.txt'文件中")
+        msg.setInformativeText("请注意：直链有效期为1小时，超时后需要重新获取！")
+        msg.setDetailedText(f"保存位置：{os.path.abspath('直链.txt')}")
+        msg.exec()
+        
+        self.show_status(f"已导出 {count} 个文件的直链")
+        
+        # 导出成功后清空选择
+        self.file_model.clear_checked()
+    
+    def on_export_finished(self):
+        self.export_worker = None
+        self.on_checkbox_changed()
+    
+    def closeEvent(self, event):
+        """关闭窗口时停止后台线程"""
+        for worker in (self.list_worker, self.push_worker):
+            if worker is not None:
+                worker.cancel()
+        self.stop_progress()
+        for worker in self.findChildren(QThread):
+            worker.wait(5000)
+        super().closeEvent(event)
 
 def main():
+    # 默认只在状态栏显示进度和结果，调试时设置环境变量 ONEDRIVE_LOG_LEVEL=DEBUG
+    setup_logging()
     app = QApplication(sys.argv)
     # 设置中文本地化
     from PyQt6.QtCore import QTranslator, QLocale
@@ -0,0 +1,203 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+# 定义缓存目录（在程序运行目录下）
+CACHE_DIR = Path('.onedrive_downloader')
+LISTING_PATH = CACHE_DIR / 'tmp.jsonl'
+
+# 列表开头的元信息（如分享链接）和写完后追加的结束标记
+META_MARKER = "@listing"
+END_MARKER = "@end"
+
+# 写入时最长隔多久刷新一次缓冲区，便于其他进程边写边读（秒）
+FLUSH_INTERVAL = 0.5
+
+class FileRecord:
+    """一个文件的列表记录
+
+    使用 __slots__ 保存固定的几个字段，比同样内容的字典小得多；文件夹ID
+    经过驻留，同一文件夹下的记录共用一个字符串；哈希只保留校验用到的
+    sha1Hash 和 quickXorHash 两个值，读取 hashes 时才组装成字典。
+    为兼容原先按字典使用记录的代码，支持 record['name']、record.get()
+    和就地赋值 record['raw_url'] = ...。
+    """
+    FIELDS = ('name', 'size', 'raw_url', 'id', 'folder', 'fetched_at', 'hashes')
+    __slots__ = ('name', 'size', 'raw_url', 'id', 'folder', 'fetched_at', '_sha1', '_quickXor')
+
+    def __init__(self, name, size=0, raw_url='', id=None, folder=None, fetched_at=0, hashes=None):
+        self.name = name
+        self.size = size or 0
+        self.raw_url = raw_url or ''
+        self.id = id
+        self.folder = sys.intern(folder) if folder else folder
+        self.fetched_at = fetched_at
+        self.hashes = hashes
+
+    @property
+    def hashes(self):
+        """{'sha1Hash': ..., 'quickXorHash': ...}，都没有时为 None"""
+        hashes = {}
+        if self._sha1:
+            hashes['sha1Hash'] = self._sha1
+        if self._quickXor:
+            hashes['quickXorHash'] = self._quickXor
+        return hashes or None
+
+    @hashes.setter
+    def hashes(self, hashes):
+        hashes = hashes or {}
+        self._sha1 = hashes.get('sha1Hash')
+        self._quickXor = hashes.get('quickXorHash')
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get('name'), data.get('size', 0), data.get('raw_url', ''), data.get('id'),
+            data.get('folder'), data.get('fetched_at', 0), data.get('hashes'),
+        )
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in self.FIELDS else None
+        return default if value is None else value
+
+    def keys(self):
+        return self.FIELDS
+
+    def __repr__(self):
+        return f"FileRecord({self.to_dict()!r})"
+
+
+class ListingWriter:
+    """以追加方式写入文件列表，每行一条JSON记录
+
+    传入 meta 时首行写入 {"@listing": meta}。正常结束时追加一行结束标记
+    {"@end": true, "count": N}；中途出错时不写标记，读取方据此判断列表
+    不完整。
+    """
+
+    def __init__(self, path=LISTING_PATH, meta=None):
+        self.path = Path(path)
+        self.meta = meta
+        self.count = 0
+        self._file = None
+        self._last_flush = 0
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
+
+    def open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open('w', encoding='utf-8')
+        if self.meta is not None:
+            self._file.write(json.dumps({META_MARKER: self.meta}, ensure_ascii=False))
+            self._file.write("\n")
+        self._last_flush = time.monotonic()
+        return self
+
+    def write(self, record):
+        """追加一条文件记录"""
+        if isinstance(record, FileRecord):
+            record = record.to_dict()
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.count += 1
+        now = time.monotonic()
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def finish(self):
+        """写入结束标记并关闭文件"""
+        self._file.write(json.dumps({END_MARKER: True, "count": self.count}))
+        self._file.write("\n")
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def iter_listing(path=LISTING_PATH, follow=False, poll_interval=FLUSH_INTERVAL):
+    """逐条读取文件列表，产出 FileRecord
+
+    follow为True时像 tail -f 一样等待正在写入的列表，直到读到结束标记；
+    否则读到文件末尾即停止，末尾未写完的半行会被忽略。
+    """
+    with Path(path).open('r', encoding='utf-8') as f:
+        pending = ""
+        while True:
+            line = f.readline()
+            if not line:
+                if not follow:
+                    return
+                time.sleep(poll_interval)
+                continue
+            pending += line
+            if not pending.endswith("\n"):
+                continue
+            record = json.loads(pending)
+            pending = ""
+            if record.get(END_MARKER):
+                return
+            if META_MARKER in record:
+                continue
+            yield FileRecord.from_dict(record)
+
+
+def load_listing(path=LISTING_PATH):
+    """读取完整的文件列表，返回记录列表"""
+    return list(iter_listing(path))
+
+
+def listing_meta(path=LISTING_PATH):
+    """读取列表首行的元信息，没有时返回空字典"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with path.open('r', encoding='utf-8') as f:
+        line = f.readline()
+    try:
+        return json.loads(line).get(META_MARKER) or {}
+    except ValueError:
+        return {}
+
+
+def listing_complete(path=LISTING_PATH):
+    """列表是否已经写完（末行为结束标记）"""
+    path = Path(path)
+    if not path.exists():
+        return False
+    with path.open('rb') as f:
+        f.seek(0, 2)
+        f.seek(max(f.tell() - 256, 0))
+        tail = f.read().decode('utf-8', errors='ignore').rstrip("\n")
+    last_line = tail.rsplit("\n", 1)[-1]
+    try:
+        return bool(json.loads(last_line).get(END_MARKER))
+    except ValueError:
+        return False
@@ -0,0 +1,208 @@
+import json
+import logging
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+
+from listing_cache import LISTING_PATH, FileRecord, iter_listing, listing_complete, listing_meta
+
+logger = logging.getLogger(__name__)
+
+# 快照文件与列表缓存放在一起，文件名相同、后缀不同
+SNAPSHOT_SUFFIX = '.snapshot'
+
+MAGIC = b'ODLS'
+VERSION = 1
+
+# 文件头：标识、版本、记录数、生成快照时列表缓存的大小和修改时间（纳秒）、元信息长度
+HEADER = struct.Struct('<4sIQQQI')
+
+# 每条记录定长：大小、直链获取时间，以及 6 个字符串在字符串区中的 (偏移, 长度)，
+# 依次为文件名、直链、条目ID、文件夹ID、sha1Hash、quickXorHash
+RECORD = struct.Struct('<Qd' + 'QI' * 6)
+
+# 字符串为 None 时的长度
+NONE = 0xFFFFFFFF
+
+
+def snapshot_path(listing_path=LISTING_PATH):
+    return Path(listing_path).with_suffix(SNAPSHOT_SUFFIX)
+
+
+def _sourceStamp(listing_path):
+    stat = Path(listing_path).stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_snapshot(records, listing_path=LISTING_PATH, meta=None):
+    """把完整的文件列表写成二进制快照，返回快照路径
+
+    快照由文件头、元信息、定长的记录表和字符串区组成。同一文件夹ID在
+    字符串区中只存一份。先写临时文件再替换，读取方不会看到写了一半的快照。
+    """
+    path = snapshot_path(listing_path)
+    source_size, source_mtime = _sourceStamp(listing_path)
+    meta_bytes = json.dumps(meta or {}, ensure_ascii=False).encode('utf-8')
+    count = len(records)
+    heap_start = HEADER.size + len(meta_bytes) + count * RECORD.size
+
+    table = bytearray(count * RECORD.size)
+    folders = {}
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, count, source_size, source_mtime, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.seek(heap_start)
+        heap_size = 0
+
+        def put(value):
+            nonlocal heap_size
+            if value is None:
+                return 0, NONE
+            data = str(value).encode('utf-8')
+            offset = heap_size
+            f.write(data)
+            heap_size += len(data)
+            return offset, len(data)
+
+        for i, record in enumerate(records):
+            hashes = record.get('hashes') or {}
+            folder = record.get('folder')
+            folder_ref = folders.get(folder)
+            if folder_ref is None:
+                folder_ref = folders[folder] = put(folder)
+            RECORD.pack_into(
+                table, i * RECORD.size,
+                record.get('size') or 0, record.get('fetched_at') or 0,
+                *put(record.get('name')), *put(record.get('raw_url')), *put(record.get('id')),
+                *folder_ref, *put(hashes.get('sha1Hash')), *put(hashes.get('quickXorHash')),
+            )
+        f.seek(HEADER.size + len(meta_bytes))
+        f.write(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ListingSnapshot:
+    """以 mmap 方式打开的列表快照，按下标访问时才解码对应的记录
+
+    打开时只读取文件头，与记录数无关；多个进程打开同一快照时共享系统的
+    页缓存。每次访问都解码出新的 FileRecord，需要就地修改（如刷新直链）
+    的调用方应自行保存取出的记录。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = self.path.open('rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        try:
+            magic, version, count, source_size, source_mtime, meta_len = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"不支持的列表快照格式: {self.path}")
+            self.count = count
+            self.source = (source_size, source_mtime)
+            self.meta = json.loads(bytes(self._mm[HEADER.size:HEADER.size + meta_len]).decode('utf-8'))
+            self._table = HEADER.size + meta_len
+            self._heap = self._table + count * RECORD.size
+            if len(self._mm) < self._heap:
+                raise ValueError(f"列表快照不完整: {self.path}")
+        except Exception:
+            self.close()
+            raise
+        # 字符串区偏移 -> 文件夹ID，同一文件夹只解码一次
+        self._folders = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, offset, length):
+        if length == NONE:
+            return None
+        start = self._heap + offset
+        return self._mm[start:start + length].decode('utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        size, fetched_at, *refs = RECORD.unpack_from(self._mm, self._table + index * RECORD.size)
+        folder = self._folders.get(refs[6])
+        if folder is None and refs[7] != NONE:
+            folder = self._folders[refs[6]] = self._string(refs[6], refs[7])
+        sha1, quick_xor = self._string(refs[8], refs[9]), self._string(refs[10], refs[11])
+        hashes = None
+        if sha1 or quick_xor:
+            hashes = {'sha1Hash': sha1, 'quickXorHash': quick_xor}
+        return FileRecord(
+            name=self._string(refs[0], refs[1]),
+            size=size,
+            raw_url=self._string(refs[2], refs[3]),
+            id=self._string(refs[4], refs[5]),
+            folder=folder,
+            fetched_at=fetched_at,
+            hashes=hashes,
+        )
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+def open_snapshot(listing_path=LISTING_PATH):
+    """打开与列表缓存一致的快照；没有快照或列表缓存已变化时返回 None"""
+    path = snapshot_path(listing_path)
+    if not path.exists() or not Path(listing_path).exists():
+        return None
+    try:
+        snapshot = ListingSnapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning("列表快照无法读取，将重新解析列表: %s", e)
+        return None
+    if snapshot.source != _sourceStamp(listing_path):
+        snapshot.close()
+        return None
+    return snapshot
+
+
+@contextmanager
+def open_listing(listing_path=LISTING_PATH):
+    """打开完整的文件列表用于读取，得到可按下标访问和迭代的记录序列
+
+    有最新的快照时直接以 mmap 打开；否则解析列表缓存，列表已写完时顺便
+    生成快照，下次即可直接打开。用法：with open_listing() as records: ...
+    """
+    snapshot = open_snapshot(listing_path)
+    if snapshot is None:
+        records = list(iter_listing(listing_path))
+        if listing_complete(listing_path):
+            try:
+                write_snapshot(records, listing_path, listing_meta(listing_path))
+            except OSError as e:
+                logger.warning("生成列表快照失败: %s", e)
+        yield records
+        return
+    try:
+        yield snapshot
+    finally:
+        snapshot.close()
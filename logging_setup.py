@@ -0,0 +1,73 @@
+import logging
+import os
+import sys
+
+# 未指定级别时读取的环境变量，可设为 DEBUG、INFO、WARNING、ERROR
+LOG_LEVEL_ENV = 'ONEDRIVE_LOG_LEVEL'
+DEFAULT_LEVEL = logging.INFO
+
+# 默认只输出消息本身，与原先的 print 一致；DEBUG 级别附带时间、线程和模块名
+SIMPLE_FORMAT = '%(message)s'
+DEBUG_FORMAT = '%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'
+
+_handler = None
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """写到当前的 sys.stdout
+
+    图形界面会把 sys.stdout 换成 TextRedirector，命令行也可能临时重定向，
+    每次输出时再取 sys.stdout，日志就跟着进入当前的输出目标。
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+
+def parse_level(level):
+    """把级别名（不区分大小写）或数值转换为 logging 的级别"""
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).strip().upper())
+    if not isinstance(value, int):
+        raise ValueError(f"未知的日志级别: {level}")
+    return value
+
+
+def setup_logging(level=None):
+    """配置日志输出并返回生效的级别，重复调用只调整级别
+
+    level 为 None 时读取环境变量 ONEDRIVE_LOG_LEVEL，默认 INFO：只输出进度
+    和结果，逐个文件的信息和接口原始响应只在 DEBUG 级别输出。
+    """
+    global _handler
+    if level is None:
+        level = os.environ.get(LOG_LEVEL_ENV) or DEFAULT_LEVEL
+    try:
+        level = parse_level(level)
+    except ValueError as e:
+        print(f"{str(e)}，使用默认级别 INFO", file=sys.stderr)
+        level = DEFAULT_LEVEL
+    root = logging.getLogger()
+    if _handler is None:
+        _handler = _StdoutHandler()
+        root.addHandler(_handler)
+    _handler.setFormatter(logging.Formatter(DEBUG_FORMAT if level <= logging.DEBUG else SIMPLE_FORMAT))
+    root.setLevel(level)
+    # urllib3 的连接日志只在调试时需要
+    logging.getLogger('urllib3').setLevel(level if level <= logging.DEBUG else logging.WARNING)
+    return level
+
+
+def add_logging_arguments(parser):
+    """给命令行加上 -v/--verbose 和 -q/--quiet"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-v', '--verbose', action='store_const', dest='log_level', const=logging.DEBUG,
+                       help="输出调试信息，包括每个文件和接口原始响应")
+    group.add_argument('-q', '--quiet', action='store_const', dest='log_level', const=logging.WARNING,
+                       help="只输出警告和错误")
+    parser.set_defaults(log_level=None)
@@ -30,7 +30,8 @@ def get_onedrive_files():
     from onedrive_downloader import getFiles
     result = getFiles(share_url, None, 0)
     with open('tmp.json', 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=4)
+        # getFiles 返回 FileRecord，转换为字典后才能写成JSON
+        json.dump([r.to_dict() for r in result], f, ensure_ascii=False, indent=4)
     print(f"成功保存{len(result)}条记录")
     return result
 
@@ -96,6 +97,8 @@ if __name__ == "__main__":
         sys.stderr.reconfigure(encoding='utf-8')
         input_path = os.path.join("data", "input")  # 跨平台路径
         os.system("clear" if os.name == 'posix' else "cls")  # 自动判断平台
+        from logging_setup import setup_logging
+        setup_logging()
         main()
     except Exception as e:
         print(f"程序发生未捕获异常: {str(e)}")
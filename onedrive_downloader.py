@@ -1,9 +1,10 @@
 import json
+import logging
 import re
 import urllib
 import urllib.request
 
-from pprint import pprint
+from pprint import pformat
 from urllib import parse
 
 import requests
@@ -11,13 +12,26 @@ import os
 import copy
 import sys
 import io
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 from requests.models import codes
 from requests.adapters import HTTPAdapter, Retry
 from pathlib import Path
 
+from listing_cache import FileRecord, ListingWriter, listing_meta
+from listing_snapshot import write_snapshot
+from share_index import ShareIndex
+
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
 
+logger = logging.getLogger(__name__)
+
 # 移除所有全局变量
 # 确保没有模块级代码
 
@@ -38,78 +52,190 @@ header = {
 
 # 定义缓存目录（在程序运行目录下）
 CACHE_DIR = Path('.onedrive_downloader')
-TEMP_JSON_PATH = CACHE_DIR / 'tmp.json'
 
 # 确保缓存目录存在
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
+# 并发列出文件夹时的默认线程数
+DEFAULT_WORKERS = 8
+
+# 列出子项时每页的条目数，接口允许的上限为1000
+PAGE_SIZE_MAX = 1000
+DEFAULT_PAGE_SIZE = PAGE_SIZE_MAX
+
+# 令牌接口未返回过期时间时假定的有效期，以及提前刷新和失败重试的间隔（秒）
+TOKEN_TTL = 3600
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_RETRY_DELAY = 30
+
+# 直链有效期约1小时，到期前多久视为需要刷新（秒）
+LINK_TTL = 3600
+LINK_REFRESH_MARGIN = 300
+
+# 推送、导出和直接下载时每批刷新一次其中即将过期直链的记录数
+REFRESH_BATCH = 200
+
+# 获取文件列表时输出进度的间隔（秒）
+PROGRESS_INTERVAL = 2.0
+
+# 列表相关请求的连接超时和读取超时（秒）；没有超时时取消获取要等所有
+# 在途请求返回才能结束
+REQUEST_TIMEOUT = (10, 60)
+
+# 子项请求被限流（429/503）时每页最多重试的次数；优先按 Retry-After 等待，
+# 没有该响应头时从 THROTTLE_BACKOFF 秒起指数退避，单次最长 THROTTLE_MAX_DELAY 秒
+THROTTLE_STATUS = (429, 503)
+THROTTLE_RETRIES = 5
+THROTTLE_BACKOFF = 1.0
+THROTTLE_MAX_DELAY = 60.0
+
 # 首字母大写
 def capitalize(s):
     return s[0].upper() + s[1:]
 
 
-def newSession():
-    s = requests.session()
+def newAdapter(pool_size=DEFAULT_WORKERS):
     retries = Retry(total=5, backoff_factor=0.1)
-    s.mount("http://", HTTPAdapter(max_retries=retries))
+    # 连接池大小与并发线程数一致，避免多线程共用会话时反复建连
+    return HTTPAdapter(
+        max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size
+    )
+
+
+def newSession(pool_size=DEFAULT_WORKERS, adapter=None):
+    """创建会话；传入 adapter 时多个会话共用同一个连接池，但各自保存 Cookie"""
+    s = requests.session()
+    if adapter is None:
+        adapter = newAdapter(pool_size)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
     return s
 
 
-def getFiles(originalPath, req=None, layers=0, _id=0):
-    fileCount = 0
-    filesData = []
-    isSharepoint = False
-    if "-my" not in originalPath:
-        isSharepoint = True
-    if req is None:
-        req = newSession()
-    reqf = req.get(originalPath, headers=header)
-    redirectURL = reqf.url
-    print(redirectURL)
-    rex = re.compile(r"&redeem=(.*)&")
-    redeem = rex.search(redirectURL).group(1)
-
-    query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(redirectURL).query))
-    redirectSplitURL = redirectURL.split("/")
-    appid = "1141147648"
-    appUuid = "5cbed6ac-a083-4e14-b191-b4ba07653de2"
+def clampPageSize(page_size):
+    """把分页大小限制在接口允许的范围内"""
+    return max(1, min(int(page_size), PAGE_SIZE_MAX))
 
-    relativeFolder = ""
-    rootFolder = query["id"]
-    for i in rootFolder.split("/"):
-        if isSharepoint:
-            if i != "Shared Documents":
-                relativeFolder += i + "/"
-            else:
-                relativeFolder += i
-                break
-        else:
-            if i != "Documents":
-                relativeFolder += i + "/"
-            else:
-                relativeFolder += i
-                break
-    relativeUrl = (
-        parse.quote(relativeFolder)
-        .replace("/", "%2F")
-        .replace("_", "%5F")
-        .replace("-", "%2D")
-    )
-    rootFolderUrl = (
-        parse.quote(rootFolder)
-        .replace("/", "%2F")
-        .replace("_", "%5F")
-        .replace("-", "%2D")
-    )
 
-    reqf = req.post("https://api-badgerp.svc.ms/v1.0/token", data={"appId": appUuid})
+def parseTokenExpiry(authData):
+    """从令牌响应中读取过期时间，返回时间戳；缺失时按 TOKEN_TTL 估算"""
+    expiry = authData.get("expiryTimeUtc")
+    if expiry:
+        try:
+            return datetime.fromisoformat(expiry.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    return time.time() + TOKEN_TTL
+
+
+class ShareContext:
+    """单个分享链接的认证上下文
+
+    分享页重定向、令牌和 autoredeem 只在 resolve() 时各请求一次，之后
+    整个遍历共用同一份 redeem、令牌和驱动器ID。令牌临近过期时由后台
+    线程刷新，长时间的遍历不会中途失效。
+
+    metrics 为 request_metrics.RequestMetrics 时，所有请求按阶段记录
+    耗时、状态码、流量和重试次数。
+    """
 
+    appUuid = "5cbed6ac-a083-4e14-b191-b4ba07653de2"
     deviceCode = "5c872a7a-0906-4ccc-a157-2b003598569f"  # 随机生成
 
-    print(reqf.text)
-    authData = json.loads(reqf.text)
-    drives = relativeFolder.split("!")[0]
-    postData = """--{}
+    def __init__(self, share_url, req=None, metrics=None):
+        self.share_url = share_url
+        self.req = req if req is not None else newSession()
+        self.metrics = metrics
+        self.isSharepoint = "-my" not in share_url
+        self.redirectURL = None
+        self.redeem = None
+        self.query = None
+        self.driveId = None
+        self.expiresAt = 0
+        self._body = None
+        self._headers = None
+        self._lock = threading.Lock()
+        # auth() 持有该锁时会调用 refresh()，需可重入
+        self._refresh_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._refresher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def resolve(self, background_refresh=True):
+        """解析分享链接并完成认证，返回自身"""
+        reqf = self.request("redirect", "GET", self.share_url, headers=header)
+        self.redirectURL = reqf.url
+        logger.debug("分享页重定向到: %s", self.redirectURL)
+        rex = re.compile(r"&redeem=(.*)&")
+        self.redeem = rex.search(self.redirectURL).group(1)
+        self.query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.redirectURL).query))
+        self.driveId = self.relativeFolder(self.rootId).split("!")[0].lower()
+
+        self.refresh()
+        if background_refresh and self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refreshLoop, name="onedrive-token", daemon=True
+            )
+            self._refresher.start()
+        return self
+
+    def close(self):
+        """停止后台刷新"""
+        self._stop.set()
+
+    def request(self, phase, method, url, **kwargs):
+        """发出请求，默认带 REQUEST_TIMEOUT 超时；设置了 metrics 时按阶段记录"""
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        if self.metrics is None:
+            return self.req.request(method, url, **kwargs)
+        return self.metrics.request(self.req, phase, method, url, **kwargs)
+
+    @property
+    def rootId(self):
+        """分享根文件夹的ID"""
+        return self.query["id"]
+
+    def relativeFolder(self, folder_id):
+        relativeFolder = ""
+        for i in folder_id.split("/"):
+            if self.isSharepoint:
+                if i != "Shared Documents":
+                    relativeFolder += i + "/"
+                else:
+                    relativeFolder += i
+                    break
+            else:
+                if i != "Documents":
+                    relativeFolder += i + "/"
+                else:
+                    relativeFolder += i
+                    break
+        return relativeFolder
+
+    @staticmethod
+    def subFolderId(folder_id, name):
+        return os.path.join(folder_id, name).replace("\\", "/")
+
+    def childrenUrl(self, folder_id, page_size=DEFAULT_PAGE_SIZE):
+        return "https://my.microsoftpersonalcontent.com/_api/v2.0/drives/{}/items/{}children?%24top={}&orderby=folder%2Cname&%24expand=thumbnails%2Ctags&select=*%2Cocr%2CwebDavUrl%2CsharepointIds%2CisRestricted%2CcommentSettings%2CspecialFolder%2CcontainingDrivePolicyScenarioViewpoint&ump=1".format(
+            self.driveId, self.relativeFolder(folder_id), clampPageSize(page_size)
+        )
+
+    def refresh(self):
+        """重新获取令牌并完成 autoredeem"""
+        with self._refresh_lock:
+            reqf = self.request(
+                "token", "POST", "https://api-badgerp.svc.ms/v1.0/token", data={"appId": self.appUuid}
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("令牌响应: %s", reqf.text)
+            authData = json.loads(reqf.text)
+            postData = """--{}
 Content-Disposition: form-data;name=data
 Prefer: HonorNonIndexedQueriesWarningMayFailRandomly, allowthrottleablequeries, Include-Feature=AddToOneDrive;Vault
 X-ClientService-ClientTag: ODC Web
@@ -122,138 +248,593 @@ Authorization: {} {}
 
 
 --{}--""".format(
-        deviceCode, authData["authScheme"], authData["token"], deviceCode
-    ).replace(
-        "\n", "\r\n"
-    )
+                self.deviceCode, authData["authScheme"], authData["token"], self.deviceCode
+            ).replace(
+                "\n", "\r\n"
+            )
+
+            authHeaderRaw = [
+                {"name": "Accept", "value": "*/*"},
+                {"name": "Accept-Encoding", "value": "gzip, deflate, br, zstd"},
+                {"name": "Accept-Language", "value": "zh-HK,zh-TW;q=0.5"},
+                {"name": "Connection", "value": "keep-alive"},
+                {
+                    "name": "Content-Type",
+                    "value": "multipart/form-data;boundary={}".format(self.deviceCode),
+                },
+                {"name": "Host", "value": "my.microsoftpersonalcontent.com"},
+                {"name": "Origin", "value": "https://onedrive.live.com"},
+                {"name": "Referer", "value": "https://onedrive.live.com/"},
+                {"name": "Sec-Fetch-Dest", "value": "empty"},
+                {"name": "Sec-Fetch-Mode", "value": "cors"},
+                {"name": "Sec-Fetch-Site", "value": "cross-site"},
+                {"name": "TE", "value": "trailers"},
+                {
+                    "name": "User-Agent",
+                    "value": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:135.0) Gecko/20100101 Firefox/135.0",
+                },
+            ]
+
+            # 复制一份，不能修改模块级的header
+            authHeader = dict(header)
+            # 将authHeaderRaw解析成正常的Header
+            for i in authHeaderRaw:
+                authHeader[i["name"]] = i["value"]
+            authHeader["Authorization"] = "{} {}".format(
+                capitalize(authData["authScheme"]), authData["token"]
+            )
+            authHeader["Prefer"] = "autoredeem"
+
+            reqUrl = "https://my.microsoftpersonalcontent.com/_api/v2.0/shares/u!{}/driveitem?%24select=id%2CparentReference".format(
+                self.redeem
+            )
+            logger.debug("autoredeem: %s", reqUrl)
+            self.request(
+                "redeem", "POST", reqUrl,
+                data="%24select=id%2CparentReference",
+                headers=authHeader,
+            )
+            logger.debug("autoredeem 完成")
+
+            with self._lock:
+                self._body = postData.encode("utf-8")
+                self._headers = authHeader
+                self.expiresAt = parseTokenExpiry(authData)
+
+    def _expiring(self):
+        return time.time() >= self.expiresAt - TOKEN_REFRESH_MARGIN
+
+    def auth(self):
+        """返回当前有效的 (请求体, 请求头)
+
+        没有后台刷新线程时，在令牌临近过期的请求上同步刷新。
+        """
+        if self._refresher is None and self._expiring():
+            with self._refresh_lock:
+                if self._expiring():
+                    self.refresh()
+        with self._lock:
+            return self._body, self._headers
+
+    def _refreshLoop(self):
+        while True:
+            delay = max(self.expiresAt - TOKEN_REFRESH_MARGIN - time.time(), 1)
+            if self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("刷新令牌失败: %s", e)
+                if self._stop.wait(TOKEN_RETRY_DELAY):
+                    return
+
+
+def retryAfter(response, attempt):
+    """被限流后重试前等待的秒数：优先用 Retry-After（秒数或HTTP日期），否则指数退避"""
+    value = response.headers.get('Retry-After')
+    delay = None
+    if value:
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        delay = THROTTLE_BACKOFF * 2 ** attempt
+    return min(max(delay, 0), THROTTLE_MAX_DELAY)
+
+
+def iterChildrenPages(context, url, prefetch=True, stopped=None):
+    """逐页获取文件夹子项，自动跟随 @odata.nextLink
+
+    每次产出一页的 value 列表。开启 prefetch 时，在调用方解析当前页的
+    同时于后台线程请求下一页。被限流（429/503）的页按 Retry-After 重试
+    至多 THROTTLE_RETRIES 次，等待期间 stopped 被设置时放弃。某一页仍然
+    失败或无法解析时抛出 RuntimeError，而不是当作最后一页：否则文件夹
+    会被悄悄截断，不完整的结果还会写进列表缓存和本地索引。
+    """
+    def fetch(page_url):
+        logger.debug("请求子项: %s", page_url)
+        for attempt in range(THROTTLE_RETRIES + 1):
+            body, headers = context.auth()
+            reqf = context.request("children", "POST", page_url, data=body, headers=headers)
+            if reqf.status_code not in THROTTLE_STATUS or attempt == THROTTLE_RETRIES:
+                break
+            delay = retryAfter(reqf, attempt)
+            logger.info("子项请求被限流（HTTP %d），%.1f 秒后重试", reqf.status_code, delay)
+            if stopped is not None:
+                if stopped.wait(delay):
+                    raise CancelledError()
+            else:
+                time.sleep(delay)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("子项响应: %s", reqf.text)
+        try:
+            # 直接解析字节，不经 reqf.text 的编码探测
+            response_data = json.loads(reqf.content)
+        except Exception as e:
+            raise RuntimeError(f"解析API响应失败（HTTP {reqf.status_code}）: {str(e)}") from None
+        if not isinstance(response_data, dict) or 'value' not in response_data:  # 检查实际API响应结构
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("异常响应:\n%s", pformat(response_data))
+            error = response_data.get('error') if isinstance(response_data, dict) else None
+            if isinstance(error, dict):
+                error = error.get('message') or error.get('code')
+            raise RuntimeError(
+                f"无法解析文件列表（HTTP {reqf.status_code}）: {error or '响应中缺少 value 字段'}"
+            )
+        return response_data
+
+    prefetcher = None
+    try:
+        page = fetch(url)
+        while True:
+            next_url = page.get('@odata.nextLink')
+            pending = None
+            if next_url and prefetch:
+                if prefetcher is None:
+                    prefetcher = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix="onedrive-page"
+                    )
+                pending = prefetcher.submit(fetch, next_url)
+            yield page['value']
+            if not next_url:
+                break
+            page = pending.result() if pending is not None else fetch(next_url)
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown(wait=False, cancel_futures=True)
 
-    authHeaderRaw = [
-        {"name": "Accept", "value": "*/*"},
-        {"name": "Accept-Encoding", "value": "gzip, deflate, br, zstd"},
-        {"name": "Accept-Language", "value": "zh-HK,zh-TW;q=0.5"},
-        {"name": "Connection", "value": "keep-alive"},
-        {
-            "name": "Content-Type",
-            "value": "multipart/form-data;boundary={}".format(deviceCode),
-        },
-        {"name": "Host", "value": "my.microsoftpersonalcontent.com"},
-        {"name": "Origin", "value": "https://onedrive.live.com"},
-        {"name": "Referer", "value": "https://onedrive.live.com/"},
-        {"name": "Sec-Fetch-Dest", "value": "empty"},
-        {"name": "Sec-Fetch-Mode", "value": "cors"},
-        {"name": "Sec-Fetch-Site", "value": "cross-site"},
-        {"name": "TE", "value": "trailers"},
-        {
-            "name": "User-Agent",
-            "value": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:135.0) Gecko/20100101 Firefox/135.0",
-        },
-    ]
-
-    authHeader = header
-    # 将authHeaderRaw解析成正常的Header
-    for i in authHeaderRaw:
-        authHeader[i["name"]] = i["value"]
-
-    reqUrl = "https://my.microsoftpersonalcontent.com/_api/v2.0/shares/u!{}/driveitem?%24select=id%2CparentReference".format(
-        redeem
-    )
-    print(reqUrl)
-    authDriverHeader = authHeader
-    authDriverHeader["Authorization"] = "{} {}".format(
-        capitalize(authData["authScheme"]), authData["token"]
-    )
-    authDriverHeader["Prefer"] = "autoredeem"
-    reqf = req.post(
-        reqUrl,
-        data="%24select=id%2CparentReference",
-        headers=authHeader,
-    )
-    print("ok")
 
-    reqUrl = "https://my.microsoftpersonalcontent.com/_api/v2.0/drives/{}/items/{}children?%24top=100&orderby=folder%2Cname&%24expand=thumbnails%2Ctags&select=*%2Cocr%2CwebDavUrl%2CsharepointIds%2CisRestricted%2CcommentSettings%2CspecialFolder%2CcontainingDrivePolicyScenarioViewpoint&ump=1".format(
-        drives.lower(), relativeFolder
-    )
+# 解析后保留的接口原始字段，供本地索引判断文件夹是否变化
+INDEX_ITEM_KEYS = ('id', 'name', 'size', 'eTag', 'cTag')
 
-    print(reqUrl)
-    reqf = req.post(
-        reqUrl,
-        data=postData.encode("utf-8"),
-        headers=authHeader,
-    )
 
-    print(reqf.text)
+def indexItem(item):
+    """只保留本地索引需要的字段，其余原始数据随页面一起释放"""
+    return {key: item[key] for key in INDEX_ITEM_KEYS if key in item}
 
-    # 修复文件数据解析逻辑
-    try:
-        response_data = json.loads(reqf.text)
-        if 'value' in response_data:  # 检查实际API响应结构
-            filesData = response_data['value']
-        else:
-            print("无法解析文件列表，响应结构异常:")
-            pprint(response_data)
-            return []
-    except Exception as e:
-        print(f"解析API响应失败: {str(e)}")
-        return []
 
-    # 添加调试信息
-    print(f"当前层级 {layers} 找到 {len(filesData)} 个项目")
-    if len(filesData) > 0:
-        print("首个项目示例:")
-        pprint(filesData[0])
-        sample_item = filesData[0]
-        print("可用字段列表:", sample_item.keys())
+def iterFolderPages(context, folder_id, layers=0, page_size=DEFAULT_PAGE_SIZE, prefetch=True,
+                    stopped=None):
+    """逐页列出单个文件夹的直接子项
+
+    每解析完一页就产出该页的条目列表，顺序与接口返回一致。每个条目为
+    (kind, value, item)：文件为 ("file", FileRecord, item)，子文件夹为
+    ("folder", 子文件夹ID, item)，item 是接口原始数据中本地索引需要的
+    几个字段（见 indexItem），由调用方决定是否继续深入。stopped 用于
+    中断限流重试的等待，见 iterChildrenPages。
+    """
+    reqUrl = context.childrenUrl(folder_id, page_size)
 
     # 修改文件类型判断逻辑
-    collected_files = []
-    for item in filesData:
-        if 'folder' in item.get('@microsoft.graph.downloadUrl', ''):
-            # 处理文件夹
-            print("\t" * layers, "文件夹:", item.get('name'))
-            sub_query = query.copy()
-            sub_query["id"] = os.path.join(sub_query["id"], item.get('name')).replace("\\", "/")
-            
-            sub_url = "/".join(redirectSplitURL[:-1]) + "/AllItems.aspx?" + urllib.parse.urlencode(sub_query)
-            sub_files = getFiles(sub_url, req, layers + 1)
-            fileCount += len(sub_files)
-            collected_files.extend(sub_files)
+    fileCount = 0
+    for page_no, filesData in enumerate(iterChildrenPages(context, reqUrl, prefetch, stopped)):
+        # 逐个条目的信息只在调试级别输出，每页判断一次
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("当前层级 %d 第 %d 页找到 %d 个项目", layers, page_no + 1, len(filesData))
+            if page_no == 0 and len(filesData) > 0:
+                logger.debug("首个项目示例:\n%s", pformat(filesData[0]))
+                logger.debug("可用字段列表: %s", list(filesData[0].keys()))
+
+        entries = []
+        fetched_at = time.time()
+        for item in filesData:
+            if 'folder' in item.get('@microsoft.graph.downloadUrl', ''):
+                # 处理文件夹
+                if debug:
+                    logger.debug("%s文件夹: %s", "\t" * layers, item.get('name'))
+                entries.append(("folder", context.subFolderId(folder_id, item.get('name')), indexItem(item)))
+            else:
+                # 处理文件
+                file_info = FileRecord(
+                    name=item.get('name'),
+                    size=item.get('size', 0),
+                    raw_url=item.get('@content.downloadUrl', ''),
+                    # 以下字段用于直链过期后按条目ID刷新
+                    id=item.get('id'),
+                    folder=folder_id,
+                    fetched_at=fetched_at,
+                    # 直接下载完成后用于校验（quickXorHash/sha1Hash）
+                    hashes=item.get('file', {}).get('hashes'),
+                )
+                entries.append(("file", file_info, indexItem(item)))
+                if debug:
+                    logger.debug("%s文件[%d]: %s", "\t" * layers, fileCount, item.get('name'))
+                fileCount += 1
+        yield entries
+
+
+class _FolderTask:
+    """遍历树中的一个文件夹节点
+
+    工作线程每解析完一页就追加条目，遍历方边到达边消费，不必等整个
+    文件夹列完。已消费的条目随即出队，内存占用不随文件夹大小累积。
+    """
+
+    def __init__(self, folder_id, layers):
+        self.folder_id = folder_id
+        self.layers = layers
+        # (file_info, None) | (None, 子节点)，保持接口返回的顺序
+        self._entries = deque()
+        self._finished = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def put(self, entries):
+        with self._cond:
+            self._entries.extend(entries)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self._finished = True
+            self._error = error
+            self._cond.notify_all()
+
+    def __iter__(self):
+        while True:
+            with self._cond:
+                while not self._entries and not self._finished:
+                    self._cond.wait()
+                if self._entries:
+                    entry = self._entries.popleft()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield entry
+
+
+class FolderWalker:
+    """并发遍历分享链接的文件夹树
+
+    每解析完一页，其中的子文件夹立即提交到有界线程池，兄弟文件夹因此
+    并行列出，所有请求共用同一个分享上下文（会话和令牌）。结果按深度
+    优先顺序产出，与串行递归的输出顺序一致，且第一页到达即可开始产出。
+
+    传入 index 时，每个列完的文件夹都会写入本地索引；incremental 为 True
+    时，cTag 未变化的子文件夹直接从索引读出，不再发请求。
+    """
+
+    def __init__(self, context, workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE, prefetch=True,
+                 index=None, incremental=False):
+        self.context = context
+        self.workers = max(1, int(workers))
+        self.page_size = clampPageSize(page_size)
+        self.prefetch = prefetch
+        self.index = index
+        self.incremental = incremental and index is not None
+        self._pool = None
+        self._stopped = threading.Event()
+
+    def _submit(self, folder_id, layers):
+        task = _FolderTask(folder_id, layers)
+        try:
+            if self._stopped.is_set():
+                raise RuntimeError("遍历已停止")
+            future = self._pool.submit(self._list, task)
+        except RuntimeError as e:
+            task.finish(e)
+            return task
+        # 线程池关闭时被取消的任务不会运行，需要在这里结束节点
+        future.add_done_callback(
+            lambda f: f.cancelled() and task.finish(CancelledError())
+        )
+        return task
+
+    def _cached(self, folder_id, layers):
+        """从索引读出未变化的子树，不发请求"""
+        logger.debug("%s文件夹未变化，使用索引: %s", "\t" * layers, folder_id)
+        task = _FolderTask(folder_id, layers)
+        entries = []
+        for kind, value in self.index.children(self.context.share_url, folder_id):
+            if kind == "folder":
+                entries.append((None, self._cached(value, layers + 1)))
+            else:
+                entries.append((value, None))
+        task.put(entries)
+        task.finish()
+        return task
+
+    def _list(self, task):
+        listed = []
+        try:
+            pages = iterFolderPages(
+                self.context, task.folder_id, task.layers, self.page_size, self.prefetch,
+                self._stopped
+            )
+            for page in pages:
+                if self._stopped.is_set():
+                    raise CancelledError()
+                entries = []
+                for kind, value, item in page:
+                    if kind != "folder":
+                        entries.append((value, None))
+                    elif self.incremental and self.index.folderUnchanged(
+                        self.context.share_url, value, item
+                    ):
+                        entries.append((None, self._cached(value, task.layers + 1)))
+                    else:
+                        entries.append((None, self._submit(value, task.layers + 1)))
+                task.put(entries)
+                if self.index is not None:
+                    listed.extend(page)
+            if self.index is not None:
+                self.index.saveFolder(self.context.share_url, task.folder_id, listed)
+        except BaseException as e:
+            task.finish(e)
         else:
-            # 处理文件
-            file_info = {
-                "name": item.get('name'),
-                "size": item.get('size', 0),
-                "raw_url": item.get('@content.downloadUrl', '')
-            }
-            collected_files.append(file_info)
-            print("\t" * layers, f"文件[{fileCount}]: {item.get('name')}")
-
-    # 保存文件信息到临时文件
-    with TEMP_JSON_PATH.open('w', encoding='utf-8') as f:
-        json.dump(collected_files, f, indent=4, ensure_ascii=False)
+            task.finish()
+
+    def walk(self, folder_id=None, layers=0):
+        """按深度优先顺序逐个产出文件信息，默认从分享根文件夹开始"""
+        if folder_id is None:
+            folder_id = self.context.rootId
+        self._stopped.clear()
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="onedrive-list"
+        )
+        completed = False
+        try:
+            # 用显式栈代替递归，避免目录过深时超出递归深度
+            stack = [iter(self._submit(folder_id, layers))]
+            while stack:
+                entry = next(stack[-1], None)
+                if entry is None:
+                    stack.pop()
+                    continue
+                file_info, task = entry
+                if task is None:
+                    yield file_info
+                else:
+                    stack.append(iter(task))
+            completed = True
+        finally:
+            self._stopped.set()
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            if self.index is not None:
+                # 只有完整遍历后才更新索引，避免中断时留下不完整的子树
+                if completed:
+                    self.index.prune(self.context.share_url, folder_id)
+                    self.index.commit()
+                else:
+                    self.index.rollback()
+
+
+def iter_files(share_url, req=None, workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE,
+               prefetch=True, layers=0, index=None, incremental=False, metrics=None):
+    """流式获取分享链接中的全部文件
+
+    生成器，每解析完一页就按深度优先顺序产出该页中的文件信息
+    （FileRecord），调用方无需等待整棵目录树列完。
+    提前关闭生成器会停止后续的列目录请求。
+
+    index 为 share_index.ShareIndex 时同步更新本地索引；incremental 为
+    True 时只深入 cTag 变化了的文件夹，其余子树直接取自索引。
+    metrics 用于记录各阶段请求的耗时和流量（见 ShareContext）。
+    """
+    if req is None:
+        # 每个文件夹可能还有一个预取下一页的线程
+        req = newSession(workers * 2 if prefetch else workers)
+
+    # 认证只做一次，整个遍历共用
+    with ShareContext(share_url, req, metrics).resolve() as context:
+        walker = FolderWalker(context, workers, page_size, prefetch, index, incremental)
+        yield from walker.walk(layers=layers)
+
+
+def folderPath(folder_id):
+    """文件夹ID对应的相对分享根目录的路径，根目录为空字符串
+
+    文件夹ID形如 根ID/子文件夹/…，去掉根ID并丢弃 . 和 .. 等不安全的部分。
+    """
+    parts = (folder_id or "").replace("\\", "/").split("/")[1:]
+    return "/".join(part for part in parts if part.strip() not in ("", ".", ".."))
+
+
+def linkExpired(record, ttl=LINK_TTL, margin=LINK_REFRESH_MARGIN, now=None):
+    """记录中的直链是否已经或即将过期"""
+    if now is None:
+        now = time.time()
+    return now >= record.get('fetched_at', 0) + ttl - margin
+
+
+class LinkResolver:
+    """在推送或导出前刷新即将过期的直链
+
+    只处理带条目ID且已临近过期的记录。它们按所在文件夹分组，每个文件夹
+    重新请求一次子项列表（每页最多1000条），再按条目ID取回新直链，无需
+    重新遍历整个分享。同一文件夹中其他条目的新直链会被缓存，后续批次
+    可以直接使用。分享认证只在第一次刷新时进行，之后复用。
+    """
+
+    def __init__(self, share_url, req=None, workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE,
+                 ttl=LINK_TTL, margin=LINK_REFRESH_MARGIN, metrics=None):
+        self.share_url = share_url
+        self.req = req
+        self.metrics = metrics
+        self.workers = max(1, int(workers))
+        self.page_size = page_size
+        self.ttl = ttl
+        self.margin = margin
+        self._context = None
+        # 条目ID -> (直链, 获取时间)
+        self._fresh = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._context is not None:
+            self._context.close()
+            self._context = None
+
+    def stale(self, records):
+        """筛选出需要刷新的记录"""
+        now = time.time()
+        return [
+            r for r in records
+            if r.get('id') and r.get('folder') and linkExpired(r, self.ttl, self.margin, now)
+        ]
+
+    def _relist(self, folder_id):
+        fetched_at = time.time()
+        found = {}
+        url = self._context.childrenUrl(folder_id, self.page_size)
+        for page in iterChildrenPages(self._context, url):
+            for item in page:
+                if item.get('@content.downloadUrl'):
+                    found[item.get('id')] = (item['@content.downloadUrl'], fetched_at)
+        return found
+
+    def refresh(self, records):
+        """就地刷新过期记录的 raw_url 和 fetched_at，返回刷新的条数"""
+        refreshed = 0
+        missing = {}
+        now = time.time()
+        for record in self.stale(records):
+            cached = self._fresh.get(record['id'])
+            if cached and not linkExpired({'fetched_at': cached[1]}, self.ttl, self.margin, now):
+                record['raw_url'], record['fetched_at'] = cached
+                refreshed += 1
+            else:
+                missing.setdefault(record.get('folder'), []).append(record)
+        if not missing:
+            return refreshed
+
+        if self._context is None:
+            req = self.req if self.req is not None else newSession(self.workers)
+            self._context = ShareContext(self.share_url, req, self.metrics).resolve()
+
+        folders = list(missing)
+        with ThreadPoolExecutor(
+            max_workers=min(self.workers, len(folders)), thread_name_prefix="onedrive-link"
+        ) as pool:
+            for found in pool.map(self._relist, folders):
+                self._fresh.update(found)
+
+        for folder_id in folders:
+            for record in missing[folder_id]:
+                cached = self._fresh.get(record['id'])
+                if cached is None:
+                    logger.warning("刷新直链失败，文件可能已被删除: %s", record.get('name'))
+                    continue
+                record['raw_url'], record['fetched_at'] = cached
+                refreshed += 1
+        if refreshed:
+            logger.info("已刷新 %d 个即将过期的直链", refreshed)
+        return refreshed
+
+
+def refresh_links(records, share_url=None, req=None):
+    """刷新记录中即将过期的直链，返回刷新的条数
+
+    未指定分享链接时使用列表缓存中记录的分享链接；两者都没有时不刷新。
+    """
+    share_url = share_url or listing_meta().get('share')
+    if not share_url:
+        return 0
+    with LinkResolver(share_url, req) as resolver:
+        return resolver.refresh(records)
+
+
+def getFiles(originalPath, req=None, layers=0, _id=0, workers=DEFAULT_WORKERS,
+             page_size=DEFAULT_PAGE_SIZE, prefetch=True, incremental=False, on_file=None,
+             metrics=None):
+    """列出分享中的全部文件并写入列表缓存
+
+    on_file(file_info) 在每个文件写入后调用；在其中抛出异常可以中止遍历，
+    此时列表缓存不会写入结束标记。metrics 为 RequestMetrics 时记录各阶段
+    请求的耗时和流量。
+    """
+    collected_files = []
+    # 增量模式下使用本地索引，跳过未变化的文件夹
+    index = ShareIndex() if incremental else None
+    try:
+        # 边遍历边追加到列表缓存，其他进程可以在列完之前开始读取
+        with ListingWriter(meta={"share": originalPath}) as writer:
+            files = iter_files(
+                originalPath, req, workers, page_size, prefetch, layers, index, incremental, metrics
+            )
+            # 逐个文件的信息只在调试级别输出，这里定时输出进度
+            next_progress = time.monotonic() + PROGRESS_INTERVAL
+            try:
+                for file_info in files:
+                    writer.write(file_info)
+                    collected_files.append(file_info)
+                    if on_file is not None:
+                        on_file(file_info)
+                    if time.monotonic() >= next_progress:
+                        logger.info("已获取 %d 个文件", len(collected_files))
+                        next_progress = time.monotonic() + PROGRESS_INTERVAL
+            finally:
+                # 中途退出时立即停止后续的列目录请求
+                files.close()
+    finally:
+        if index is not None:
+            index.close()
+
+    # 列表写完后生成二进制快照，之后读取列表时直接以 mmap 打开
+    try:
+        write_snapshot(collected_files, meta={"share": originalPath})
+    except OSError as e:
+        logger.warning("生成列表快照失败: %s", e)
 
     return collected_files
 
-def get_onedrive_files(share_url=None):
+def get_onedrive_files(share_url=None, workers=DEFAULT_WORKERS, page_size=DEFAULT_PAGE_SIZE,
+                       incremental=False):
     """获取OneDrive文件列表"""
     if not share_url:
         share_url = input("请输入OneDrive分享链接：").strip()
     if not share_url:
-        print("链接不能为空")
+        logger.error("链接不能为空")
         return False
 
     try:
         # 调用getFiles函数处理链接
-        files = getFiles(share_url)
+        files = getFiles(
+            share_url, workers=workers, page_size=page_size, incremental=incremental
+        )
         if files:
-            print(f"成功获取 {len(files)} 个文件")
+            logger.info("成功获取 %d 个文件", len(files))
             return True
         return False
     except Exception as e:
-        print(f"获取文件列表失败: {str(e)}")
+        logger.error("获取文件列表失败: %s", e)
         return False
 
 def main(share_url=None):
     return get_onedrive_files(share_url)
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     main()
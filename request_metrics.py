@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+from urllib3.exceptions import MaxRetryError
+
+# 延迟直方图的桶上限（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_PREFIX = 'onedrive_request'
+
+
+def _bodySize(body):
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    return 0
+
+
+def _retries(response):
+    """urllib3 层自动重试的次数（不含重定向）"""
+    retries = getattr(response.raw, 'retries', None)
+    if retries is None:
+        return 0
+    return sum(1 for entry in retries.history if entry.redirect_location is None)
+
+
+def _exhaustedRetries(session, url, error):
+    """重试用尽后失败的请求已重试的次数"""
+    if not error.args or not isinstance(error.args[0], MaxRetryError):
+        return 0
+    retries = session.get_adapter(url).max_retries
+    return retries.total if isinstance(retries.total, int) else 0
+
+
+class _PhaseStats:
+    __slots__ = ('count', 'errors', 'seconds', 'max_seconds', 'buckets', 'sent', 'received',
+                 'retries', 'redirects', 'statuses')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sent = 0
+        self.received = 0
+        self.retries = 0
+        self.redirects = 0
+        # 状态码（请求异常时为异常类名）-> 次数
+        self.statuses = {}
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 6),
+            'avg_seconds': round(self.seconds / self.count, 6) if self.count else None,
+            'max_seconds': round(self.max_seconds, 6),
+            'buckets': dict(zip([*map(str, LATENCY_BUCKETS), '+Inf'], self.buckets)),
+            'bytes_sent': self.sent,
+            'bytes_received': self.received,
+            'retries': self.retries,
+            'redirects': self.redirects,
+            'statuses': dict(self.statuses),
+        }
+
+
+class RequestMetrics:
+    """按阶段汇总请求的延迟、状态码、流量和重试次数
+
+    列表流程的阶段有 redirect（分享页重定向）、token（令牌）、redeem
+    （autoredeem）和 children（子项分页）。
+
+    ShareContext 等通过 request() 发出请求，每个请求记录一次：耗时计入
+    延迟直方图，状态码、收发字节数、urllib3 的自动重试次数和重定向次数
+    计入计数器。只保存聚合值，内存占用与请求数无关，可被多个线程和多个
+    分享共用。结束时用 write_json() 或 write_prometheus() 导出。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def request(self, session, phase, method, url, **kwargs):
+        """用 session 发出请求并记录，返回响应；请求异常记录后原样抛出"""
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self.observe(phase, time.perf_counter() - started, type(e).__name__,
+                         sent=_bodySize(kwargs.get('data')),
+                         retries=_exhaustedRetries(session, url, e), error=True)
+            raise
+        # 访问 content 会读完响应体，耗时包含下载时间
+        received = len(response.content)
+        self.observe(
+            phase, time.perf_counter() - started, response.status_code,
+            sent=_bodySize(response.request.body), received=received,
+            retries=_retries(response), redirects=len(response.history),
+            error=response.status_code >= 400,
+        )
+        return response
+
+    def observe(self, phase, seconds, status, sent=0, received=0, retries=0, redirects=0, error=False):
+        """记录一次请求"""
+        bucket = len(LATENCY_BUCKETS)
+        for i, limit in enumerate(LATENCY_BUCKETS):
+            if seconds <= limit:
+                bucket = i
+                break
+        status = str(status)
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = self._phases[phase] = _PhaseStats()
+            stats.count += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.buckets[bucket] += 1
+            stats.sent += sent
+            stats.received += received
+            stats.retries += retries
+            stats.redirects += redirects
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def report(self):
+        """各阶段的汇总信息"""
+        with self._lock:
+            phases = {phase: stats.to_dict() for phase, stats in self._phases.items()}
+        return {
+            'started_at': self.started_at,
+            'seconds': round(time.time() - self.started_at, 3),
+            'requests': sum(stats['count'] for stats in phases.values()),
+            'phases': phases,
+        }
+
+    def format_summary(self):
+        """每个阶段一行的文字摘要"""
+        lines = []
+        for phase, stats in self.report()['phases'].items():
+            lines.append(
+                f"{phase}: {stats['count']} 次，失败 {stats['errors']} 次，重试 {stats['retries']} 次，"
+                f"平均 {stats['avg_seconds'] or 0:.3f}s，最长 {stats['max_seconds']:.3f}s，"
+                f"接收 {stats['bytes_received'] / 1024 / 1024:.2f}MB"
+            )
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Prometheus 文本格式"""
+        with self._lock:
+            phases = sorted(self._phases.items())
+            snapshot = [(phase, stats.to_dict(), list(stats.buckets)) for phase, stats in phases]
+        name = METRIC_PREFIX
+        lines = [
+            f"# HELP {name}_duration_seconds Request latency by listing phase.",
+            f"# TYPE {name}_duration_seconds histogram",
+        ]
+        for phase, stats, buckets in snapshot:
+            cumulative = 0
+            for limit, count in zip([*map(str, LATENCY_BUCKETS), '+Inf'], buckets):
+                cumulative += count
+                lines.append(f'{name}_duration_seconds_bucket{{phase="{phase}",le="{limit}"}} {cumulative}')
+            lines.append(f'{name}_duration_seconds_sum{{phase="{phase}"}} {stats["seconds"]}')
+            lines.append(f'{name}_duration_seconds_count{{phase="{phase}"}} {stats["count"]}')
+        lines += [
+            f"# HELP {name}s_total Requests by listing phase and HTTP status.",
+            f"# TYPE {name}s_total counter",
+        ]
+        for phase, stats, _ in snapshot:
+            for status, count in sorted(stats['statuses'].items()):
+                lines.append(f'{name}s_total{{phase="{phase}",status="{status}"}} {count}')
+        for metric, key, help_text in (
+            ('bytes_sent_total', 'bytes_sent', 'Request body bytes sent.'),
+            ('bytes_received_total', 'bytes_received', 'Response body bytes received.'),
+            ('retries_total', 'retries', 'Automatic retries made by the connection pool.'),
+            ('redirects_total', 'redirects', 'Redirects followed.'),
+        ):
+            lines += [f"# HELP {name}_{metric} {help_text}", f"# TYPE {name}_{metric} counter"]
+            for phase, stats, _ in snapshot:
+                lines.append(f'{name}_{metric}{{phase="{phase}"}} {stats[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        _writeAtomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path):
+        """写出 Prometheus 文本文件，供 node_exporter 的 textfile 收集器读取"""
+        _writeAtomic(path, self.prometheus())
+
+    def write(self, path):
+        """按扩展名导出：.prom 为 Prometheus 文本格式，其他为JSON"""
+        if str(path).endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_json(path)
+
+
+def _writeAtomic(path, text):
+    # 先写临时文件再替换，收集器不会读到写了一半的文件
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(tmp_path, path)
@@ -1,15 +1,27 @@
 import os
 import json
+import logging
 import requests
 from urllib.parse import urlparse
 import sys
 from pathlib import Path
 
+from aria2_pool import Aria2Pool
+from aria2_rpc import RPC_TIMEOUT, build_add_uri, check_rpc
+from aria2_scheduler import DEFAULT_POLICY, SubmissionScheduler
+from aria2_status import PollerGroup, format_summary
+from file_index import FileIndex, QUERY_HELP
+from listing_cache import LISTING_PATH, listing_meta
+from listing_snapshot import open_listing
+from onedrive_downloader import REFRESH_BATCH, LinkResolver
+from direct_downloader import DOWNLOAD_DIR, download_files
+
+logger = logging.getLogger(__name__)
+
 # 定义缓存目录（在程序运行目录下）
 CACHE_DIR = Path('.onedrive_downloader')
 CONFIG_FILE = CACHE_DIR / 'aria2_config.json'
 INPUT_FILE = CACHE_DIR / 'result.txt'
-TEMP_JSON_PATH = CACHE_DIR / 'tmp.json'
 
 def load_config():
     """加载配置文件"""
@@ -31,6 +43,19 @@ def save_config(config):
     with CONFIG_FILE.open('w', encoding='utf-8') as f:
         json.dump(config, f, indent=2, ensure_ascii=False)
 
+def with_rpc(saved_config, rpc_url, secret):
+    """在已保存的配置上换成新的RPC地址和密码，保留分段档位、文件夹结构等其他设置
+
+    RPC地址改动后，配置中的多端点列表和分配策略不再适用，一并去掉。
+    """
+    config = dict(saved_config or {})
+    if config.get('rpc') != rpc_url:
+        config.pop('endpoints', None)
+        config.pop('policy', None)
+    config['rpc'] = rpc_url
+    config['secret'] = secret
+    return config
+
 def get_aria2_config():
     """获取配置信息"""
     saved_config = load_config()
@@ -39,6 +64,11 @@ def get_aria2_config():
         print(f"\n当前Aria2配置：")
         print(f"RPC地址: {saved_config['rpc']}")
         print(f"RPC密码: {saved_config['secret']}")
+        if saved_config.get('endpoints'):
+            # 多个aria2端点时按分配策略分发任务
+            print(f"分配策略: {saved_config.get('policy', 'least_bytes')}")
+            for endpoint in saved_config['endpoints']:
+                print(f"· 端点: {endpoint['rpc']} 权重: {endpoint.get('weight', 1)}")
         if input("是否使用当前配置？(y/n, 默认y): ").lower() in ('', 'y'):
             return saved_config
     
@@ -58,10 +88,7 @@ def get_aria2_config():
         # 地址格式正确，退出循环
         break
     
-    config = {
-        'rpc': rpc_url,
-        'secret': input("密码 (默认空): ") or ""
-    }
+    config = with_rpc(saved_config, rpc_url, input("密码 (默认空): ") or "")
     
     # 保存配置提示
     if input("是否保存Aria2配置以便下次使用？(y/n): ").lower() == 'y':
@@ -87,35 +114,53 @@ def parse_downloads():
     """解析下载列表"""
     downloads = []
     
-    if not TEMP_JSON_PATH.exists():
+    if not LISTING_PATH.exists():
         print("错误：下载列表文件不存在")
         print(f"请先运行前面的步骤生成下载列表")
         input("按任意键退出...")
         return []
 
     try:
-        with TEMP_JSON_PATH.open('r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        for idx, item in enumerate(data):
-            name = item['name'].strip()
-            url = item['raw_url'].strip()
-            size = item['size']
-            downloads.append((idx, name, url, size))
+        # 有最新的列表快照时直接读取，无需重新解析整个列表
+        with open_listing() as data:
+            for idx, item in enumerate(data):
+                name = item['name'].strip()
+                url = item['raw_url'].strip()
+                size = item['size']
+                # 保留原始记录，推送或导出前据此刷新过期直链
+                downloads.append((idx, name, url, size, item))
         
         return downloads
     except Exception as e:
         print(f"解析下载列表失败: {str(e)}")
         return []
 
+def print_downloads(downloads):
+    for idx, name, *_ in downloads:
+        print(f"[{idx:2d}] {name}")
+
 def select_files(downloads):
-    """交互式选择文件"""
+    """交互式选择文件，可先按名称、扩展名、大小或路径筛选列表"""
+    index = FileIndex([item for *_, item in downloads])
+    shown = downloads
+    
     print("\n可用文件列表：")
-    for idx, name, _, _ in downloads:
-        print(f"[{idx:2d}] {name}")
+    print_downloads(shown)
+    print(f"\n输入 /查询 可筛选列表，查询语法：{QUERY_HELP}")
     
     while True:
-        selection = input("\n请输入要下载的序号（支持格式：1 / 2-5 / 1,3,5-7）：")
+        selection = input("\n请输入要下载的序号（支持格式：1 / 2-5 / 1,3,5-7，a 选择当前列出的全部）：").strip()
+        if selection.startswith('/'):
+            try:
+                shown = [downloads[i] for i in index.query(selection[1:])]
+            except ValueError as e:
+                print(f"查询格式错误: {str(e)}")
+                continue
+            print_downloads(shown)
+            print(f"共列出 {len(shown)} 个文件")
+            continue
+        if selection.lower() == 'a':
+            return list(shown)
         try:
             selected = set()
             # 处理不同格式输入
@@ -138,37 +183,28 @@ def select_files(downloads):
         except ValueError:
             print("输入格式错误，请按示例格式输入")
 
+def refresh_downloads(selected, resolver):
+    """刷新所选文件中即将过期的直链，返回更新后的下载列表"""
+    if resolver is not None:
+        try:
+            resolver.refresh([item for *_, item in selected])
+        except Exception as e:
+            logger.warning("刷新直链失败，将使用原有直链: %s", e)
+    return [
+        (idx, name, item['raw_url'].strip(), size, item)
+        for idx, name, _, size, item in selected
+    ]
+
 def send_to_aria2(filename, url, config, test_connection=False):
     """发送下载任务到aria2"""
     try:
         server_url = config['rpc']
         secret = config['secret']
         
-        # 检查RPC地址格式
-        if not server_url.startswith(('http://', 'https://')):
-            return {'error': {'message': 'RPC地址格式错误，必须以http://或https://开头，以/jsonrpc结尾'}}
-        if not server_url.endswith('/jsonrpc'):
-            return {'error': {'message': 'RPC地址格式错误，必须以/jsonrpc结尾'}}
-        
-        # 尝试发送一个不带token的测试请求
-        test_data = {
-            'jsonrpc': '2.0',
-            'method': 'aria2.getVersion',
-            'id': 1,
-            'params': []
-        }
-        try:
-            test_response = requests.post(server_url, json=test_data, timeout=5)
-            test_result = test_response.json()
-            if 'error' in test_result and 'Unauthorized' in str(test_result.get('error', {}).get('message', '')):
-                if not secret:
-                    return {'error': {'message': '服务端需要密码验证'}}
-        except requests.exceptions.ConnectionError:
-            return {'error': {'message': 'RPC地址错误或Aria2未启动，请检查：\n1. RPC地址是否正确\n2. Aria2是否已启动'}}
-        except requests.exceptions.Timeout:
-            return {'error': {'message': 'RPC地址连接超时，请检查地址是否正确'}}
-        except Exception:
-            pass  # 忽略其他错误，继续执行
+        # 检查RPC地址格式和连通性
+        error_msg = check_rpc(config)
+        if error_msg:
+            return {'error': {'message': error_msg}}
         
         # 构建请求数据
         if test_connection:
@@ -186,13 +222,11 @@ def send_to_aria2(filename, url, config, test_connection=False):
                 'jsonrpc': '2.0',
                 'method': 'aria2.addUri',
                 'id': 1,
-                'params': [[url], {'out': filename}]
+                'params': build_add_uri(filename, url, config)
             }
-            if secret:
-                data['params'].insert(0, f'token:{secret}')
         
         # 发送请求
-        response = requests.post(server_url, json=data)
+        response = requests.post(server_url, json=data, timeout=RPC_TIMEOUT)
         result = response.json()
         
         # 检查密码错误
@@ -205,22 +239,51 @@ def send_to_aria2(filename, url, config, test_connection=False):
     except Exception as e:
         return {'error': {'message': str(e)}}
 
+def watch_progress(pushed):
+    """轮询并显示已推送任务的下载进度，直到全部结束或按 Ctrl+C
+
+    pushed 为 [(端点配置, GID)]，任务可以分布在多个aria2端点上。
+    """
+
+    poller = PollerGroup()
+    for endpoint, gid in pushed:
+        poller.track([gid], endpoint)
+
+    def show(summary):
+        print(f"\r{format_summary(summary)}    ", end='', flush=True)
+
+    try:
+        summary = poller.run(show)
+        print()
+        if summary and summary['errors']:
+            print("\n下载失败详情：")
+            for gid, error in summary['errors'].items():
+                print(f"· 任务ID {gid}: {error}")
+    except KeyboardInterrupt:
+        print("\n已停止显示进度，下载仍在Aria2中继续")
+    except Exception as e:
+        print(f"\n获取下载进度失败: {str(e)}")
+    finally:
+        poller.close()
+
 def main():
-    # 获取配置
-    config = get_aria2_config()
-    
     downloads = parse_downloads()
     if not downloads:
         print("没有找到有效的文件")
         input("按任意键退出...")
         return
     
+    # 直链约1小时过期，推送或导出前按需刷新
+    share_url = listing_meta().get('share')
+    resolver = LinkResolver(share_url) if share_url else None
+
     # 全量下载提示
     print(f"\n找到 {len(downloads)} 个文件")
     print("\n请选择操作：")
     print("1. 推送到Aria2")
     print("2. 导出直链")
-    choice = input("请输入选项(1/2): ").strip()
+    print("3. 直接下载（无需Aria2）")
+    choice = input("请输入选项(1/2/3): ").strip()
     
     if choice == '2':
         # 导出直链功能
@@ -235,9 +298,12 @@ def main():
             input("按任意键退出...")
             return
         
+        selected = refresh_downloads(selected, resolver)
+        if resolver is not None:
+            resolver.close()
         try:
             with open('直链.txt', 'w', encoding='utf-8') as f:
-                for idx, name, url, size in selected:
+                for idx, name, url, size, _ in selected:
                     size_mb = size / 1024 / 1024
                     f.write(f"文件名：{name}\n")
                     f.write(f"大小：{size_mb:.2f}MB\n")
@@ -253,6 +319,36 @@ def main():
         
         input("\n按回车键退出程序...")
         return
+
+    if choice == '3':
+        # 内置多连接下载
+        download_choice = input("\n是否下载全部文件？(y/n, 默认n): ").strip().lower()
+        if download_choice == 'y':
+            selected = downloads
+        else:
+            selected = select_files(downloads)
+
+        if not selected:
+            print("未选择任何文件")
+            input("按任意键退出...")
+            return
+
+        success, fail_list = download_files(
+            [item for *_, item in selected], resolver=resolver
+        )
+        if resolver is not None:
+            resolver.close()
+        print(f"\n下载汇总：成功 {success} 个，失败 {len(fail_list)} 个")
+        print(f"保存位置：{os.path.abspath(DOWNLOAD_DIR)}")
+        if fail_list:
+            print("\n下载失败详情：")
+            for name, error in fail_list:
+                print(f"· {name}: {error}")
+        input("\n按回车键退出程序...")
+        return
+
+    # 获取配置
+    config = get_aria2_config()
     
     # 推送到Aria2功能
     push_choice = input("\n是否推送全部文件到Aria2？(y/n, 默认n): ").strip().lower()
@@ -266,28 +362,65 @@ def main():
         input("按任意键退出...")
         return
     
+    # 推送顺序，默认使用配置文件中的 schedule
+    policies = {'1': 'listing', '2': 'smallest', '3': 'largest', '4': 'interleave'}
+    print("\n请选择推送顺序：")
+    print("1. 列表顺序")
+    print("2. 小文件优先（尽快完成更多文件）")
+    print("3. 大文件优先（缩短总下载时间）")
+    print("4. 大小文件交错")
+    policy = policies.get(
+        input("请输入选项(1/2/3/4, 默认按配置): ").strip(), config.get('schedule', DEFAULT_POLICY)
+    )
+    hold_back = input(
+        "\n是否按直链有效期控制推送节奏？(开启后根据下载速度暂缓推送，需保持程序运行直到推送完成)(y/n, 默认n): "
+    ).strip().lower() == 'y'
+    
     success = 0
     fail = 0
     fail_list = []
+    pushed = []
     
-    for idx, name, url, size in selected:
-        print(f"\n正在推送到Aria2({idx}/{len(downloads)}): {name}")
-        result = send_to_aria2(name, url, config)
-        
+    # 分批推送，每批推送前刷新其中即将过期的直链
+    pool = Aria2Pool(config)
+    error_msg = pool.check()
+    if error_msg:
+        print(f"推送失败 | 错误信息: {error_msg}")
+        fail_list = [(name, error_msg) for _, name, *_ in selected]
+        fail = len(fail_list)
+        selected = []
+
+    def on_result(record, result):
+        nonlocal success, fail
+        name = record['name'].strip()
         if 'result' in result:
-            print(f"推送成功 | 任务ID: {result['result']}")
+            logger.debug("推送成功 | %s | 任务ID: %s", name, result['result'])
+            pushed.append((result['endpoint'], result['result']))
             success +=1
         else:
             error_msg = result.get('error', '未知错误')
-            print(f"推送失败 | 错误信息: {error_msg}")
+            logger.warning("推送失败 | %s | 错误信息: %s", name, error_msg)
             fail_list.append((name, error_msg))
             fail +=1
+
+    scheduler = SubmissionScheduler(pool, policy, resolver, hold_back, wave_size=REFRESH_BATCH)
+    try:
+        scheduler.submit([item for *_, item in selected], on_result)
+    except KeyboardInterrupt:
+        print("\n已停止推送，已推送的任务仍在Aria2中继续")
+    scheduler.close()
+    if resolver is not None:
+        resolver.close()
     
     print(f"\n推送汇总：成功 {success} 个，失败 {fail} 个")
     if fail_list:
         print("\n推送失败详情：")
         for name, error in fail_list:
             print(f"· {name}: {error}")
+
+    pool.close()
+    if pushed and input("\n是否等待并显示下载进度？(y/n, 默认n): ").strip().lower() == 'y':
+        watch_progress(pushed)
     
     # 如果有成功推送的文件，询问是否保存配置
     if success > 0:
@@ -305,4 +438,6 @@ def main():
         input("\n按回车键退出程序...")
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     main() 
\ No newline at end of file
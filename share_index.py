@@ -0,0 +1,157 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from listing_cache import FileRecord
+
+# 定义缓存目录（在程序运行目录下）
+CACHE_DIR = Path('.onedrive_downloader')
+INDEX_PATH = CACHE_DIR / 'index.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    share TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    is_folder INTEGER NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    etag TEXT,
+    ctag TEXT,
+    raw_url TEXT,
+    fetched_at REAL NOT NULL DEFAULT 0,
+    hashes TEXT,
+    PRIMARY KEY (share, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_parent ON items (share, parent, position);
+"""
+
+
+def itemTag(item):
+    """文件夹内容变化的标记，优先使用cTag，缺失时退回eTag"""
+    return item.get('cTag') or item.get('eTag')
+
+
+class ShareIndex:
+    """分享链接目录树的本地索引（SQLite）
+
+    以 (分享链接, 条目ID) 为键保存名称、路径、大小、eTag/cTag 和父文件夹。
+    增量重新列出时，cTag 与路径都未变化的文件夹直接从索引读出整棵子树，
+    不再发请求。一次遍历的所有写入在同一个事务中，遍历中途失败时回滚，
+    不会留下半新半旧的索引。
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 遍历的工作线程会并发访问，统一由锁串行化
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        # 兼容缺少后加字段的旧索引
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(items)")]
+        if 'fetched_at' not in columns:
+            self._conn.execute("ALTER TABLE items ADD COLUMN fetched_at REAL NOT NULL DEFAULT 0")
+        if 'hashes' not in columns:
+            self._conn.execute("ALTER TABLE items ADD COLUMN hashes TEXT")
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+    def folderUnchanged(self, share, folder_id, item):
+        """文件夹自上次索引以来是否没有变化"""
+        tag = itemTag(item)
+        if not tag:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ctag, path FROM items WHERE share = ? AND item_id = ? AND is_folder = 1",
+                (share, item.get('id') or folder_id),
+            ).fetchone()
+        return row is not None and row == (tag, folder_id)
+
+    def saveFolder(self, share, folder_id, entries):
+        """用一次完整列出的结果替换文件夹的直接子项
+
+        entries 为 [(kind, value, item)]，kind 为 "file" 或 "folder"，
+        文件的 value 是文件信息，文件夹的 value 是子文件夹ID。
+        """
+        rows = []
+        for position, (kind, value, item) in enumerate(entries):
+            if kind == "folder":
+                path, size, raw_url, fetched_at = value, item.get('size', 0), None, 0
+                hashes = None
+            else:
+                path = folder_id + "/" + value["name"]
+                size, raw_url, fetched_at = value["size"], value["raw_url"], value["fetched_at"]
+                hashes = json.dumps(value.get("hashes") or {})
+            rows.append((
+                share, item.get('id') or path, folder_id, position, item.get('name'),
+                path, kind == "folder", size or 0, item.get('eTag'), itemTag(item), raw_url,
+                fetched_at, hashes,
+            ))
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM items WHERE share = ? AND parent = ?", (share, folder_id)
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO items "
+                "(share, item_id, parent, position, name, path, is_folder, size, etag, ctag, raw_url, "
+                "fetched_at, hashes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def children(self, share, folder_id):
+        """按原列出顺序返回文件夹的直接子项 [(kind, value)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_id, is_folder, name, path, size, raw_url, fetched_at, hashes FROM items "
+                "WHERE share = ? AND parent = ? ORDER BY position",
+                (share, folder_id),
+            ).fetchall()
+        entries = []
+        for item_id, is_folder, name, path, size, raw_url, fetched_at, hashes in rows:
+            if is_folder:
+                entries.append(("folder", path))
+            else:
+                entries.append(("file", FileRecord(
+                    name=name,
+                    size=size,
+                    raw_url=raw_url or "",
+                    id=item_id,
+                    folder=folder_id,
+                    fetched_at=fetched_at,
+                    hashes=json.loads(hashes) if hashes else None,
+                )))
+        return entries
+
+    def prune(self, share, root_id):
+        """删除父文件夹已不存在的孤立条目"""
+        with self._lock:
+            while True:
+                cursor = self._conn.execute(
+                    "DELETE FROM items WHERE share = ? AND parent != ? AND parent NOT IN "
+                    "(SELECT path FROM items WHERE share = ? AND is_folder = 1)",
+                    (share, root_id, share),
+                )
+                if cursor.rowcount == 0:
+                    break